@@ -0,0 +1,51 @@
+# -*- coding: UTF-8 -*-
+from __future__ import print_function
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-02"
+# Created: 2016-05-02 10:12
+""" Micro benchmarks for the APP implementation """
+
+import logging
+import timeit
+
+
+logger = logging.getLogger(__name__)
+
+
+def measure(func, number=10000, repeat=3):
+    """
+    Time a callable (best of repeat)
+
+    :param func: Function to time (called without arguments)
+    :type func: () -> object
+    :param number: Calls per repetition (default: 10000)
+    :type number: int
+    :param repeat: Number of repetitions (default: 3)
+    :type repeat: int
+    :return: Best time per call in microseconds
+    :rtype: float
+    """
+    timer = timeit.Timer(func)
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+
+def report(name, micros, baseline=None):
+    """
+    Print a benchmark result
+
+    :param name: Name of benchmark
+    :type name: str | unicode
+    :param micros: Time per call in microseconds
+    :type micros: float
+    :param baseline: Time per call of the reference (default: None)
+    :type baseline: None | float
+    :rtype: None
+    """
+    line = u"{:<40} {:>10.2f} us".format(name, micros)
+    if baseline:
+        line += u"  (x{:.2f})".format(baseline / micros)
+    print(line)
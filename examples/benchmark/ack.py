@@ -0,0 +1,70 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-06"
+# Created: 2016-05-06 09:45
+"""
+Benchmark creating and packing ACK messages
+
+Run from the repository root: python -m examples.benchmark.ack
+"""
+
+import datetime
+import time
+
+import pytz
+
+from paps.si.app.message import APPMessage, MsgType
+
+from examples.benchmark import report
+
+
+def legacy_stamp(header):
+    """ Set timestamp with datetime/pytz (reference implementation) """
+    header.timestamp = pytz.UTC.localize(datetime.datetime.utcnow())
+
+
+def pack_acks(number, legacy=False):
+    """
+    Create and pack ACK messages
+
+    :param number: Number of ACKs
+    :type number: int
+    :param legacy: Stamp like before - at creation and pack (default: False)
+    :type legacy: bool
+    :return: Seconds needed
+    :rtype: float
+    """
+    start = time.time()
+    for seq in range(number):
+        packet = APPMessage(message_type=MsgType.ACK, device_id=2)
+        packet.header.ack_sequence_number = seq
+        if legacy:
+            legacy_stamp(packet.header)
+            legacy_stamp(packet.header)
+            packet.pack()
+        else:
+            packet.pack(update_timestamp=True)
+    return time.time() - start
+
+
+def main(number=100000):
+    base = min(pack_acks(number, True) for _ in range(3)) / number * 1e6
+    print("{} ACKs - time per ACK".format(number))
+    report("create + pack ACK (datetime/pytz)", base)
+    report(
+        "create + pack ACK (time.time)",
+        min(pack_acks(number) for _ in range(3)) / number * 1e6, base
+    )
+
+
+if __name__ == "__main__":
+    main()
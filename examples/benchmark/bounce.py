@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-17"
+# Created: 2016-05-17 14:20
+"""
+Count UPDATEs a client sends for a bouncing detector
+
+Every 1 ms the detector reports all people, a real change happens every
+200 ms and bounces for 10 ms.
+
+Run from the repository root: python -m examples.benchmark.bounce
+"""
+
+import time
+
+from paps import Person
+from paps.si.app.sensorClient import SensorClient
+
+
+def run(settings, seconds=2.0, seats=8):
+    """
+    Feed bouncing detector states to a client
+
+    :return: Number of calls and number of sent UPDATEs
+    :rtype: (int, int)
+    """
+    settings.update({
+        'listen_bind_ip': "127.0.0.1",
+        'multicast_bind_ip': "127.0.0.1",
+        'listen_port': 0,
+    })
+    client = SensorClient(settings)
+    client.start()
+    # Nobody listening - only count
+    client._server_ip = "127.0.0.1"
+    client._server_port = client._listen_socket.getsockname()[1] + 1
+    client._joined.set()
+    sent = [0]
+    send_packet = client._send_packet
+
+    def count(ip, port, packet, **kwargs):
+        sent[0] += 1
+        send_packet(ip, port, packet, **kwargs)
+
+    client._send_packet = count
+    calls = 0
+    start = time.time()
+    try:
+        while True:
+            elapsed = time.time() - start
+            if elapsed >= seconds:
+                break
+            state = int(elapsed / 0.2) % 2 == 1
+            since_change = elapsed % 0.2
+            if since_change < 0.01:
+                # Bouncing
+                state ^= int(since_change * 1000) % 2 == 1
+            client.person_update([Person(sitting=state) for _ in range(seats)])
+            calls += 1
+            time.sleep(0.001)
+        # Pending state/keepalive
+        time.sleep(0.1)
+    finally:
+        client._joined.clear()
+        client.stop()
+    return calls, sent[0]
+
+
+def main():
+    for name, settings in (
+        ("every call", {
+            'update_suppress_duplicates': False, 'update_keepalive': 0
+        }),
+        ("changes only", {'update_keepalive': 0}),
+        ("changes, max 20/s, keepalive 1 s", {
+            'update_min_interval': 0.05, 'update_keepalive': 1.0
+        }),
+    ):
+        calls, sent = run(settings)
+        print("{:<36} {:>5} calls -> {:>5} UPDATEs".format(name, calls, sent))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-09"
+# Created: 2016-05-09 15:20
+"""
+Benchmark sending ACKs/UPDATEs with and without coalescing (localhost)
+
+Run from the repository root: python -m examples.benchmark.coalesce
+"""
+
+import socket
+import time
+
+from paps import Person
+from paps.si.app.message import APPMessage, APPUpdateMessage, MsgType
+from paps.si.app.sensor import Sensor
+
+from examples.benchmark import report
+
+
+class CountingSensor(Sensor):
+    """ Sensor counting sent datagrams """
+
+    def __init__(self, settings=None):
+        super(CountingSensor, self).__init__(settings)
+        self.datagrams = 0
+
+    def _send(self, ip, port, data):
+        self.datagrams += 1
+        return super(CountingSensor, self)._send(ip, port, data)
+
+
+def burst(sensor, peers, number):
+    """
+    Send ACKs and UPDATEs round robin to peers
+
+    :return: Seconds needed
+    :rtype: float
+    """
+    start = time.time()
+    for i in range(number):
+        ip, port = peers[i % len(peers)]
+        if i % 2:
+            packet = APPMessage(message_type=MsgType.ACK)
+            packet.header.ack_sequence_number = i
+        else:
+            packet = APPUpdateMessage(people=[Person(sitting=True)] * 20)
+        sensor._send_packet(ip, port, packet, acknowledge_packet=False)
+    sensor._flush_coalesced()
+    return time.time() - start
+
+
+def main(number=20000, num_peers=20):
+    receivers = []
+    for _ in range(num_peers):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.bind(("127.0.0.1", 0))
+        receivers.append(sock)
+    peers = [sock.getsockname() for sock in receivers]
+    print("{} messages to {} peers".format(number, num_peers))
+    base = None
+    for window in (0, 0.005):
+        sensor = CountingSensor({
+            'listen_bind_ip': "127.0.0.1",
+            'multicast_bind_ip': "127.0.0.1",
+            'listen_port': 0,
+            'coalesce_window': window,
+        })
+        sensor._init_listen_socket()
+        try:
+            micros = burst(sensor, peers, number) / number * 1e6
+        finally:
+            sensor._shutdown_listen_socket()
+        report(
+            "window {}s: {} datagrams".format(window, sensor.datagrams),
+            micros, base
+        )
+        base = base or micros
+    for sock in receivers:
+        sock.close()
+
+
+if __name__ == "__main__":
+    main()
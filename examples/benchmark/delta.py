@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-18"
+# Created: 2016-05-18 11:00
+"""
+Measure bytes sent for UPDATEs and DELTAs of a large device where one
+person changes at a time (server and client over loopback)
+
+Run from the repository root: python -m examples.benchmark.delta
+"""
+
+import random
+import time
+
+from paps import Person
+from paps.changeInterface import ChangeInterface
+from paps.si.app.sensorClient import SensorClient
+from paps.si.app.sensorServer import SensorServer
+
+
+class StateChanger(ChangeInterface):
+    """ Keep sitting state of people """
+
+    def __init__(self):
+        super(StateChanger, self).__init__()
+        self.sitting = {}
+
+    def on_person_new(self, people):
+        for person in people:
+            self.sitting[person.id] = person.sitting
+
+    def on_person_update(self, people):
+        for person in people:
+            self.sitting[person.id] = person.sitting
+
+    def on_person_leave(self, people):
+        pass
+
+
+def run(delta, seats, updates):
+    """
+    Send updates changing one person each
+
+    :return: Bytes sent by client, does server state match
+    :rtype: (int, bool)
+    """
+    changer = StateChanger()
+    server = SensorServer({
+        'changer': changer,
+        'listen_bind_ip': "127.0.0.1",
+        'listen_port': 0,
+        'multicast_bind_ip': "127.0.0.1",
+        'multicast_bind_port': 0,
+        # Join of many people
+        'receive_buffer_size': 65507,
+    })
+    server.start()
+    client = SensorClient({
+        'listen_bind_ip': "127.0.0.1",
+        'listen_port': 0,
+        'multicast_bind_ip': "127.0.0.1",
+        'multicast_group': "127.0.0.1",
+        'multicast_port': server._listen_socket.getsockname()[1],
+        'update_delta': delta,
+        'update_keepalive': 0,
+    })
+    client.start()
+    people = [Person(id=index) for index in range(seats)]
+    sent = [0]
+    try:
+        client.join(people)
+        send = client._send
+
+        def count(ip, port, data):
+            sent[0] += len(data)
+            return send(ip, port, data)
+
+        client._send = count
+        rand = random.Random(1)
+        for _ in range(updates):
+            index = rand.randrange(seats)
+            people[index] = Person(
+                id=index, sitting=not people[index].sitting
+            )
+            client.person_update(people)
+            time.sleep(0.002)
+        time.sleep(0.1)
+        client._send = send
+        device_id = client._device_id
+        match = all(
+            changer.sitting[u"{}.{}".format(device_id, person.id)]
+            == person.sitting
+            for person in people
+        )
+    finally:
+        client.stop()
+        server.stop()
+    return sent[0], match
+
+
+def main(seats=1000, updates=500):
+    print("{} seats, {} updates changing one person".format(seats, updates))
+    base = None
+    for name, delta in (("UPDATE", False), ("DELTA", True)):
+        sent, match = run(delta, seats, updates)
+        line = "  {:<8} {:>8} bytes ({:>6.1f} per update)".format(
+            name, sent, sent / updates
+        )
+        if base:
+            line += "  (x{:.1f})".format(base / sent)
+        else:
+            base = sent
+        print(line + ("" if match else "  SERVER STATE DIFFERS"))
+
+
+if __name__ == "__main__":
+    main()
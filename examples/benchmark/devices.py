@@ -0,0 +1,81 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-16"
+# Created: 2016-05-16 10:40
+"""
+Benchmark device id allocation and address checks with many registered
+devices
+
+Run from the repository root: python -m examples.benchmark.devices
+"""
+
+from paps.si.app.deviceIdAllocator import DeviceIdAllocator
+
+from examples.benchmark import measure, report
+
+
+def legacy_new_device_id(clients, key2device_id, key):
+    """ Linear probe for a free id (reference implementation) """
+    device_id = 2
+    if key in key2device_id:
+        return key2device_id[key]
+    while device_id in clients:
+        device_id += 1
+    return device_id
+
+
+def main(devices=50000):
+    addresses = [
+        ("10.0.{}.{}".format(i // 256, i % 256), 2346)
+        for i in range(devices)
+    ]
+    ids = DeviceIdAllocator()
+    clients = {}
+    key2device_id = {}
+    address2device_id = {}
+    for ip, port in addresses:
+        device_id = ids.allocate()
+        key = "{}:{}".format(ip, port)
+        clients[device_id] = {'key': key, 'address': (ip, port)}
+        key2device_id[key] = device_id
+        address2device_id[(ip, port)] = device_id
+    # Free an id in the middle
+    freed = devices // 2
+    del clients[freed]
+    ids.release(freed)
+
+    def legacy_allocate():
+        legacy_new_device_id(clients, key2device_id, "10.1.0.0:2346")
+
+    def allocate():
+        ids.release(ids.allocate())
+
+    base = measure(legacy_allocate, number=100)
+    report("allocate id (linear probe)", base)
+    report("allocate id (DeviceIdAllocator)", measure(allocate), base)
+
+    client = clients[2]
+    ip, port = addresses[0]
+
+    def legacy_check():
+        return client['key'] != "{}:{}".format(ip, port)
+
+    def check():
+        return client['address'] != (ip, port)
+
+    base = measure(legacy_check, number=100000)
+    report("check address (key string)", base)
+    report("check address (tuple)", measure(check, number=100000), base)
+
+
+if __name__ == "__main__":
+    main()
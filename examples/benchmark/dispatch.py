@@ -0,0 +1,106 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-13"
+# Created: 2016-05-13 09:40
+"""
+Benchmark UPDATE echo round trips over loopback with queued and inline
+packet dispatch
+
+Run from the repository root: python -m examples.benchmark.dispatch
+(examples/measure/main.py --echo --dispatch inline for two machines)
+"""
+
+import threading
+import time
+
+from paps import Person
+from paps.si.app.message import MsgType, APPUpdateMessage
+from paps.si.app.sensor import Sensor
+from paps.si.app.sensorClient import SensorClient
+
+
+class EchoSensor(SensorClient):
+    """ Echo UPDATEs back or signal received echos """
+
+    def __init__(self, settings=None):
+        super(EchoSensor, self).__init__(settings)
+        self.echo = settings.get('echo', False)
+        self.echoed = threading.Event()
+
+    def _do_packet(self, packet, ip, port):
+        if packet.header.message_type != MsgType.UPDATE:
+            return
+        if self.echo:
+            self._send_packet(
+                ip, port, packet,
+                update_timestamp=False, acknowledge_packet=False
+            )
+        else:
+            self.echoed.set()
+
+    def stop(self):
+        # Not joined - skip leaving
+        Sensor.stop(self)
+
+
+def create(dispatch_mode, echo):
+    return EchoSensor({
+        'listen_bind_ip': "127.0.0.1",
+        'multicast_bind_ip': "127.0.0.1",
+        'listen_port': 0,
+        'retransmit_timeout': 0.1,
+        'dispatch_mode': dispatch_mode,
+        'echo': echo,
+    })
+
+
+def round_trips(dispatch_mode, number=2000):
+    """
+    Measure echo round trips
+
+    :return: Round trip times in microseconds (sorted)
+    :rtype: list[float]
+    """
+    echo = create(dispatch_mode, True)
+    pinger = create(dispatch_mode, False)
+    echo.start()
+    pinger.start()
+    port = echo._listen_socket.getsockname()[1]
+    packet = APPUpdateMessage(people=[Person(sitting=True) for _ in range(3)])
+    res = []
+    try:
+        for _ in range(number):
+            pinger.echoed.clear()
+            start = time.time()
+            pinger._send_packet(
+                "127.0.0.1", port, packet, acknowledge_packet=False
+            )
+            if not pinger.echoed.wait(1.0):
+                continue
+            res.append((time.time() - start) * 1e6)
+    finally:
+        pinger.stop()
+        echo.stop()
+    res.sort()
+    return res
+
+
+def main():
+    for mode in ("queue", "inline"):
+        res = round_trips(mode)
+        print("{:<8} median {:>8.1f} us  p99 {:>8.1f} us  ({} echos)".format(
+            mode, res[len(res) // 2], res[int(len(res) * 0.99)], len(res)
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-18"
+# Created: 2016-05-18 10:20
+"""
+Benchmark UPDATE payload size and CPU per people encoding
+(bitmap, run-length, sparse and the adaptive choice) for typical
+audience states
+
+Run from the repository root: python -m examples.benchmark.encoding
+"""
+
+import random
+
+from paps.si.app import peopleCodec
+
+from examples.benchmark import measure
+
+
+SEATS = 1000
+""" Seats of one client (e.g. 25 rows of 40) """
+ROW = 40
+""" Seats per row """
+
+
+def patterns():
+    """
+    Audience states to encode
+
+    :return: Name and bits of each state
+    :rtype: list[(unicode, bytearray)]
+    """
+    rnd = random.Random(42)
+    few = bytearray(SEATS)
+    for index in rnd.sample(range(SEATS), SEATS // 50):
+        few[index] = 1
+    most = bytearray([1]) * SEATS
+    for index in rnd.sample(range(SEATS), SEATS // 20):
+        most[index] = 0
+    rows = bytearray([
+        1 if index // ROW % 3 else 0 for index in range(SEATS)
+    ])
+    wave = bytearray([1]) * SEATS
+    wave[400:520] = bytearray(120)
+    return [
+        ("all seated", bytearray([1]) * SEATS),
+        ("all standing", bytearray(SEATS)),
+        ("2% seated", few),
+        ("5% standing", most),
+        ("rows standing", rows),
+        ("wave (120 up)", wave),
+        ("random", bytearray([rnd.randint(0, 1) for _ in range(SEATS)])),
+    ]
+
+
+ENCODINGS = [
+    ("raw", peopleCodec.ENCODING_RAW),
+    ("rle", peopleCodec.ENCODING_RLE),
+    ("sparse", peopleCodec.ENCODING_SPARSE),
+    ("auto", None),
+]
+
+
+def main():
+    print("{} seats - bytes / encode us / decode us".format(SEATS))
+    print("{:<16}".format("") + "".join(
+        "{:>24}".format(name) for name, _ in ENCODINGS
+    ))
+    for name, bits in patterns():
+        line = "{:<16}".format(name)
+        for _, encoding in ENCODINGS:
+            used, data = peopleCodec.encode_bits(bits, encoding)
+            assert peopleCodec.decode_bits(used, data) == bits
+            encode = measure(
+                lambda: peopleCodec.encode_bits(bits, encoding), number=2000
+            )
+            decode = measure(
+                lambda: peopleCodec.decode_bits(used, data), number=2000
+            )
+            line += "{:>8} {:>7.1f} {:>7.1f}".format(
+                len(data), encode, decode
+            )
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-02"
+# Created: 2016-05-02 10:15
+"""
+Benchmark APPHeader pack/unpack
+
+Run from the repository root: python -m examples.benchmark.header
+"""
+
+import struct
+
+from paps.si.app.message import APPHeader, Flag, Id, MsgType
+
+from examples.benchmark import measure, report
+
+
+OPTIONAL = int(Flag.SEQ | Flag.ACKSEQ | Flag.ACKMASK)
+""" Flags of the optional header fields """
+
+
+def legacy_fields(data):
+    """ Format string based field decode (reference implementation) """
+    size = struct.calcsize(APPHeader.fmt_header)
+    fields, payload = struct.unpack(
+        APPHeader.fmt_header, data[:size]
+    ), data[size:]
+    if fields[5] & Flag.SEQ:
+        size = struct.calcsize(APPHeader.fmt_seq)
+        (sequence_number,), payload = struct.unpack(
+            APPHeader.fmt_seq, payload[:size]
+        ), payload[size:]
+    return fields, payload
+
+
+def fields(view):
+    """ Precompiled field decode (as used by APPHeader.unpack_from) """
+    values = APPHeader.struct_header.unpack_from(view, 0)
+    offset = APPHeader.struct_header.size
+    optional = values[5] & OPTIONAL
+    if optional:
+        unpacker = APPHeader.structs_optional[optional]
+        sequence_number, = unpacker.unpack_from(view, offset)
+        offset += unpacker.size
+    return values, offset
+
+
+def legacy_unpack(data):
+    """ Format string based unpack (reference implementation) """
+    size = struct.calcsize(APPHeader.fmt_header)
+    (
+        version, msg_type, payload_len,
+        timestamp, device_id, flags,
+    ), payload = struct.unpack(
+        APPHeader.fmt_header, data[:size]
+    ), data[size:]
+    ack_sequence_number = None
+    sequence_number = None
+
+    if flags & Flag.SEQ:
+        size = struct.calcsize(APPHeader.fmt_seq)
+        (sequence_number,), payload = struct.unpack(
+            APPHeader.fmt_seq, payload[:size]
+        ), payload[size:]
+    if flags & Flag.ACKSEQ:
+        size = struct.calcsize(APPHeader.fmt_seq_ack)
+        (ack_sequence_number,), payload = struct.unpack(
+            APPHeader.fmt_seq_ack, payload[:size]
+        ), payload[size:]
+    return APPHeader(
+        message_type=msg_type,
+        version_major=version >> 4,
+        version_minor=version & 0xf,
+        payload_length=payload_len,
+        device_id=device_id,
+        sequence_number=sequence_number,
+        flags=flags,
+        timestamp=timestamp,
+        ack_sequence_number=ack_sequence_number
+    ), payload
+
+
+def legacy_pack(header):
+    """ Format string based pack (reference implementation) """
+    if header.device_id <= Id.NOT_SET or not isinstance(header.device_id, int):
+        raise ValueError("Invalid device id")
+    if header.message_type <= MsgType.NOT_SET \
+            or not isinstance(header.message_type, int) \
+            or header.message_type not in list(MsgType):
+        raise ValueError("Invalid message type")
+    append = b""
+    if header.sequence_number is not None:
+        header.flags |= Flag.SEQ
+        append += struct.pack(header.fmt_seq, header.sequence_number)
+    if header.ack_sequence_number is not None:
+        header.flags |= Flag.ACKSEQ
+        append += struct.pack(header.fmt_seq_ack, header.ack_sequence_number)
+    packed = struct.pack(
+        header.fmt_header,
+        (header.version_major << 4) + header.version_minor,
+        header.message_type,
+        header.payload_length,
+        header._timestamp,
+        header.device_id,
+        header.flags
+    )
+    return packed + append
+
+
+def main():
+    header = APPHeader(
+        message_type=MsgType.UPDATE, device_id=2, payload_length=250,
+        timestamp=1462176900.0, sequence_number=17
+    )
+    datagram = header.pack() + b"\x01" * 250
+    view = memoryview(bytearray(datagram))
+    buff = bytearray(header.size)
+
+    base = measure(lambda: legacy_pack(header))
+    report("pack (format strings)", base)
+    report("pack (struct.Struct)", measure(lambda: header.pack()), base)
+    report(
+        "pack_into (struct.Struct)",
+        measure(lambda: header.pack_into(buff)), base
+    )
+    base = measure(lambda: legacy_fields(datagram))
+    report("decode fields (format strings)", base)
+    report("decode fields (unpack_from)", measure(lambda: fields(view)), base)
+    base = measure(lambda: legacy_unpack(datagram))
+    report("unpack (format strings)", base)
+    report(
+        "unpack (struct.Struct)",
+        measure(lambda: APPHeader.unpack(datagram)), base
+    )
+    report(
+        "unpack_from (memoryview)",
+        measure(lambda: APPHeader.unpack_from(view)), base
+    )
+
+
+if __name__ == "__main__":
+    main()
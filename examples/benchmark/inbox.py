@@ -0,0 +1,97 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-13"
+# Created: 2016-05-13 16:20
+"""
+Benchmark the inbox while packet processing stalls
+
+UPDATEs of many devices pile up in a queue.Queue, but collapse to one
+per device in the Inbox. A JOIN arriving during the flood waits behind
+all UPDATEs in a queue.Queue, but is handed out first by the Inbox.
+
+Run from the repository root: python -m examples.benchmark.inbox
+"""
+
+import time
+try:
+    import Queue as queue
+except ImportError:
+    # running python3
+    import queue
+
+from paps import Person
+from paps.si.app.inbox import Inbox
+from paps.si.app.message import APPJoinMessage, APPUpdateMessage
+
+from examples.benchmark import report
+
+
+def stall(inbox, devices, updates):
+    """
+    Put updates of all devices, then drain inbox
+
+    :return: Microseconds per put, waiting packets, drain microseconds
+    :rtype: (float, int, float)
+    """
+    packets = [
+        APPUpdateMessage(device_id=device_id, people=[Person(sitting=True)])
+        for device_id in range(2, devices + 2)
+    ]
+    start = time.time()
+    for _ in range(updates):
+        for packet in packets:
+            inbox.put(("127.0.0.1", packet.header.device_id, packet))
+    put = (time.time() - start) / (devices * updates) * 1e6
+    size = inbox.qsize()
+    start = time.time()
+    while not inbox.empty():
+        inbox.get()
+    return put, size, (time.time() - start) * 1e6
+
+
+def join_wait(inbox, devices):
+    """
+    Queue an UPDATE per device, then a JOIN - take packets until the JOIN
+
+    :return: Packets taken before JOIN, microseconds until JOIN taken
+    :rtype: (int, float)
+    """
+    for device_id in range(2, devices + 2):
+        inbox.put(("127.0.0.1", device_id, APPUpdateMessage(
+            device_id=device_id, people=[Person(sitting=True)]
+        )))
+    join = APPJoinMessage(payload={'people': []})
+    inbox.put(("127.0.0.1", 1, join))
+    start = time.time()
+    before = 0
+    while inbox.get()[2] is not join:
+        before += 1
+    return before, (time.time() - start) * 1e6
+
+
+def main(devices=200, updates=500):
+    base, base_size, base_drain = stall(queue.Queue(), devices, updates)
+    put, size, drain = stall(Inbox(), devices, updates)
+    report("put (queue.Queue)", base)
+    report("put (Inbox)", put, base)
+    report("catch up after stall (queue.Queue)", base_drain)
+    report("catch up after stall (Inbox)", drain, base_drain)
+    print("waiting packets after stall: {} -> {}".format(base_size, size))
+    base_before, base = join_wait(queue.Queue(), 4000)
+    before, micros = join_wait(Inbox(), 4000)
+    report("JOIN behind 4000 UPDATEs (queue.Queue)", base)
+    report("JOIN behind 4000 UPDATEs (Inbox)", micros, base)
+    print("packets handled before JOIN: {} -> {}".format(base_before, before))
+
+
+if __name__ == "__main__":
+    main()
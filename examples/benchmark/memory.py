@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-06"
+# Created: 2016-05-06 14:05
+"""
+Benchmark memory footprint of people, headers and messages
+
+Run from the repository root: python -m examples.benchmark.memory
+"""
+
+import sys
+
+from paps import Person
+from paps.si.app.message import APPHeader, APPMessage, APPUpdateMessage, \
+    MsgType
+
+from examples.benchmark import measure, report
+
+
+class LegacyPerson(object):
+    """ Dict backed person (reference implementation) """
+
+    def __init__(self, id=None, sitting=False):
+        self.sitting = sitting
+        self.id = id
+
+
+class LegacyHeader(object):
+    """ Dict backed header (reference implementation) """
+
+    def __init__(self):
+        self.message_type = MsgType.ACK
+        self.device_id = 2
+        self.payload_length = 0
+        self.flags = 0
+        self._timestamp = None
+        self.sequence_number = None
+        self.ack_sequence_number = None
+        self.version_major = 1
+        self.version_minor = 0
+
+
+class LegacyMessage(object):
+    """ Dict backed message (reference implementation) """
+
+    def __init__(self):
+        self._header = LegacyHeader()
+        self._payload = b""
+
+
+def footprint(obj):
+    """
+    Get the size of an object including its instance dict
+
+    :param obj: Object to inspect
+    :type obj: object
+    :return: Size in bytes
+    :rtype: int
+    """
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+
+def main(seats=10000, rate=20):
+    sizes = [
+        ("Person", footprint(LegacyPerson()), footprint(Person())),
+        (
+            "APPHeader", footprint(LegacyHeader()),
+            footprint(APPHeader(MsgType.ACK, 2))
+        ),
+        (
+            "APPMessage (+ header)",
+            footprint(LegacyMessage()) + footprint(LegacyHeader()),
+            footprint(APPMessage(MsgType.ACK, 2)) +
+            footprint(APPHeader(MsgType.ACK, 2))
+        ),
+    ]
+    print("Footprint per object (bytes):")
+    for name, legacy, slotted in sizes:
+        print("  {:<30} dict {:>5}  slots {:>5}".format(name, legacy, slotted))
+
+    # Per update: one person per seat decoded + one copy in the controller
+    people = 2 * seats * rate
+    legacy, slotted = sizes[0][1:]
+    print("{} seats at {} Hz: {} people/s".format(seats, rate, people))
+    print("  allocated dict  {:>8.1f} MB/s".format(people * legacy / 1e6))
+    print("  allocated slots {:>8.1f} MB/s".format(people * slotted / 1e6))
+
+    data = APPUpdateMessage(
+        device_id=2, people=[Person(sitting=True) for _ in range(seats)]
+    ).pack()
+    packet, _ = APPUpdateMessage.unpack(data)
+    base = measure(
+        lambda: [LegacyPerson(sitting=bit == 1) for bit in packet.bits()],
+        number=20
+    )
+    report("decode {} people (dict)".format(seats), base)
+    report(
+        "decode {} people (slots)".format(seats),
+        measure(
+            lambda: [Person(sitting=bit == 1) for bit in packet.bits()],
+            number=20
+        ), base
+    )
+    current = packet.people()
+    base = measure(
+        lambda: [LegacyPerson(p.id, p.sitting) for p in current], number=20
+    )
+    report("copy {} people (dict)".format(seats), base)
+    report(
+        "copy {} people (slots)".format(seats),
+        measure(lambda: [Person.from_person(p) for p in current], number=20),
+        base
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-05"
+# Created: 2016-05-05 14:30
+"""
+Benchmark JOIN payload size and decoding (json vs binary)
+
+Run from the repository root: python -m examples.benchmark.payload
+"""
+
+from paps import Person
+from paps.si.app.message import APPJoinMessage, Flag
+
+from examples.benchmark import measure, report
+
+
+def decode(data):
+    packet, _ = APPJoinMessage.unpack(data)
+    return packet.payload
+
+
+def main(seats=500):
+    payload = {
+        'people': [
+            Person(id=i, sitting=bool(i % 3)).to_dict() for i in range(seats)
+        ]
+    }
+    json_data = APPJoinMessage(device_id=2, payload=payload).pack()
+    binary_data = APPJoinMessage(
+        device_id=2, payload=payload, serializer=Flag.BINARY
+    ).pack()
+    print("{} seats: json {} bytes, binary {} bytes".format(
+        seats, len(json_data), len(binary_data)
+    ))
+
+    base = measure(lambda: decode(json_data), number=100)
+    report("decode join (json)", base)
+    report(
+        "decode join (binary)",
+        measure(lambda: decode(binary_data), number=100), base
+    )
+    base = measure(lambda: APPJoinMessage(
+        device_id=2, payload=payload
+    ).pack(), number=100)
+    report("encode join (json)", base)
+    report("encode join (binary)", measure(lambda: APPJoinMessage(
+        device_id=2, payload=payload, serializer=Flag.BINARY
+    ).pack(), number=100), base)
+
+
+if __name__ == "__main__":
+    main()
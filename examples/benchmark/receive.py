@@ -0,0 +1,180 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-04"
+# Created: 2016-05-04 15:10
+"""
+Benchmark the receive path (Sensor._get_packet) without a network
+
+A burst of datagrams is either read one per select wakeup (recvfrom) or
+drained at once into the reused receive buffer (recvfrom_into)
+
+Run from the repository root: python -m examples.benchmark.receive
+"""
+
+import errno
+import select
+import socket
+import time
+
+from paps import Person
+from paps.si.app.message import APPHeader, APPUpdateMessage, guess_class
+from paps.si.app.sensor import Sensor
+
+from examples.benchmark import measure, report
+
+
+BURST = 64
+""" Datagrams waiting per select wakeup """
+
+
+class FakeSocket(object):
+    """ Socket returning the same datagram burst times, then EAGAIN """
+
+    def __init__(self, data, burst=1):
+        self.data = data
+        self.address = ("127.0.0.1", 2347)
+        self.burst = burst
+        self.waiting = burst
+        self.reads = 0
+
+    def refill(self):
+        self.waiting = self.burst
+
+    def _take(self, flags):
+        if self.waiting <= 0:
+            if flags:
+                raise socket.error(errno.EAGAIN, "Resource unavailable")
+            # Would block - pretend the next burst arrived
+            self.refill()
+        self.waiting -= 1
+        self.reads += 1
+
+    def recvfrom(self, buffer_size, flags=0):
+        self._take(flags)
+        return self.data, self.address
+
+    def recvfrom_into(self, buff, nbytes=0, flags=0):
+        self._take(flags)
+        size = len(self.data)
+        buff[:size] = self.data
+        return size, self.address
+
+
+class NullInbox(object):
+    """ Inbox dropping everything """
+
+    def put(self, item):
+        pass
+
+
+class LegacySensor(Sensor):
+    """ Sensor unpacking the header twice (reference implementation) """
+
+    def _unpack(self, data):
+        header, _ = APPHeader.unpack(data)
+        cls = guess_class(header.message_type)
+        return cls.unpack(data)
+
+    def _get_packet(self, socket):
+        data, (ip, port) = socket.recvfrom(self._buffer_size)
+        return self._handle_datagram(ip, port, data)
+
+
+def wakeups(sensor, sock):
+    """ Drain one burst - return number of select wakeups needed """
+    sock.refill()
+    num = 0
+    while sock.waiting > 0:
+        sensor._get_packet(sock)
+        num += 1
+    return num
+
+
+def create(cls):
+    sensor = cls({
+        'listen_bind_ip': "127.0.0.1",
+        'multicast_bind_ip': "127.0.0.1"
+    })
+    sensor.inbox = NullInbox()
+    return sensor
+
+
+def loopback(sensor, data, rounds=200):
+    """
+    Receive bursts over loopback (select + _get_packet)
+
+    :return: Microseconds per burst and select wakeups per burst
+    :rtype: (float, float)
+    """
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    receiver.bind(("127.0.0.1", 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = receiver.getsockname()
+    elapsed = 0.0
+    selects = 0
+    try:
+        for _ in range(rounds):
+            for _ in range(BURST):
+                sender.sendto(data, address)
+            received = 0
+            start = time.time()
+            while received < BURST:
+                select.select([receiver], [], [], 1.0)
+                selects += 1
+                received += len(sensor._get_packet(receiver))
+            elapsed += time.time() - start
+    finally:
+        receiver.close()
+        sender.close()
+    return elapsed / rounds * 1e6, selects / rounds
+
+
+def main():
+    data = APPUpdateMessage(
+        device_id=2, people=[Person(sitting=True) for _ in range(100)]
+    ).pack()
+    sock = FakeSocket(data)
+    legacy = create(LegacySensor)
+    sensor = create(Sensor)
+
+    base = measure(lambda: legacy._unpack(data))
+    report("_unpack (header unpacked twice)", base)
+    report("_unpack (single pass)", measure(
+        lambda: sensor._unpack(data)
+    ), base)
+    base = measure(lambda: legacy._get_packet(sock))
+    report("_get_packet (legacy, one datagram)", base)
+    report("_get_packet (drain, one datagram)", measure(
+        lambda: sensor._get_packet(sock)
+    ), base)
+
+    burst = FakeSocket(data, BURST)
+    base = measure(lambda: wakeups(legacy, burst), number=1000)
+    report("burst of {} (recvfrom per wakeup)".format(BURST), base)
+    report("burst of {} (drain into buffer)".format(BURST), measure(
+        lambda: wakeups(sensor, burst), number=1000
+    ), base)
+    print("wakeups per burst: {} -> {}".format(
+        wakeups(legacy, burst), wakeups(sensor, burst)
+    ))
+    base, base_selects = loopback(legacy, data)
+    report("loopback burst (recvfrom per wakeup)", base)
+    micros, selects = loopback(sensor, data)
+    report("loopback burst (drain into buffer)", micros, base)
+    print("loopback selects per burst: {:.1f} -> {:.1f}".format(
+        base_selects, selects
+    ))
+    print("receive buffers allocated per burst: {} -> 0".format(BURST))
+
+if __name__ == "__main__":
+    main()
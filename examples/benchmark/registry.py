@@ -0,0 +1,111 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-16"
+# Created: 2016-05-16 16:30
+"""
+Benchmark memory and update cost of registered clients
+
+Run from the repository root: python -m examples.benchmark.registry
+"""
+
+import sys
+
+from paps import Person
+from paps.si.app.clientRegistry import ClientRegistry
+
+from examples.benchmark import measure, report
+
+
+def deep_size(obj, seen):
+    """
+    Get the size of an object and everything it references (once)
+
+    :param obj: Object to inspect
+    :type obj: object
+    :param seen: Ids of objects already counted
+    :type seen: set[int]
+    :return: Size in bytes
+    :rtype: int
+    """
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif hasattr(obj, "__slots__"):
+        for name in obj.__slots__:
+            size += deep_size(getattr(obj, name, None), seen)
+    return size
+
+
+def legacy_client(device_id, ip, port, people):
+    """ Dict client record (reference implementation) """
+    return {
+        'device_id': device_id,
+        'key': "{}:{}".format(ip, port),
+        'people': people,
+    }
+
+
+def main(clients=50000, seats=4):
+    legacy = {}
+    key2device_id = {}
+    registry = ClientRegistry()
+    for index in range(clients):
+        ip = "10.0.{}.{}".format(index // 256, index % 256)
+        device_id = registry.allocate((ip, 2346))
+        people = [
+            Person("{}.{}".format(device_id, seat), False)
+            for seat in range(seats)
+        ]
+        legacy[device_id] = legacy_client(device_id, ip, 2346, people)
+        key2device_id[legacy[device_id]['key']] = device_id
+        registry.add(device_id, (ip, 2346), people)
+    # Shared objects (small ints, None) are counted once per structure
+    base = deep_size(legacy, set()) + deep_size(key2device_id, set())
+    size = deep_size(registry._records, set()) \
+        + deep_size(registry._addresses, set())
+    print("{} clients with {} seats (bytes per client):".format(
+        clients, seats
+    ))
+    print("  dict records     {:>6}".format(base // clients))
+    print("  ClientRegistry   {:>6}".format(size // clients))
+
+    client = legacy[2]
+    sitting = [Person(sitting=True) for _ in range(seats)]
+    bits = bytearray([1] * seats)
+
+    def legacy_update():
+        changed = []
+        for index, person in enumerate(sitting):
+            old = client['people'][index]
+            person.id = old.id
+            if person != old:
+                old.sitting = person.sitting
+                changed.append(old)
+        return changed
+
+    base = measure(legacy_update, number=100000)
+    report("update unchanged (dict record)", base)
+    report(
+        "update unchanged (ClientRegistry)",
+        measure(lambda: registry.update(2, bits), number=100000), base
+    )
+
+
+if __name__ == "__main__":
+    main()
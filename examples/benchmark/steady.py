@@ -0,0 +1,114 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-17"
+# Created: 2016-05-17 09:50
+"""
+Benchmark server handling of steady state UPDATEs (state resent or a
+single seat changed)
+
+Run from the repository root: python -m examples.benchmark.steady
+"""
+
+from paps import Person
+from paps.changeInterface import ChangeInterface
+from paps.si.app.message import APPJoinMessage, APPUpdateMessage
+from paps.si.app.peopleCodec import ENCODING_RAW
+from paps.si.app.sensorServer import SensorServer
+
+from examples.benchmark import measure, report
+
+
+class NullChanger(ChangeInterface):
+    """ Ignore all changes """
+
+    def on_person_new(self, people):
+        pass
+
+    def on_person_update(self, people):
+        pass
+
+    def on_person_leave(self, people):
+        pass
+
+
+def legacy_update(client_people, packet):
+    """ Decode and compare all people (reference implementation) """
+    changed = []
+    for index, person in enumerate(packet.people()):
+        old = client_people[index]
+        person.id = old.id
+        if person != old:
+            old.sitting = person.sitting
+            changed.append(old)
+    return changed
+
+
+def main(seats=2000):
+    server = SensorServer({
+        'changer': NullChanger(),
+        'listen_bind_ip': "127.0.0.1",
+        'multicast_bind_ip': "127.0.0.1",
+    })
+    server._send_packet = lambda ip, port, packet: None
+    server._do_packet(APPJoinMessage(payload={'people': [
+        {'id': index, 'sitting': False} for index in range(seats)
+    ]}), "127.0.0.1", 2346)
+    device_id = server._clients.device_id(("127.0.0.1", 2346))
+    client_people = server._clients.get(device_id).people()
+    states = [
+        [Person(sitting=False) for _ in range(seats)],
+        [Person(sitting=index == seats // 2) for index in range(seats)],
+    ]
+    # Unpacked packets like received ones (no cached view)
+    # Bitmap - sparse would be smaller for these states, but is not XOR-ed
+    packets = [
+        APPUpdateMessage.unpack(APPUpdateMessage(
+            device_id=device_id, people=people, encoding=ENCODING_RAW
+        ).pack())[0]
+        for people in states
+    ]
+    flips = [0]
+
+    def flip(handle):
+        flips[0] ^= 1
+        packet = packets[flips[0]]
+        packet._view = None
+        handle(packet)
+
+    def legacy_flip():
+        flip(lambda packet: legacy_update(client_people, packet))
+
+    def server_flip():
+        flip(lambda packet: server._do_packet(packet, "127.0.0.1", 2346))
+
+    print("{} seats".format(seats))
+    unchanged = packets[0]
+
+    def legacy_unchanged():
+        unchanged._view = None
+        legacy_update(client_people, unchanged)
+
+    base = measure(legacy_unchanged, number=100)
+    report("unchanged (decode + compare)", base)
+    report(
+        "unchanged (payload compare)",
+        measure(lambda: server._do_packet(
+            unchanged, "127.0.0.1", 2346
+        ), number=10000), base
+    )
+    base = measure(legacy_flip, number=100)
+    report("one seat changed (decode + compare)", base)
+    report("one seat changed (payload XOR)", measure(server_flip), base)
+
+
+if __name__ == "__main__":
+    main()
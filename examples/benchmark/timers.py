@@ -0,0 +1,62 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-10"
+# Created: 2016-05-10 09:30
+"""
+Benchmark retransmission timers with many packets in flight
+
+Run from the repository root: python -m examples.benchmark.timers
+"""
+
+import random
+import time
+
+from paps.si.app.timerQueue import TimerQueue
+
+from examples.benchmark import report
+
+
+def main(in_flight=10000, acked=0.9, spread=0.5, offset=0.5):
+    timers = TimerQueue()
+    late = []
+
+    def fire(deadline):
+        late.append(time.time() - deadline)
+
+    start = time.time()
+    handles = []
+    for _ in range(in_flight):
+        # Offset: time to schedule/cancel everything before the first fires
+        delay = offset + random.random() * spread
+        handles.append(timers.schedule(delay, fire, time.time() + delay))
+    report("schedule", (time.time() - start) / in_flight * 1e6)
+
+    random.shuffle(handles)
+    num_acked = int(in_flight * acked)
+    start = time.time()
+    for handle in handles[:num_acked]:
+        timers.cancel(handle)
+    report("cancel (ack)", (time.time() - start) / num_acked * 1e6)
+    print("{} in flight, {} acked: {} active, heap size {}".format(
+        in_flight, num_acked, len(timers), len(timers._heap)
+    ))
+
+    while len(timers):
+        timers.run_pending()
+        timers.wait(spread)
+    print("{} retransmits: max late {:.2f} ms, mean late {:.3f} ms".format(
+        len(late), max(late) * 1e3, sum(late) / len(late) * 1e3
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-03"
+# Created: 2016-05-03 11:02
+"""
+Benchmark APPUpdateMessage people encoding/decoding
+
+Run from the repository root: python -m examples.benchmark.update
+"""
+
+import struct
+
+from paps import Person
+from paps.si.app import peopleCodec
+from paps.si.app.message import APPUpdateMessage
+
+from examples.benchmark import measure, report
+
+
+def legacy_pack_people(people):
+    """ Bit by bit packing (reference implementation) """
+    res = bytearray()
+    bits = bytearray([1])
+
+    for person in people:
+        bits.extend(person.to_bits())
+    aByte = 0
+
+    for i, bit in enumerate(bits[::-1]):
+        mod = i % 8
+        aByte |= bit << mod
+        if mod == 7 or i == len(bits) - 1:
+            res.append(aByte)
+            aByte = 0
+    return struct.pack(APPUpdateMessage.fmt.format(len(res)), *res[::-1])
+
+
+def legacy_people(payload):
+    """ Bit by bit unpacking (reference implementation) """
+    people = []
+    bits = bytearray()
+    byts = struct.unpack(
+        APPUpdateMessage.fmt.format(len(payload)), payload
+    )[::-1]
+    for aByte in byts[:-1]:
+        for i in range(8):
+            bits.append(aByte >> i & 1)
+    mark = 7
+    aByte = byts[-1]
+    while aByte >> mark == 0 and mark > 0:
+        mark -= 1
+    for i in range(mark):
+        bits.append(aByte >> i & 1)
+    i = len(bits)
+    while i > 0:
+        p = Person()
+        p.from_bits(bits[i - Person.BITS_PER_PERSON:i][::-1])
+        people.append(p)
+        i -= Person.BITS_PER_PERSON
+    return people
+
+
+def main(seats=2000):
+    people = [Person(id=i, sitting=bool(i % 3)) for i in range(seats)]
+    bits = peopleCodec.people_to_bits(people)
+    payload = peopleCodec.pack_bits(bits)
+    assert legacy_pack_people(people) == payload
+    print("{} seats (numpy: {})".format(seats, peopleCodec.numpy is not None))
+
+    base = measure(lambda: legacy_pack_people(people), number=100)
+    report("encode people (bit loop)", base)
+    report(
+        "encode people (bulk)",
+        measure(lambda: peopleCodec.pack_bits(
+            peopleCodec.people_to_bits(people)
+        ), number=1000), base
+    )
+    report(
+        "encode bits (bulk)",
+        measure(lambda: peopleCodec.pack_bits(bits), number=1000), base
+    )
+    if peopleCodec.numpy is not None:
+        report(
+            "encode bits (numpy)",
+            measure(lambda: peopleCodec._pack_bits_numpy(bits), number=1000),
+            base
+        )
+    base = measure(lambda: legacy_people(payload), number=100)
+    report("decode people (bit loop)", base)
+    report(
+        "decode people (bulk + Person)",
+        measure(
+            lambda: list(peopleCodec.PeopleView(
+                peopleCodec.unpack_bits(payload)
+            )), number=100
+        ), base
+    )
+    report(
+        "decode lazy view (bulk)",
+        measure(
+            lambda: peopleCodec.PeopleView(peopleCodec.unpack_bits(payload)),
+            number=1000
+        ), base
+    )
+    if peopleCodec.numpy is not None:
+        report(
+            "decode bits (numpy)",
+            measure(
+                lambda: peopleCodec._unpack_bits_numpy(payload), number=1000
+            ), base
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -31,26 +31,16 @@ class EchoClient(SensorClient):
     def __init__(self, settings=None):
         super(EchoClient, self).__init__(settings)
 
-    def _packet_loop(self):
+    def _do_packet(self, packet, ip, port):
         """
-        Packet processing loop
+        React to incoming packet (config and echoed updates)
 
         :rtype: None
         """
-        while self._is_running:
-            # Only wait if there are no more packets in the inbox
-            if self.inbox.empty() \
-                    and not self.new_packet.wait(self._packet_timeout):
-                continue
-            ip, port, packet = self.inbox.get()
-            if self.inbox.empty():
-                self.new_packet.clear()
-            self.debug(u"{}".format(packet))
-
-            if packet.header.message_type == MsgType.CONFIG:
-                self._do_config_packet(packet, ip, port)
-            elif packet.header.message_type == MsgType.UPDATE:
-                self._do_update_packet(packet)
+        if packet.header.message_type == MsgType.UPDATE:
+            self._do_update_packet(packet)
+        else:
+            super(EchoClient, self)._do_packet(packet, ip, port)
 
     def _do_update_packet(self, packet):
         pass
@@ -73,10 +63,16 @@ class WrapperEchoClient(WrapperClient):
     def _get_person_update(self, packet):
         if self._is_updating:
             try:
-                self._responses_time += time.time() - self._q.get(False, 0.1)
-                self._responses += 1
+                self._q.get(False, 0.1)
             except Queue.Empty:
-                pass
+                return
+            # Echo keeps the original header -> round trip from its timestamp
+            # (microsecond resolution with protocol 1.1)
+            self._responses_time += (
+                pytz.UTC.localize(datetime.datetime.utcnow()) -
+                packet.header.timestamp
+            ).total_seconds()
+            self._responses += 1
 
     def start(self, blocking=False):
         self.info("()")
@@ -111,7 +107,10 @@ def cmd_line(line, ctrl):
     return line
 
 
-def create(clients_num, clients_host, clients_port, people_num, throttle):
+def create(
+        clients_num, clients_host, clients_port, people_num, throttle,
+        dispatch_mode="queue"
+):
     """
     Prepare clients to execute
 
@@ -124,7 +123,9 @@ def create(clients_num, clients_host, clients_port, people_num, throttle):
             'id': number,
             'listen_bind_ip': clients_host,
             #'multicast_bind_ip': "127.0.0.1",
-            'listen_port': clients_port + number
+            'listen_port': clients_port + number,
+            'protocol_version_minor': 1,
+            'dispatch_mode': dispatch_mode
         })
         people = []
         for person_number in range(people_num):
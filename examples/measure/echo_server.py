@@ -13,6 +13,11 @@ __date__ = "2016-04-19"
 # Created: 2016-03-14 15:27
 """ measure request speed echo server """
 
+import logging
+import datetime
+
+import pytz
+
 from paps.si.app.message import MsgType
 from paps.si.app.sensorServer import SensorServer
 from paps.changeInterface import ChangeInterface
@@ -33,7 +38,12 @@ class EchoServer(SensorServer):
         super(EchoServer, self)._do_packet(packet, ip, port)
         if packet.header.message_type == MsgType.UPDATE:
             # Echo update msg
-            self.debug(packet.header.timestamp)
+            if self._logger.isEnabledFor(logging.DEBUG):
+                # One way latency (needs synchronized clocks)
+                self.debug(u"Latency: {}".format(
+                    pytz.UTC.localize(datetime.datetime.utcnow()) -
+                    packet.header.timestamp
+                ))
             self._send_packet(
                 ip, port, packet,
                 update_timestamp=False, acknowledge_packet=False
@@ -53,7 +63,7 @@ def cmd_line(line, ctrl):
     return line
 
 
-def create(host, port):
+def create(host, port, dispatch_mode="queue"):
     """
     Prepare server to execute
 
@@ -65,7 +75,9 @@ def create(host, port):
     })
     d = {
         'listen_port': port,
-        'changer': wrapper
+        'changer': wrapper,
+        'protocol_version_minor': 1,
+        'dispatch_mode': dispatch_mode
     }
     if host:
         d['listen_bind_ip'] = host
@@ -74,6 +74,9 @@ if __name__ == '__main__':
     parser.add_argument("--port", type=int, default=2346)
     parser.add_argument("--people", type=int, default=3)
     parser.add_argument("--throttle", type=int, default=0)
+    parser.add_argument(
+        "--dispatch", choices=["queue", "inline"], default="queue"
+    )
 
     args = parser.parse_args()
     if args.debug:
@@ -83,10 +86,13 @@ if __name__ == '__main__':
     if args.echo:
         if args.client:
             modules, cmd_line = echo_client.create(
-                args.number, args.host, args.port, args.people, args.throttle
+                args.number, args.host, args.port, args.people, args.throttle,
+                args.dispatch
             )
         else:
-            modules, cmd_line = echo_server.create(args.host, args.port)
+            modules, cmd_line = echo_server.create(
+                args.host, args.port, args.dispatch
+            )
     else:
         if args.client:
             modules, cmd_line = client.create(
@@ -17,6 +17,8 @@ __date__ = "2016-03-31"
 class Person(object):
     """ Class representing a person in the audience participation system  """
 
+    __slots__ = ("sitting", "id")
+
     BITS_PER_PERSON = 1
     """ How many bits are necessary to encode one person """
 
@@ -30,7 +32,8 @@ class Person(object):
         :type sitting: bool
         :rtype: None
         """
-        super(Person, self).__init__()
+        # No super().__init__() - object does nothing and people
+        # get created per seat and update
         self.sitting = sitting
         """ Is this person sitting
             :type sitting: bool """
@@ -126,10 +129,7 @@ class Person(object):
         :type person: Person
         :rtype: Person
         """
-        p = Person()
-        p.id = person.id
-        p.sitting = person.sitting
-        return p
+        return Person(person.id, person.sitting)
 
     def __cmp__(self, other):
         """
@@ -0,0 +1,448 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-12"
+# Created: 2016-05-12 10:30
+"""
+Sensor server and client running on an asyncio event loop (python 3)
+
+Instead of receive/timer/packet threads handing packets over through a
+queue, datagrams are handled in the event loop as they arrive and timers
+are loop timers. Many sensors (e.g. simulated clients) can share one loop.
+
+join()/unjoin() return futures (await them or add callbacks)
+"""
+
+import functools
+
+try:
+    import asyncio
+except ImportError:
+    # running python2
+    asyncio = None
+
+from ..sensorInterface import SensorException, SensorStartException, \
+    SensorJoinException
+from .sensor import Sensor
+from .sensorServer import SensorServer
+from .sensorClient import SensorClient
+from .message import Id, ProtocolViolation, \
+    APPJoinMessage, APPUnjoinMessage
+
+
+class _SensorProtocol(asyncio.DatagramProtocol if asyncio else object):
+    """ Pass datagrams of a socket on to a sensor """
+
+    def __init__(self, sensor):
+        """
+        Initialize object
+
+        :param sensor: Sensor to handle datagrams
+        :type sensor: AsyncSensor
+        :rtype: None
+        """
+        super(_SensorProtocol, self).__init__()
+        self._sensor = sensor
+
+    def datagram_received(self, data, address):
+        self._sensor._datagram_received(data, address)
+
+    def error_received(self, exc):
+        self._sensor.error(u"Socket error: {}".format(exc))
+
+
+class AsyncSensor(Sensor):
+    """ Base class for sensors running on an asyncio event loop """
+
+    def __init__(self, settings=None):
+        if settings is None:
+            settings = {}
+        if asyncio is None:
+            raise SensorException("asyncio not available")
+        super(AsyncSensor, self).__init__(settings)
+        # Handle packets right away in loop - there is no packet thread
+        self._dispatch_inline = True
+        self._loop = settings.get('loop')
+        """ Event loop to run on (None - current loop at start)
+            :type _loop: None | asyncio.AbstractEventLoop """
+        self._transports = {}
+        """ Transports of listening sockets - socket -> transport
+            :type _transports: dict[socket.socket, asyncio.BaseTransport] """
+        self._stopped = None
+        """ Done once stopped (run by blocking start)
+            :type _stopped: None | asyncio.Future """
+        self._ack_waiters = {}
+        """ Futures waiting for packets to be acked - sequence number -> future
+            :type _ack_waiters: dict[int, asyncio.Future] """
+
+    def _send(self, ip, port, data):
+        transport = self._transports.get(self._listen_socket)
+        if transport is None:
+            # Endpoint not ready yet
+            return super(AsyncSensor, self)._send(ip, port, data)
+        transport.sendto(data, (ip, port))
+        return len(data)
+
+    def _schedule(self, delay, callback, *args):
+        """
+        Run callback after delay (in event loop)
+
+        :param delay: Seconds to wait
+        :type delay: float
+        :param callback: Function to call
+        :type callback: callable
+        :param args: Arguments for callback
+        :return: Handle to cancel timer
+        :rtype: asyncio.TimerHandle
+        """
+        return self._loop.call_later(delay, callback, *args)
+
+    def _cancel(self, timer):
+        timer.cancel()
+
+    def _datagram_received(self, data, address):
+        """
+        Handle datagram received on one of the endpoints
+
+        :param data: Received datagram
+        :type data: bytes
+        :param address: Sender (ip, port)
+        :type address: (str, int)
+        :rtype: None
+        """
+        ip, port = address[:2]
+        try:
+            self._handle_datagram(ip, port, data)
+        except ProtocolViolation:
+            self.exception(
+                u"Failed to decode datagram from {}:{}".format(ip, port)
+            )
+
+    def _packet_acked(self, seq, waiting, now):
+        super(AsyncSensor, self)._packet_acked(seq, waiting, now)
+        future = self._ack_waiters.pop(seq, None)
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def _packet_lost(self, ip, port, packet):
+        super(AsyncSensor, self)._packet_lost(ip, port, packet)
+        future = self._ack_waiters.pop(packet.header.sequence_number, None)
+        if future is not None and not future.done():
+            future.set_exception(SensorException("Packet not acknowledged"))
+
+    def _send_packet_acked(self, ip, port, packet):
+        """
+        Send packet and wait for its ack
+
+        :param ip: Ip to send to
+        :type ip: str
+        :param port: Port to send to
+        :type port: int
+        :param packet: Packet to be transmitted
+        :type packet: paps.si.app.message.APPMessage
+        :return: Done once acked (fails if not acked after all retries)
+        :rtype: asyncio.Future
+        """
+        future = self._loop.create_future()
+        self._send_packet(ip, port, packet)
+        self._ack_waiters[packet.header.sequence_number] = future
+        return future
+
+    def _open_endpoint(self, sock):
+        """
+        Start handling datagrams of socket in event loop
+
+        :param sock: Bound socket
+        :type sock: socket.socket
+        :return: Done once endpoint is ready
+        :rtype: asyncio.Future
+        """
+        future = asyncio.ensure_future(
+            self._loop.create_datagram_endpoint(
+                lambda: _SensorProtocol(self), sock=sock
+            ),
+            loop=self._loop
+        )
+        future.add_done_callback(
+            functools.partial(self._endpoint_opened, sock)
+        )
+        return future
+
+    def _endpoint_opened(self, sock, future):
+        """
+        Remember transport of endpoint
+
+        :param sock: Socket of endpoint
+        :type sock: socket.socket
+        :param future: Finished endpoint creation
+        :type future: asyncio.Future
+        :rtype: None
+        """
+        if future.cancelled() or future.exception() is not None:
+            self.error(u"Failed to open endpoint: {}".format(
+                None if future.cancelled() else future.exception()
+            ))
+            return
+        transport, _ = future.result()
+        self._transports[sock] = transport
+
+    def start(self, blocking=False):
+        """
+        Start the interface
+
+        :param blocking: Should the call block until stop() is called
+            (default: False) - runs the event loop
+        :type blocking: bool
+        :return: Done once all endpoints are ready
+        :rtype: asyncio.Future
+        :raises SensorStartException: Failed to start
+        """
+        try:
+            self._init_listen_socket()
+        except:
+            self.exception(u"Failed to init listen socket ({}:{})".format(
+                self._listen_ip, self._listen_port
+            ))
+            self._shutdown_listen_socket()
+            raise SensorStartException("Listen socket init failed")
+        self.info(u"Listening on {}:{}".format(
+            self._listen_ip, self._listen_port
+        ))
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+        self._stopped = self._loop.create_future()
+        # StartStopable.start - no threads needed
+        super(Sensor, self).start(False)
+        started = asyncio.gather(*[
+            self._open_endpoint(sock) for sock in self._listening
+        ])
+        if blocking:
+            self._loop.run_until_complete(self._stopped)
+        return started
+
+    def stop(self):
+        """
+        Stop the interface (waiting messages are sent)
+
+        :rtype: None
+        """
+        super(Sensor, self).stop()
+        try:
+            for address, pending in list(self._pending_acks.items()):
+                self._flush_acks(address, pending)
+            self._flush_coalesced()
+        except:
+            self.exception("Failed to send waiting messages")
+        with self._seq_ack_lock:
+            for timer, _, _ in self._seq_ack.values():
+                timer.cancel()
+            self._seq_ack.clear()
+        for future in self._ack_waiters.values():
+            if not future.done():
+                future.cancel()
+        self._ack_waiters.clear()
+        for sock in self._listening:
+            transport = self._transports.pop(sock, None)
+            if transport is not None:
+                # Closes socket
+                transport.close()
+            else:
+                sock.close()
+        self._listening = []
+        self._listen_socket = None
+        if self._stopped is not None and not self._stopped.done():
+            self._stopped.set_result(None)
+
+
+class AsyncSensorServer(AsyncSensor, SensorServer):
+    """ APP sensor server on an asyncio event loop """
+
+    def start(self, blocking=False):
+        """
+        Start the interface
+
+        :param blocking: Should the call block until stop() is called
+            (default: False) - runs the event loop
+        :type blocking: bool
+        :return: Done once all endpoints are ready
+        :rtype: asyncio.Future
+        :raises SensorStartException: Failed to start
+        """
+        self.debug("()")
+        try:
+            self._init_multicast_socket()
+        except:
+            self._multicast_socket = None
+            self.exception("Failed to init multicast socket")
+            raise SensorStartException("Multicast socket init failed")
+        self.info("Started")
+        return super(AsyncSensorServer, self).start(blocking)
+
+    def stop(self):
+        """
+        Stop the sensor server
+
+        :rtype: None
+        """
+        self.debug("()")
+        if self._multicast_socket is not None:
+            # Socket gets closed with its transport
+            self._drop_membership_multicast_socket()
+            self._multicast_socket = None
+        super(AsyncSensorServer, self).stop()
+
+
+class AsyncSensorClient(AsyncSensor, SensorClient):
+    """ APP sensor client on an asyncio event loop """
+
+    def __init__(self, settings=None):
+        if settings is None:
+            settings = {}
+        super(AsyncSensorClient, self).__init__(settings)
+        self._joining = None
+        """ Join in progress - future and retry timer
+            :type _joining: None | (asyncio.Future, asyncio.TimerHandle) """
+
+    def join(self, people):
+        """
+        Join the local audience
+        (a config message should be received on success)
+        Validates that there are people to join and that each of them
+        has a valid unique id
+
+        :param people: Which people does this sensor have
+        :type people: list[paps.person.Person]
+        :return: Done once joined
+            (fails with SensorJoinException if no config is received)
+        :rtype: asyncio.Future
+        :raises SensorJoinException: Invalid people or not started
+        """
+        if not people:
+            raise SensorJoinException("No people given")
+        ids = set()
+        for person in people:
+            if not person.id and person.id != 0:
+                raise SensorJoinException("Invalid id for one or more people")
+            if person.id in ids:
+                raise SensorJoinException(
+                    u"Id {} not unique".format(person.id)
+                )
+            ids.add(person.id)
+        if not self._is_running:
+            raise SensorJoinException("Not started")
+        if self._joining is not None:
+            # Replace join in progress
+            future, timer = self._joining
+            timer.cancel()
+            future.cancel()
+        self._joined.clear()
+        self._update_reset()
+        future = self._loop.create_future()
+        payload = {'people': [person.to_dict() for person in people]}
+        self._joining = (future, None)
+        self._join_try(future, payload, 0)
+        return future
+
+    def _join_try(self, future, payload, tries):
+        """
+        Send join packet (timer callback for retries)
+
+        :param future: Future of this join
+        :type future: asyncio.Future
+        :param payload: Join payload
+        :type payload: dict
+        :param tries: Number of unsuccessful tries so far
+        :type tries: int
+        :rtype: None
+        """
+        if self._joining is None or self._joining[0] is not future:
+            # Joined or replaced meanwhile
+            return
+        if tries:
+            self.warning(
+                u"Unsuccessful attempt joining audience # {}".format(tries)
+            )
+        if tries >= self._join_retry_count or not self._is_running:
+            self._joining = None
+            future.set_exception(
+                SensorJoinException("No config packet received")
+            )
+            return
+        self._send_packet(
+            self._multicast_group, self._multicast_port,
+            APPJoinMessage(
+                payload=payload, serializer=self._payload_serializer
+            )
+        )
+        self._joining = (future, self._schedule(
+            self._join_retry_timeout, self._join_try,
+            future, payload, tries + 1
+        ))
+
+    def _do_config_packet(self, packet, ip, port):
+        super(AsyncSensorClient, self)._do_config_packet(packet, ip, port)
+        if self._joined.is_set() and self._joining is not None:
+            future, timer = self._joining
+            self._joining = None
+            timer.cancel()
+            if not future.done():
+                future.set_result(None)
+                self.info("Joined the audience")
+
+    def unjoin(self):
+        """
+        Leave the local audience
+
+        :return: Done once the server acknowledged
+            (fails with SensorException if not acknowledged)
+        :rtype: asyncio.Future
+        :raises SensorJoinException: Failed to leave
+        """
+        self.debug("()")
+        if not self._joined.is_set():
+            future = self._loop.create_future()
+            future.set_result(None)
+            return future
+        future = self._send_packet_acked(
+            self._server_ip, self._server_port,
+            APPUnjoinMessage(device_id=Id.NOT_SET)
+        )
+        self._joined.clear()
+        self._update_reset()
+        self.info("Left the audience")
+        return future
+
+    def stop(self):
+        """
+        Stop the interface (after leaving the audience)
+
+        :return: Done once stopped
+        :rtype: asyncio.Future
+        """
+        self.debug("()")
+        if not self._is_running:
+            super(AsyncSensorClient, self).stop()
+            return self._stopped
+        if self._joining is not None:
+            future, timer = self._joining
+            self._joining = None
+            timer.cancel()
+            future.cancel()
+        try:
+            leaving = self.unjoin()
+        except:
+            self.exception("Failed to leave audience")
+            super(AsyncSensorClient, self).stop()
+            return self._stopped
+        leaving.add_done_callback(
+            lambda _: super(AsyncSensorClient, self).stop()
+        )
+        return self._stopped
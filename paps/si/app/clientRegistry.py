@@ -0,0 +1,423 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-16"
+# Created: 2016-05-16 14:00
+"""
+Registered clients of a sensor server
+
+Records are split into stripes by device id, each guarded by its own
+lock, so updates of different devices do not wait on each other.
+Joining/leaving additionally takes the membership lock (device ids and
+address index) - always before a stripe lock.
+
+Seat states are kept as a bytearray (one byte per person, 0/1) instead
+of a list of people, people are only created when handed out. The last
+UPDATE payload is kept as well - a resent state is detected by comparing
+the raw payloads, a changed one by XOR-ing them (no decoding - bitmap
+encoded payloads only). Clients
+sending DELTAs additionally get the seats of their acked UPDATE kept as
+baseline.
+"""
+
+import threading
+
+from ...person import Person
+from .deviceIdAllocator import DeviceIdAllocator
+from .peopleCodec import diff_bits, diff_seats, pack_bits, ENCODING_RAW
+
+
+class ClientRecord(object):
+    """ Registered client """
+
+    __slots__ = (
+        "device_id", "address", "person_ids", "seats", "payload", "encoding",
+        "baseline"
+    )
+
+    def __init__(
+            self, device_id, address, person_ids, seats, payload=None,
+            encoding=ENCODING_RAW
+    ):
+        """
+        Initialize object
+
+        :param device_id: Device id of client
+        :type device_id: int
+        :param address: Client ip address and port
+        :type address: (unicode, int)
+        :param person_ids: Ids of people (in order of client)
+        :type person_ids: tuple[unicode]
+        :param seats: Sitting state per person (one byte per person)
+        :type seats: bytearray
+        :param payload: Packed seats (default: None)
+            None -> unknown
+        :type payload: None | str
+        :param encoding: Encoding of payload (default: ENCODING_RAW)
+        :type encoding: int
+        :rtype: None
+        """
+        self.device_id = device_id
+        """ Device id of client
+            :type device_id: int """
+        self.address = address
+        """ Client ip address and port
+            :type address: (unicode, int) """
+        self.person_ids = person_ids
+        """ Ids of people (in order of client)
+            :type person_ids: tuple[unicode] """
+        self.seats = seats
+        """ Sitting state per person (one byte per person)
+            :type seats: bytearray """
+        self.payload = payload
+        """ Packed seats as last received (None - unknown)
+            :type payload: None | str """
+        self.encoding = encoding
+        """ Encoding of payload (paps.si.app.peopleCodec)
+            :type encoding: int """
+        self.baseline = None
+        """ Sequence number and seats of acked UPDATE DELTAs refer to
+            (None - no baseline)
+            :type baseline: None | (int, bytearray) """
+
+    def people(self, indices=None):
+        """
+        Create people from record
+
+        :param indices: Only people at these indices (default: None)
+            None -> all people
+        :type indices: None | list[int]
+        :return: The people
+        :rtype: list[paps.person.Person]
+        """
+        ids = self.person_ids
+        seats = self.seats
+        if indices is None:
+            indices = range(len(ids))
+        return [Person(ids[index], seats[index] == 1) for index in indices]
+
+    def copy(self):
+        """
+        Copy record (seat states are not shared)
+
+        :rtype: ClientRecord
+        """
+        record = ClientRecord(
+            self.device_id, self.address, self.person_ids,
+            bytearray(self.seats), self.payload, self.encoding
+        )
+        record.baseline = self.baseline
+        return record
+
+
+class ClientRegistry(object):
+    """ Thread safe map of device id -> client record """
+
+    def __init__(self, stripes=16, device_ids=None):
+        """
+        Initialize object
+
+        :param stripes: Number of lock stripes (default: 16)
+        :type stripes: int
+        :param device_ids: Device id allocator to use (default: None)
+            None -> DeviceIdAllocator()
+        :type device_ids: None | paps.si.app.deviceIdAllocator.DeviceIdAllocator
+        :rtype: None
+        """
+        super(ClientRegistry, self).__init__()
+        self._stripes = stripes
+        """ Number of lock stripes
+            :type _stripes: int """
+        self._locks = tuple(threading.Lock() for _ in range(stripes))
+        """ Lock per stripe (records dict and seat states) """
+        self._records = tuple({} for _ in range(stripes))
+        """ Records per stripe - device id -> record
+            :type _records: tuple[dict[int, ClientRecord]] """
+        self._lock = threading.Lock()
+        """ Membership lock (device ids and address index) """
+        self._addresses = {}
+        """ (ip, port) -> device id
+            :type _addresses: dict[(unicode, int), int] """
+        if device_ids is None:
+            device_ids = DeviceIdAllocator()
+        self._device_ids = device_ids
+        """ Device ids in use
+            :type _device_ids: paps.si.app.deviceIdAllocator.DeviceIdAllocator
+        """
+
+    def allocate(self, address):
+        """
+        Allocate a new device id or return existing device id for address
+
+        :param address: Client ip address and port
+        :type address: (unicode, int)
+        :return: The device id
+        :rtype: int
+        :raises ValueError: No device id left
+        """
+        with self._lock:
+            device_id = self._addresses.get(address)
+            if device_id is not None:
+                return device_id
+            return self._device_ids.allocate()
+
+    def reserve(self, device_id):
+        """
+        Mark device id as in use (e.g. client rejoins with known id)
+
+        :param device_id: Device id to reserve
+        :type device_id: int
+        :rtype: None
+        :raises ValueError: Device id out of range
+        """
+        with self._lock:
+            self._device_ids.reserve(device_id)
+
+    def release(self, device_id):
+        """
+        Free an allocated/reserved device id that did not get registered
+
+        :param device_id: Device id to release
+        :type device_id: int
+        :rtype: None
+        """
+        with self._lock:
+            if device_id not in self._records[device_id % self._stripes]:
+                self._device_ids.release(device_id)
+
+    def add(self, device_id, address, people):
+        """
+        Register client (replaces client with same device id)
+
+        :param device_id: Device id of client
+        :type device_id: int
+        :param address: Client ip address and port
+        :type address: (unicode, int)
+        :param people: People of client
+        :type people: list[paps.person.Person]
+        :return: The new record
+        :rtype: ClientRecord
+        :raises ValueError: Device id out of range
+        """
+        seats = bytearray([1 if person.sitting else 0 for person in people])
+        record = ClientRecord(
+            device_id, address, tuple(person.id for person in people), seats,
+            pack_bits(seats) if Person.BITS_PER_PERSON == 1 else None
+        )
+        stripe = device_id % self._stripes
+        with self._lock:
+            self._device_ids.reserve(device_id)
+            old = self._records[stripe].get(device_id)
+            if old is not None and old.address != address:
+                # Rejoined from new address
+                self._addresses.pop(old.address, None)
+            self._addresses[address] = device_id
+            with self._locks[stripe]:
+                self._records[stripe][device_id] = record
+        return record
+
+    def remove(self, device_id):
+        """
+        Unregister client and release its device id
+
+        :param device_id: Device id of client
+        :type device_id: int
+        :return: Removed record (None - not registered)
+        :rtype: None | ClientRecord
+        """
+        stripe = device_id % self._stripes
+        with self._lock:
+            with self._locks[stripe]:
+                record = self._records[stripe].pop(device_id, None)
+            if record is None:
+                return None
+            if self._addresses.get(record.address) == device_id:
+                del self._addresses[record.address]
+            self._device_ids.release(device_id)
+        return record
+
+    def get(self, device_id):
+        """
+        Get record of client
+
+        The record is shared - use update() to change seats and snapshot()
+        for a consistent copy
+
+        :param device_id: Device id of client
+        :type device_id: int
+        :return: The record (None - not registered)
+        :rtype: None | ClientRecord
+        """
+        stripe = device_id % self._stripes
+        with self._locks[stripe]:
+            return self._records[stripe].get(device_id)
+
+    def device_id(self, address):
+        """
+        Get device id registered for address
+
+        :param address: Client ip address and port
+        :type address: (unicode, int)
+        :return: The device id (None - not registered)
+        :rtype: None | int
+        """
+        with self._lock:
+            return self._addresses.get(address)
+
+    def update(self, device_id, seats, payload=None, encoding=ENCODING_RAW):
+        """
+        Set seat states of client
+
+        Only as many seats as registered are updated
+
+        :param device_id: Device id of client
+        :type device_id: int
+        :param seats: Sitting state per person (one byte per person)
+        :type seats: bytearray
+        :param payload: Packed seats (kept for update_payload())
+            (default: None)
+        :type payload: None | str
+        :param encoding: Encoding of payload (default: ENCODING_RAW)
+        :type encoding: int
+        :return: Indices of changed seats (None - not registered)
+        :rtype: None | list[int]
+        """
+        stripe = device_id % self._stripes
+        with self._locks[stripe]:
+            record = self._records[stripe].get(device_id)
+            if record is None:
+                return None
+            current = record.seats
+            if len(seats) != len(current):
+                seats = seats[:len(current)]
+                payload = None
+            if Person.BITS_PER_PERSON == 1:
+                record.payload = payload
+                record.encoding = encoding
+            if len(seats) < len(current):
+                # Only the seats given
+                changed = diff_seats(current[:len(seats)], seats)
+            else:
+                changed = diff_seats(current, seats)
+            for index in changed:
+                current[index] = seats[index]
+        return changed
+
+    def update_payload(self, device_id, payload, encoding=ENCODING_RAW):
+        """
+        Set seat states of client from packed seats (UPDATE payload)
+        by comparing them to the last payload
+
+        :param device_id: Device id of client
+        :type device_id: int
+        :param payload: Packed seats
+        :type payload: str
+        :param encoding: Encoding of payload (default: ENCODING_RAW)
+            Only bitmaps are XOR-ed - others are only compared
+        :type encoding: None | int
+        :return: Indices of changed seats
+            None -> not registered or not comparable (decode and update())
+        :rtype: None | list[int]
+        """
+        stripe = device_id % self._stripes
+        with self._locks[stripe]:
+            record = self._records[stripe].get(device_id)
+            if record is None:
+                return None
+            last = record.payload
+            if last is None:
+                return None
+            if payload == last and encoding == record.encoding:
+                return []
+            if encoding != ENCODING_RAW or record.encoding != ENCODING_RAW:
+                return None
+            seats = record.seats
+            changed = diff_bits(last, payload, len(seats))
+            if changed is None:
+                return None
+            for index in changed:
+                seats[index] ^= 1
+            record.payload = payload
+        return changed
+
+    def set_baseline(self, device_id, seq):
+        """
+        Keep current seats as baseline for DELTAs
+
+        :param device_id: Device id of client
+        :type device_id: int
+        :param seq: Sequence number of the UPDATE that set the seats
+        :type seq: int
+        :rtype: None
+        """
+        stripe = device_id % self._stripes
+        with self._locks[stripe]:
+            record = self._records[stripe].get(device_id)
+            if record is not None:
+                record.baseline = (seq, bytearray(record.seats))
+
+    def update_delta(self, device_id, seq, indices):
+        """
+        Set seat states of client from a DELTA - baseline with the seats
+        at indices flipped
+
+        :param device_id: Device id of client
+        :type device_id: int
+        :param seq: Sequence number of baseline
+        :type seq: int
+        :param indices: Indices of seats differing from baseline
+        :type indices: list[int]
+        :return: Indices of changed seats
+            None -> not registered or baseline unknown (resync)
+        :rtype: None | list[int]
+        :raises IndexError: Index out of range
+        """
+        stripe = device_id % self._stripes
+        with self._locks[stripe]:
+            record = self._records[stripe].get(device_id)
+            if record is None or record.baseline is None \
+                    or record.baseline[0] != seq:
+                return None
+            seats = bytearray(record.baseline[1])
+            for index in indices:
+                seats[index] ^= 1
+            changed = diff_seats(record.seats, seats)
+            if not changed:
+                return changed
+            record.seats = seats
+            # No longer matches seats
+            record.payload = None
+        return changed
+
+    def snapshot(self):
+        """
+        Copy all records (each consistent in itself)
+
+        :return: Record copies ordered by device id
+        :rtype: list[ClientRecord]
+        """
+        res = []
+        for lock, records in zip(self._locks, self._records):
+            with lock:
+                res.extend(record.copy() for record in records.values())
+        res.sort(key=lambda record: record.device_id)
+        return res
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __contains__(self, device_id):
+        stripe = device_id % self._stripes
+        with self._locks[stripe]:
+            return device_id in self._records[stripe]
+
+    def __len__(self):
+        return sum(len(records) for records in self._records)
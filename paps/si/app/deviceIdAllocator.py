@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-16"
+# Created: 2016-05-16 09:30
+"""
+Hand out device ids in constant time
+
+Ids are unsigned 16 bit (header field). Released ids are handed out
+again oldest first, so a stale client keeps its old id as long as
+possible before it is reused.
+"""
+
+import collections
+
+from .message import Id
+
+
+DEVICE_ID_FIRST = Id.SERVER + 1
+""" Lowest device id of a client """
+DEVICE_ID_LAST = 0xffff
+""" Highest device id (16 bit header field) """
+
+
+class DeviceIdAllocator(object):
+    """ Device ids in use and free for clients """
+
+    def __init__(self, first=DEVICE_ID_FIRST, last=DEVICE_ID_LAST):
+        """
+        Initialize object
+
+        :param first: Lowest id to hand out (default: DEVICE_ID_FIRST)
+        :type first: int
+        :param last: Highest id to hand out (default: DEVICE_ID_LAST)
+        :type last: int
+        :rtype: None
+        """
+        self.first = first
+        """ Lowest id to hand out
+            :type first: int """
+        self.last = last
+        """ Highest id to hand out
+            :type last: int """
+        self._next = first
+        """ Lowest id never handed out
+            :type _next: int """
+        self._free = collections.deque()
+        """ Released ids (oldest first) - may hold ids reserved since
+            :type _free: collections.deque[int] """
+        self._used = set()
+        """ Ids in use
+            :type _used: set[int] """
+
+    def allocate(self):
+        """
+        Get an unused id
+
+        :return: The device id
+        :rtype: int
+        :raises ValueError: All ids in use
+        """
+        used = self._used
+        free = self._free
+        while free:
+            device_id = free.popleft()
+            # Skip ids reserved after release
+            if device_id not in used:
+                used.add(device_id)
+                return device_id
+        while self._next <= self.last:
+            device_id = self._next
+            self._next += 1
+            if device_id not in used:
+                used.add(device_id)
+                return device_id
+        raise ValueError("No device id left")
+
+    def reserve(self, device_id):
+        """
+        Mark id as in use (e.g. client rejoins with known id)
+
+        :param device_id: Id to reserve
+        :type device_id: int
+        :rtype: None
+        :raises ValueError: Id out of range
+        """
+        if not self.first <= device_id <= self.last:
+            raise ValueError("Device id {} out of range".format(device_id))
+        self._used.add(device_id)
+
+    def release(self, device_id):
+        """
+        Free id for reuse (unknown ids are ignored)
+
+        :param device_id: Id to release
+        :type device_id: int
+        :rtype: None
+        """
+        if device_id in self._used:
+            self._used.remove(device_id)
+            self._free.append(device_id)
+
+    def __contains__(self, device_id):
+        return device_id in self._used
+
+    def __len__(self):
+        return len(self._used)
@@ -0,0 +1,270 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-13"
+# Created: 2016-05-13 14:10
+"""
+Bounded inbox of received packets
+
+Control packets (JOIN/UNJOIN/ACK/CONFIG/RESYNC) are always handed out before
+bulk packets (UPDATE, DATA, ..), so they do not wait behind a flood of
+state updates. They are never dropped - bulk packets are dropped if the
+inbox is full. A packet with a sequence number is checked with accepts()
+before it is acked, so a dropped one gets retransmitted by the sender.
+
+An UPDATE/DELTA replaces the UPDATE/DELTA of the same device still
+waiting in the inbox (only the newest state matters). An acked UPDATE
+(DELTA baseline) is never replaced - later states queue up behind it.
+"""
+
+import collections
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    # running python3
+    import queue
+
+from .message import MsgType
+
+
+CONTROL = 0
+BULK = 1
+""" Priority classes (lower is handed out first) """
+PRIORITY_NAMES = ("control", "bulk")
+""" Names of priority classes (for stats) """
+_CONTROL_TYPES = frozenset((
+    MsgType.JOIN, MsgType.UNJOIN, MsgType.ACK, MsgType.CONFIG,
+    MsgType.RESYNC
+))
+""" Message types of control class """
+_STATE_TYPES = frozenset((MsgType.UPDATE, MsgType.DELTA))
+""" Message types carrying the complete state of a device """
+
+
+class Inbox(object):
+    """ Queue of received packets - (ip, port, packet) """
+
+    def __init__(self, maxsize=4096):
+        """
+        Initialize object
+
+        :param maxsize: Max number of waiting bulk packets (default: 4096)
+            0 -> unbounded
+        :type maxsize: int
+        :rtype: None
+        """
+        super(Inbox, self).__init__()
+        self.maxsize = maxsize
+        """ Max number of waiting bulk packets (0 - unbounded)
+            :type maxsize: int """
+        self._queues = tuple(collections.deque() for _ in PRIORITY_NAMES)
+        """ Waiting packets per priority class - [ip, port, packet, put time]
+            :type _queues: tuple[collections.deque[list]] """
+        self._size = 0
+        """ Number of waiting packets (all classes)
+            :type _size: int """
+        self._updates = {}
+        """ Waiting UPDATEs - (ip, port, device id) -> queue entry
+            :type _updates: dict[(str, int, int), list] """
+        self._not_empty = threading.Condition()
+        """ Lock for queue/wakes up get() """
+        self._woken = False
+        """ wake() called - next get() without packet returns right away """
+        self.coalesced = 0
+        """ Number of UPDATEs replaced by a newer one
+            :type coalesced: int """
+        self.dropped = 0
+        """ Number of packets dropped because inbox was full
+            :type dropped: int """
+        self._handled = [0] * len(PRIORITY_NAMES)
+        """ Number of packets taken per class """
+        self._wait_total = [0.0] * len(PRIORITY_NAMES)
+        """ Seconds packets waited in inbox per class """
+        self._wait_max = [0.0] * len(PRIORITY_NAMES)
+        """ Longest wait in inbox per class """
+
+    def put(self, item):
+        """
+        Add received packet
+
+        :param item: Sender ip, port and packet
+        :type item: (str, int, paps.si.app.message.APPMessage)
+        :return: Was packet added (False - dropped)
+        :rtype: bool
+        """
+        ip, port, packet = item
+        header = packet.header
+        message_type = header.message_type
+        with self._not_empty:
+            if message_type in _CONTROL_TYPES:
+                self._queues[CONTROL].append([ip, port, packet, time.time()])
+                self._size += 1
+                self._not_empty.notify()
+                return True
+            is_update = message_type in _STATE_TYPES
+            if is_update:
+                key = (ip, port, header.device_id)
+                if header.sequence_number is not None:
+                    # Baseline - must not be replaced
+                    self._updates.pop(key, None)
+                    is_update = False
+                else:
+                    entry = self._updates.get(key)
+                    if entry is not None:
+                        # Latest state wins (waiting since first one)
+                        entry[2] = packet
+                        self.coalesced += 1
+                        return True
+            bulk = self._queues[BULK]
+            if self.maxsize and len(bulk) >= self.maxsize:
+                self.dropped += 1
+                return False
+            entry = [ip, port, packet, time.time()]
+            bulk.append(entry)
+            self._size += 1
+            if is_update:
+                self._updates[key] = entry
+            self._not_empty.notify()
+        return True
+
+    def accepts(self, item):
+        """
+        Check if a packet would be added by put() (counted as dropped if not)
+
+        Only valid until another packet is put (a get() just makes room)
+
+        :param item: Sender ip, port and packet
+        :type item: (str, int, paps.si.app.message.APPMessage)
+        :return: Would packet be added (False - dropped)
+        :rtype: bool
+        """
+        if not self.maxsize:
+            return True
+        ip, port, packet = item
+        header = packet.header
+        message_type = header.message_type
+        with self._not_empty:
+            if message_type in _CONTROL_TYPES \
+                    or len(self._queues[BULK]) < self.maxsize:
+                return True
+            if message_type in _STATE_TYPES \
+                    and header.sequence_number is None \
+                    and (ip, port, header.device_id) in self._updates:
+                # Replaces waiting state
+                return True
+            self.dropped += 1
+        return False
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return oldest packet of highest priority class
+
+        :param block: Wait for a packet (default: True)
+        :type block: bool
+        :param timeout: Max seconds to wait (default: None)
+            None -> wait forever
+        :type timeout: None | float
+        :return: Sender ip, port and packet
+        :rtype: (str, int, paps.si.app.message.APPMessage)
+        :raises queue.Empty: No packet waiting (or woken up by wake())
+        """
+        with self._not_empty:
+            if not block:
+                if not self._size:
+                    raise queue.Empty()
+            elif timeout is None:
+                while not self._size:
+                    if self._woken:
+                        self._woken = False
+                        raise queue.Empty()
+                    self._not_empty.wait()
+            else:
+                end = time.time() + timeout
+                while not self._size:
+                    remaining = end - time.time()
+                    if self._woken:
+                        self._woken = False
+                        raise queue.Empty()
+                    if remaining <= 0:
+                        raise queue.Empty()
+                    self._not_empty.wait(remaining)
+            for priority, waiting in enumerate(self._queues):
+                if waiting:
+                    break
+            ip, port, packet, put_time = entry = waiting.popleft()
+            self._size -= 1
+            if priority == BULK:
+                key = (ip, port, packet.header.device_id)
+                if self._updates.get(key) is entry:
+                    del self._updates[key]
+            wait = time.time() - put_time
+            self._handled[priority] += 1
+            self._wait_total[priority] += wait
+            if wait > self._wait_max[priority]:
+                self._wait_max[priority] = wait
+        return ip, port, packet
+
+    def wake(self):
+        """
+        Make a waiting (or the next) get() return without a packet
+        (e.g. on stop)
+
+        :rtype: None
+        """
+        with self._not_empty:
+            self._woken = True
+            self._not_empty.notify_all()
+
+    def qsize(self):
+        """
+        Number of waiting packets
+
+        :rtype: int
+        """
+        with self._not_empty:
+            return self._size
+
+    def empty(self):
+        """
+        Is no packet waiting
+
+        :rtype: bool
+        """
+        with self._not_empty:
+            return not self._size
+
+    def stats(self):
+        """
+        Get the inbox counters
+
+        :return: size, maxsize, coalesced, dropped and per priority class
+            (control/bulk) size, handled, wait_avg and wait_max (seconds)
+        :rtype: dict
+        """
+        with self._not_empty:
+            res = {
+                'size': self._size,
+                'maxsize': self.maxsize,
+                'coalesced': self.coalesced,
+                'dropped': self.dropped,
+            }
+            for priority, name in enumerate(PRIORITY_NAMES):
+                handled = self._handled[priority]
+                res[name] = {
+                    'size': len(self._queues[priority]),
+                    'handled': handled,
+                    'wait_avg': self._wait_total[priority] / handled
+                    if handled else 0.0,
+                    'wait_max': self._wait_max[priority],
+                }
+            return res
@@ -15,18 +15,23 @@ __date__ = "2016-03-29"
 import logging
 import calendar
 import datetime
+import time
 import tzlocal
 import struct
 
 from enum import IntEnum, unique
 import pytz
-from flotils.loadable import loadJSON, saveJSON
 
 from ...papsException import PapsException
 from ...person import Person
+from .peopleCodec import PeopleView, people_to_bits, pack_bits, \
+    encode_bits, decode_bits, ENCODING_RAW, ENCODING_RLE, ENCODING_SPARSE
+from .payloadSerializer import JSON_SERIALIZER, BINARY_SERIALIZER
 
 
 BYTE_ORDER = ">"
+_NOT_DECODED = object()
+""" Marker for a payload that has not been decoded yet """
 local_tz = tzlocal.get_localzone()
 logger = logging.getLogger(__name__)
 
@@ -49,6 +54,10 @@ class MsgType(IntEnum):
     """ Client changed """
     DATA = 5
     """ Transmit data (json) object """
+    DELTA = 6
+    """ Client changed - only people changed since an acked UPDATE """
+    RESYNC = 7
+    """ Server requests an acked UPDATE (DELTA baseline unknown) """
 
 
 @unique
@@ -59,6 +68,31 @@ class Flag(IntEnum):
     """ Is sequence number present for pack """
     ACKSEQ = 2
     """ Is sequence number present for an ack """
+    BINARY = 4
+    """ Is the payload (JOIN/CONFIG/DATA) encoded with the binary serializer
+        instead of json """
+    ACKMASK = 8
+    """ Is a mask of further acked sequence numbers present (needs ACKSEQ) """
+    RLE = 16
+    """ Are the people (UPDATE) run-length encoded instead of a bitmap """
+    SPARSE = 32
+    """ Are the people (UPDATE) encoded as indices differing from the
+        majority instead of a bitmap """
+
+
+# Plain int copies of the flags (enum member lookup is slow on the hot path)
+_FLAG_SEQ = int(Flag.SEQ)
+_FLAG_ACKSEQ = int(Flag.ACKSEQ)
+_FLAG_ACKMASK = int(Flag.ACKMASK)
+_FLAGS_OPTIONAL = _FLAG_SEQ | _FLAG_ACKSEQ | _FLAG_ACKMASK
+""" Flags of optional header fields """
+_FLAGS_RESERVED = _FLAGS_OPTIONAL | int(Flag.RLE) | int(Flag.SPARSE)
+""" Flags a serializer can not use (optional header fields and UPDATE
+    people encoding) """
+_MESSAGE_TYPES = frozenset(
+    int(msg_type) for msg_type in MsgType if msg_type > MsgType.NOT_SET
+)
+""" Valid message types for transmission """
 
 
 @unique
@@ -100,6 +134,10 @@ def format_message_type(message_type):
         return "UPDATE"
     elif message_type == MsgType.DATA:
         return "DATA"
+    elif message_type == MsgType.DELTA:
+        return "DELTA"
+    elif message_type == MsgType.RESYNC:
+        return "RESYNC"
     else:
         return u"{}".format(message_type)
 
@@ -126,20 +164,9 @@ def guess_class(message_type):
     :type message_type: int
     :return: The corresponding class or None if not found
     :rtype: None | APPUnjoinMessage | APPUpdateMessage """\
-    """ | APPJoinMessage | APPDataMessage | APPConfigMessage  """
-    if message_type == MsgType.UNJOIN:
-        return APPUnjoinMessage
-    elif message_type == MsgType.UPDATE:
-        return APPUpdateMessage
-    elif message_type == MsgType.JOIN:
-        return APPJoinMessage
-    elif message_type == MsgType.DATA:
-        return APPDataMessage
-    elif message_type == MsgType.CONFIG:
-        return APPConfigMessage
-    elif message_type == MsgType.ACK:
-        return APPMessage
-    return None
+    """ | APPJoinMessage | APPDataMessage | APPConfigMessage """\
+    """ | APPDeltaMessage | APPResyncMessage """
+    return message_classes.get(message_type)
 
 
 def guess_message_type(message):
@@ -162,22 +189,117 @@ def guess_message_type(message):
         return MsgType.UPDATE
     elif isinstance(message, APPUnjoinMessage):
         return MsgType.UNJOIN
+    elif isinstance(message, APPDeltaMessage):
+        return MsgType.DELTA
+    elif isinstance(message, APPResyncMessage):
+        return MsgType.RESYNC
     # APPMessage -> ACK?
     return None
 
 
+def _header_structs(fmt_header, fmt_seq, fmt_seq_ack, fmt_ack_mask):
+    """
+    Precompile the complete header for each combination of optional fields
+
+    :param fmt_header: Format of fixed part of header
+    :type fmt_header: str
+    :param fmt_seq: Format of sequence number
+    :type fmt_seq: str
+    :param fmt_seq_ack: Format of ack sequence number
+    :type fmt_seq_ack: str
+    :param fmt_ack_mask: Format of ack mask
+    :type fmt_ack_mask: str
+    :return: (flags & (SEQ | ACKSEQ | ACKMASK)) -> struct.Struct
+    :rtype: dict[int, struct.Struct]
+    """
+    res = {}
+    for seq in (0, _FLAG_SEQ):
+        for ack in (0, _FLAG_ACKSEQ):
+            for mask in (0, _FLAG_ACKMASK):
+                fmt = fmt_header
+                if seq:
+                    fmt += fmt_seq[1:]
+                if ack:
+                    fmt += fmt_seq_ack[1:]
+                if mask:
+                    fmt += fmt_ack_mask[1:]
+                res[seq | ack | mask] = struct.Struct(fmt)
+    return res
+
+
+def _optional_structs(fmt_seq, fmt_seq_ack, fmt_ack_mask):
+    """
+    Precompile the optional header fields for each combination of flags
+    (an ack mask without ack sequence number is not read)
+
+    :param fmt_seq: Format of sequence number
+    :type fmt_seq: str
+    :param fmt_seq_ack: Format of ack sequence number
+    :type fmt_seq_ack: str
+    :param fmt_ack_mask: Format of ack mask
+    :type fmt_ack_mask: str
+    :return: (flags & (SEQ | ACKSEQ | ACKMASK)) -> struct.Struct
+    :rtype: dict[int, struct.Struct]
+    """
+    res = _header_structs(BYTE_ORDER, fmt_seq, fmt_seq_ack, fmt_ack_mask)
+    for flags in list(res):
+        if flags & _FLAG_ACKMASK and not flags & _FLAG_ACKSEQ:
+            res[flags] = res[flags & ~_FLAG_ACKMASK]
+    return res
+
+
 class APPHeader(object):
     """ Header for message """
 
+    __slots__ = (
+        "message_type", "device_id", "payload_length", "flags",
+        "_timestamp", "sequence_number", "ack_sequence_number", "ack_mask",
+        "version_major", "version_minor",
+    )
+
     fmt_header = BYTE_ORDER + "BBHfHH"
+    fmt_header_usec = BYTE_ORDER + "BBHQHH"
     fmt_seq = BYTE_ORDER + "I"
     fmt_seq_ack = BYTE_ORDER + "I"
+    fmt_ack_mask = BYTE_ORDER + "I"
+
+    ACK_MASK_BITS = 32
+    """ Number of sequence numbers (after ack_sequence_number) in ack_mask """
+
+    VERSION_USEC = 0x11
+    """ Version byte (1.1) using a timestamp in microseconds """
+
+    struct_version = struct.Struct(BYTE_ORDER + "B")
+    """ Precompiled version field """
+    struct_header = struct.Struct(fmt_header)
+    """ Precompiled fixed part of the header """
+    struct_header_usec = struct.Struct(fmt_header_usec)
+    """ Precompiled fixed part of the header (timestamp in microseconds) """
+    struct_seq = struct.Struct(fmt_seq)
+    """ Precompiled sequence number field """
+    struct_seq_ack = struct.Struct(fmt_seq_ack)
+    """ Precompiled ack sequence number field """
+    struct_ack_mask = struct.Struct(fmt_ack_mask)
+    """ Precompiled ack mask field """
+    structs_pack = _header_structs(
+        fmt_header, fmt_seq, fmt_seq_ack, fmt_ack_mask
+    )
+    """ Precompiled complete header for each combination of optional fields
+        (flags & (SEQ | ACKSEQ | ACKMASK)) -> struct.Struct """
+    structs_pack_usec = _header_structs(
+        fmt_header_usec, fmt_seq, fmt_seq_ack, fmt_ack_mask
+    )
+    """ Precompiled complete header (timestamp in microseconds) for each
+        combination of optional fields """
+    structs_optional = _optional_structs(fmt_seq, fmt_seq_ack, fmt_ack_mask)
+    """ Precompiled optional fields (following the fixed part) for each
+        combination of flags (flags & (SEQ | ACKSEQ | ACKMASK)) """
 
     def __init__(
         self, message_type=MsgType.NOT_SET, device_id=Id.NOT_SET,
         payload_length=0, flags=0,
         timestamp=None, sequence_number=None, ack_sequence_number=None,
-        version_major=1, version_minor=0
+        version_major=1, version_minor=0, ack_mask=None
     ):
         """
         Initialize object
@@ -191,8 +313,8 @@ class APPHeader(object):
         :param flags: Transmit flags (default: 0)
         :type flags: int
         :param timestamp: Message timestamp (default: None)
-            None sets it automatically to current time
-            Preferred: utc and datetime
+            None sets it to the current time when packed
+            Preferred: utc and float (unix timestamp)
         :type timestamp: None | float | datetime.datetime
         :param sequence_number: Sequence number of package (default: None)
             if it is None -> no sequence number
@@ -203,7 +325,11 @@ class APPHeader(object):
         :param version_major: Major of used protocol version (default: 1)
         :type version_major: int
         :param version_minor: Minor of used protocol version (default: 0)
+            From 1.1 on the timestamp is transmitted in microseconds
         :type version_minor: int
+        :param ack_mask: Further sequence numbers to be acked (default: None)
+            bit i set -> ack_sequence_number + 1 + i is acked too
+        :type ack_mask: None | int
         :rtype: None
         :raises ValueError: Message type not set
         """
@@ -223,11 +349,9 @@ class APPHeader(object):
         """ Transmit flags
             :type flags: int """
         self._timestamp = None
-        """ Timestamp of the header
-            :type _timestamp: float """
-        if timestamp is None:
-            self.set_timestamp_to_current()
-        else:
+        """ Timestamp of the header (unix timestamp in utc)
+            :type _timestamp: None | float """
+        if timestamp is not None:
             self.timestamp = timestamp
 
         self.sequence_number = sequence_number
@@ -242,6 +366,30 @@ class APPHeader(object):
         self.version_minor = version_minor
         """ Minor of used protocol version
             :type version_minor: int """
+        self.ack_mask = ack_mask
+        """ Further sequence numbers to be acked (only with ack)
+            - bit i set -> ack_sequence_number + 1 + i
+            :type ack_mask: None | int """
+
+    def acked_sequence_numbers(self):
+        """
+        Get all sequence numbers acked by this header
+
+        :return: Acked sequence numbers
+        :rtype: list[int]
+        """
+        ack_seq = self.ack_sequence_number
+        if ack_seq is None:
+            return []
+        res = [ack_seq]
+        mask = self.ack_mask
+        i = 1
+        while mask:
+            if mask & 1:
+                res.append((ack_seq + i) & 0xffffffff)
+            mask >>= 1
+            i += 1
+        return res
 
     @property
     def version(self):
@@ -316,47 +464,169 @@ class APPHeader(object):
 
         :rtype: None
         """
-        # Good form to add tzinfo
-        self.timestamp = pytz.UTC.localize(datetime.datetime.utcnow())
+        # Raw unix timestamp - datetime only created when read
+        self._timestamp = time.time()
 
-    def pack(self, update_timestamp=False):
+    def _pack_args(self, update_timestamp):
         """
-        Pack this object into a transmittable format
+        Validate header and prepare struct and values for packing
 
-        :param update_timestamp:
-            Should the timestamp be updated to current (default: False)
+        :param update_timestamp: Should the timestamp be updated to current
         :type update_timestamp: bool
-        :return: Packed data
-        :rtype: bytearray
+        :return: Struct to use and values to pack
+        :rtype: (struct.Struct, tuple)
         :raises ValueError: Invalid device id/message type
         """
         if self.device_id <= Id.NOT_SET or not isinstance(self.device_id, int):
             raise ValueError("Invalid device id")
-        if self.message_type <= MsgType.NOT_SET \
-                or not isinstance(self.message_type, int) \
-                or self.message_type not in list(MsgType):
+        if not isinstance(self.message_type, int) \
+                or self.message_type not in _MESSAGE_TYPES:
             raise ValueError("Invalid message type")
         if update_timestamp or not self._timestamp:
             self.set_timestamp_to_current()
-        append = b""
+        version = (self.version_major << 4) + self.version_minor
+        if version == self.VERSION_USEC:
+            structs = self.structs_pack_usec
+            timestamp = int(round(self._timestamp * 1000000))
+        else:
+            structs = self.structs_pack
+            timestamp = self._timestamp
+        values = [
+            version,
+            self.message_type,
+            self.payload_length,
+            timestamp,
+            self.device_id,
+            0
+        ]
+        # Optional fields are flagged by what is set
+        flags = self.flags & ~_FLAGS_OPTIONAL
 
         if self.sequence_number is not None:
-            self.flags |= Flag.SEQ
-            append += struct.pack(self.fmt_seq, self.sequence_number)
+            flags |= _FLAG_SEQ
+            values.append(self.sequence_number)
         if self.ack_sequence_number is not None:
-            self.flags |= Flag.ACKSEQ
-            append += struct.pack(self.fmt_seq_ack, self.ack_sequence_number)
+            flags |= _FLAG_ACKSEQ
+            values.append(self.ack_sequence_number)
+            if self.ack_mask:
+                flags |= _FLAG_ACKMASK
+                values.append(self.ack_mask)
+        self.flags = values[5] = flags
+        return structs[flags & _FLAGS_OPTIONAL], values
 
-        packed = struct.pack(
-            self.fmt_header,
-            (self.version_major << 4) + self.version_minor,
-            self.message_type,
-            self.payload_length,
-            self._timestamp,
-            self.device_id,
-            self.flags
-        )
-        return packed + append
+    def pack(self, update_timestamp=False):
+        """
+        Pack this object into a transmittable format
+
+        :param update_timestamp:
+            Should the timestamp be updated to current (default: False)
+        :type update_timestamp: bool
+        :return: Packed data
+        :rtype: str
+        :raises ValueError: Invalid device id/message type
+        """
+        packer, values = self._pack_args(update_timestamp)
+        return packer.pack(*values)
+
+    def pack_into(self, buffer, offset=0, update_timestamp=False):
+        """
+        Pack this object directly into a writable buffer
+
+        :param buffer: Buffer to write to
+        :type buffer: bytearray | memoryview
+        :param offset: Start writing at this position (default: 0)
+        :type offset: int
+        :param update_timestamp:
+            Should the timestamp be updated to current (default: False)
+        :type update_timestamp: bool
+        :return: Position in buffer after the header
+        :rtype: int
+        :raises ValueError: Invalid device id/message type
+        :raises struct.error: Buffer too small
+        """
+        packer, values = self._pack_args(update_timestamp)
+        packer.pack_into(buffer, offset, *values)
+        return offset + packer.size
+
+    @property
+    def size(self):
+        """
+        Get the packed size of this header
+
+        :return: Number of bytes
+        :rtype: int
+        """
+        if (self.version_major << 4) + self.version_minor \
+                == self.VERSION_USEC:
+            size = self.struct_header_usec.size
+        else:
+            size = self.struct_header.size
+        if self.sequence_number is not None:
+            size += self.struct_seq.size
+        if self.ack_sequence_number is not None:
+            size += self.struct_seq_ack.size
+            if self.ack_mask:
+                size += self.struct_ack_mask.size
+        return size
+
+    @classmethod
+    def unpack_from(cls, data, offset=0):
+        """
+        Unpack an instance from data without copying it
+
+        :param data: Packed data
+        :type data: str | bytearray | memoryview
+        :param offset: Start reading at this position (default: 0)
+        :type offset: int
+        :return: Object instance and position after the header
+        :rtype: (APPHeader, int)
+        :raises ProtocolViolation: Data too short
+        """
+        try:
+            unpacker = cls.struct_header
+            (
+                version, msg_type, payload_len,
+                timestamp, device_id, flags,
+            ) = unpacker.unpack_from(data, offset)
+            if version == cls.VERSION_USEC:
+                # Layout of the header depends on the version
+                unpacker = cls.struct_header_usec
+                (
+                    version, msg_type, payload_len,
+                    timestamp, device_id, flags,
+                ) = unpacker.unpack_from(data, offset)
+                timestamp /= 1000000.0
+            offset += unpacker.size
+            optional = flags & _FLAGS_OPTIONAL
+            if optional:
+                # All optional fields at once
+                unpacker = cls.structs_optional[optional]
+                values = unpacker.unpack_from(data, offset)
+                offset += unpacker.size
+        except struct.error:
+            raise ProtocolViolation("Header too small")
+        # Per datagram - skip the keyword arguments of __init__
+        header = cls.__new__(cls)
+        header.message_type = msg_type
+        header.device_id = device_id
+        header.payload_length = payload_len
+        header.flags = flags
+        header._timestamp = timestamp
+        header.version_major = version >> 4
+        header.version_minor = version & 0xf
+        header.sequence_number = None
+        header.ack_sequence_number = None
+        header.ack_mask = None
+        if optional:
+            if optional & _FLAG_SEQ:
+                header.sequence_number = values[0]
+            if optional & _FLAG_ACKSEQ:
+                header.ack_sequence_number = values[
+                    1 if optional & _FLAG_SEQ else 0
+                ]
+                if optional & _FLAG_ACKMASK:
+                    header.ack_mask = values[-1]
+        return header, offset
 
     @classmethod
     def unpack(cls, data):
@@ -368,37 +638,8 @@ class APPHeader(object):
         :return: Object instance and remaining data
         :rtype: (APPHeader, str)
         """
-        size = struct.calcsize(APPHeader.fmt_header)
-        (
-            version, msg_type, payload_len,
-            timestamp, device_id, flags,
-        ), payload = struct.unpack(
-            APPHeader.fmt_header, data[:size]
-        ), data[size:]
-        ack_sequence_number = None
-        sequence_number = None
-
-        if flags & Flag.ACKSEQ:
-            size = struct.calcsize(APPHeader.fmt_seq_ack)
-            (ack_sequence_number,), payload = struct.unpack(
-                APPHeader.fmt_seq_ack, payload[:size]
-            ), payload[size:]
-        if flags & Flag.SEQ:
-            size = struct.calcsize(APPHeader.fmt_seq)
-            (sequence_number,), payload = struct.unpack(
-                APPHeader.fmt_seq, payload[:size]
-            ), payload[size:]
-        return cls(
-            message_type=msg_type,
-            version_major=version >> 4,
-            version_minor=version & 0xf,
-            payload_length=payload_len,
-            device_id=device_id,
-            sequence_number=sequence_number,
-            flags=flags,
-            timestamp=timestamp,
-            ack_sequence_number=ack_sequence_number
-        ), payload
+        header, offset = cls.unpack_from(data)
+        return header, data[offset:]
 
     def __str__(self):
         """
@@ -442,9 +683,11 @@ class APPHeader(object):
 class APPMessage(object):
     """ Base class for all messages  """
 
+    __slots__ = ("_header", "_payload")
+
     def __init__(
             self, message_type=MsgType.NOT_SET,
-            device_id=Id.REQUEST, payload=""
+            device_id=Id.REQUEST, payload=b""
     ):
         """
         Initialize object
@@ -510,6 +753,16 @@ class APPMessage(object):
     """ Message payload
         :type payload: str """
 
+    @property
+    def raw_payload(self):
+        """
+        Get the payload as transmitted
+
+        :return: Encoded payload
+        :rtype: str
+        """
+        return self._payload
+
     @property
     def header(self):
         """
@@ -520,7 +773,7 @@ class APPMessage(object):
         """
         return self._header
 
-    def pack(self, update_timestamp=False, insert_before_payload=""):
+    def pack(self, update_timestamp=False, insert_before_payload=b""):
         """
         Pack this object into a transmittable format
 
@@ -534,9 +787,57 @@ class APPMessage(object):
         :rtype: str
         :raises ValueError: Invalid deviceId
         """
+        # Get payload first - encoding it might update the header
+        payload = self.raw_payload
         return self._header.pack(update_timestamp) \
             + insert_before_payload \
-            + self._payload
+            + payload
+
+    @classmethod
+    def unpack_payload(cls, header, data, offset=0):
+        """
+        Create an instance from an already unpacked header and the data
+        following it (only the payload gets copied)
+
+        :param header: Unpacked header of message
+        :type header: APPHeader
+        :param data: Packed data
+        :type data: str | bytearray | memoryview
+        :param offset: Position of payload in data (default: 0)
+        :type offset: int
+        :return: Object instance and position after this message
+        :rtype: (APPMessage, int)
+        :raises ProtocolViolation: Data length smaller than payload length
+        """
+        end = offset + header.payload_length
+
+        if len(data) < end:
+            raise ProtocolViolation("Payload too small")
+        payload = data[offset:end]
+        if not isinstance(payload, bytes):
+            # Copy out of (reused) receive buffers
+            payload = memoryview(payload).tobytes()
+        # Skip __init__ - header and payload are already known
+        body = cls.__new__(cls)
+        body._header = header
+        body._payload = payload
+        return body, end
+
+    @classmethod
+    def unpack_from(cls, data, offset=0):
+        """
+        Unpack an instance from data (only the payload gets copied)
+
+        :param data: Packed data
+        :type data: str | bytearray | memoryview
+        :param offset: Start reading at this position (default: 0)
+        :type offset: int
+        :return: Object instance and position after this message
+        :rtype: (APPMessage, int)
+        :raises ProtocolViolation: Data length smaller than payload length
+        """
+        header, offset = APPHeader.unpack_from(data, offset)
+        return cls.unpack_payload(header, data, offset)
 
     @classmethod
     def unpack(cls, data):
@@ -549,15 +850,8 @@ class APPMessage(object):
         :rtype: (APPMessage, str)
         :raises ProtocolViolation: Data length smaller than payload length
         """
-        header, data = APPHeader.unpack(data)
-
-        if len(data) < header.payload_length:
-            raise ProtocolViolation("Payload too small")
-        payload = data[:header.payload_length]
-        body = cls()
-        body._header = header
-        body._payload = payload
-        return body, data[header.payload_length:]
+        body, offset = cls.unpack_from(data)
+        return body, data[offset:]
 
     def __str__(self):
         """
@@ -592,6 +886,8 @@ class APPGuessMessage(APPMessage):
     the message type
     """
 
+    __slots__ = ()
+
     def __init__(self, device_id=Id.REQUEST, payload=None):
         """
         Initialize object
@@ -604,7 +900,7 @@ class APPGuessMessage(APPMessage):
         :raises ValueError: Message type not settable
         """
         if payload is None:
-            payload = ""
+            payload = b""
         super(APPGuessMessage, self).__init__(
             message_type=None,
             device_id=device_id,
@@ -613,9 +909,30 @@ class APPGuessMessage(APPMessage):
 
 
 class APPDataMessage(APPGuessMessage):
-    """ Message to transmit json encoded data """
+    """
+    Message to transmit json encoded data
 
-    def __init__(self, device_id=Id.REQUEST, payload=None):
+    Payload is encoded/decoded lazily and both forms are cached.
+    Changing the payload object in place is not tracked
+    - assign it to payload again to update the encoded form.
+    The encoding is selected by the flags of the header
+    (see serializers - default json).
+    """
+
+    __slots__ = ("_data",)
+
+    serializers = {
+        0: JSON_SERIALIZER,
+        Flag.BINARY: BINARY_SERIALIZER,
+    }
+    """ Registered serializers - header flags -> serializer
+        :type serializers: dict[int, paps.si.app.payloadSerializer.Serializer]
+    """
+    serializer_mask = int(Flag.BINARY)
+    """ Header flags used to select a serializer
+        :type serializer_mask: int """
+
+    def __init__(self, device_id=Id.REQUEST, payload=None, serializer=0):
         """
         Initialize object
 
@@ -623,38 +940,169 @@ class APPDataMessage(APPGuessMessage):
         :type device_id: int
         :param payload: Payload of message (default: None)
         :type payload: None | dict
+        :param serializer: Flags of serializer to use (default: 0 - json)
+        :type serializer: int
         :rtype: None
         :raises ValueError: Message type not settable
         """
+        self._data = _NOT_DECODED
+        """ Decoded payload (_NOT_DECODED if not yet decoded) """
         super(APPDataMessage, self).__init__(
             device_id=device_id,
             payload=""
         )
         self.payload = payload
+        self.serializer = serializer
+
+    @staticmethod
+    def register_serializer(flags, serializer):
+        """
+        Register a serializer (for all data messages)
+
+        :param flags: Header flags selecting this serializer
+        :type flags: int
+        :param serializer: Serializer to register
+        :type serializer: paps.si.app.payloadSerializer.Serializer
+        :rtype: None
+        :raises ValueError: Flags collide with existing header flags
+        """
+        if flags & _FLAGS_RESERVED:
+            raise ValueError(
+                "Flags reserved for optional header fields/people encoding"
+            )
+        # Shared by all data messages
+        APPDataMessage.serializers[flags] = serializer
+        APPDataMessage.serializer_mask |= flags
+
+    @classmethod
+    def serializer_flags(cls, name):
+        """
+        Get the header flags of a serializer
+
+        :param name: Name of serializer
+        :type name: str | unicode
+        :return: Header flags selecting this serializer
+        :rtype: int
+        :raises KeyError: No serializer with this name registered
+        """
+        for flags, serializer in cls.serializers.items():
+            if serializer.name == name:
+                return int(flags)
+        raise KeyError(u"Serializer {} not registered".format(name))
+
+    def serializer_get(self):
+        """
+        Get the header flags of the used serializer
+
+        :return: Header flags selecting the serializer
+        :rtype: int
+        """
+        return self._header.flags & self.serializer_mask
+
+    def serializer_set(self, value):
+        """
+        Set the serializer to use (payload gets encoded again)
+
+        :param value: Header flags selecting the serializer
+        :type value: int
+        :rtype: None
+        :raises ValueError: Serializer not registered
+        """
+        if value not in self.serializers:
+            raise ValueError(u"Serializer {} not registered".format(value))
+        if value == self.serializer_get():
+            return
+        # Make sure payload is decoded with the old serializer
+        self.payload = self.payload
+        self._header.flags = (self._header.flags & ~self.serializer_mask) \
+            | value
+
+    serializer = property(serializer_get, serializer_set)
+    """ Header flags of the serializer used for the payload
+        :type serializer: int """
+
+    def update(self, obj):
+        """
+        Set this instance up based on another instance
+
+        :param obj: Instance to copy from
+        :type obj: APPMessage
+        :rtype: None
+        """
+        super(APPDataMessage, self).update(obj)
+        if isinstance(obj, APPDataMessage):
+            self._data = obj._data
+        elif isinstance(obj, APPMessage):
+            self._data = _NOT_DECODED
 
     def payload_get(self):
         """
-        Get the message payload
+        Get the message payload (decoded on first access)
 
         :return: Payload
-        :rtype: str
+        :rtype: None | dict | list | str | unicode | int | float | bool
+        :raises ProtocolViolation: Unknown serializer
+        :raises ValueError: Failed to decode
         """
-        payload = super(APPDataMessage, self).payload_get()
-        return loadJSON(payload)
+        data = self._data
+        if data is _NOT_DECODED:
+            serializer = self.serializers.get(self.serializer_get())
+            if serializer is None:
+                raise ProtocolViolation("Unknown payload serializer")
+            data = self._data = serializer.loads(self._payload)
+        return data
 
     def payload_set(self, value):
         """
-        Set the message payload (and update header)
+        Set the message payload (encoded on first pack)
 
         :param value: New payload value
-        :type value: str
+        :type value: None | dict | list | str | unicode | int | float | bool
         :rtype: None
         """
-        payload = saveJSON(value, pretty=False)
-        super(APPDataMessage, self).payload_set(payload)
+        self._data = value
+        self._payload = None
 
     payload = property(payload_get, payload_set)
 
+    @property
+    def raw_payload(self):
+        """
+        Get the payload as transmitted (encoded on first access)
+
+        :return: Encoded payload
+        :rtype: str
+        :raises ValueError: Failed to encode
+        """
+        if self._payload is None:
+            self._payload = self.serializers[self.serializer_get()].dumps(
+                self._data
+            )
+            self._header.payload_length = len(self._payload)
+        return self._payload
+
+    @classmethod
+    def unpack_payload(cls, header, data, offset=0):
+        """
+        Create an instance from an already unpacked header and the data
+        following it (payload is decoded on first access)
+
+        :param header: Unpacked header of message
+        :type header: APPHeader
+        :param data: Packed data
+        :type data: str | bytearray | memoryview
+        :param offset: Position of payload in data (default: 0)
+        :type offset: int
+        :return: Object instance and position after this message
+        :rtype: (APPDataMessage, int)
+        :raises ProtocolViolation: Data length smaller than payload length
+        """
+        body, end = super(APPDataMessage, cls).unpack_payload(
+            header, data, offset
+        )
+        body._data = _NOT_DECODED
+        return body, end
+
     def __str__(self):
         """
         String representation
@@ -684,25 +1132,49 @@ class APPDataMessage(APPGuessMessage):
 
 class APPJoinMessage(APPDataMessage):
     """ Message to join audience  """
-    pass
+    __slots__ = ()
 
 
 class APPConfigMessage(APPDataMessage):
     """ Message to change configuration """
-    pass
+    __slots__ = ()
 
 
 class APPUnjoinMessage(APPGuessMessage):
     """ Message to leave audience  """
-    pass
+    __slots__ = ()
 
 
 class APPUpdateMessage(APPMessage):
-    """ Message to update people """
+    """
+    Message to update people
+
+    The encoding of the people is selected by the flags of the header
+    (bitmap, run-length or sparse - see encodings). Unless given, the
+    smallest one is used.
+    """
+
+    __slots__ = ("_view", "_view_payload")
 
     fmt = BYTE_ORDER + "{}B"
+    encodings = {
+        0: ENCODING_RAW,
+        Flag.RLE: ENCODING_RLE,
+        Flag.SPARSE: ENCODING_SPARSE,
+    }
+    """ Header flags -> people encoding (paps.si.app.peopleCodec)
+        :type encodings: dict[int, int] """
+    encoding_mask = int(Flag.RLE | Flag.SPARSE)
+    """ Header flags used to select the encoding
+        :type encoding_mask: int """
+    _encoding_flags = dict(
+        (encoding, int(flags)) for flags, encoding in encodings.items()
+    )
+    """ People encoding -> header flags """
 
-    def __init__(self, device_id=Id.REQUEST, people=None):
+    def __init__(
+            self, device_id=Id.REQUEST, people=None, bits=None, encoding=None
+    ):
         """
         Initialize object
 
@@ -710,14 +1182,53 @@ class APPUpdateMessage(APPMessage):
         :type device_id: int
         :param people: People to be transmitted (default: None)
         :type people: None | list[paps.people.People]
+        :param bits: Bits of people to be transmitted - used instead of people
+            (one byte per bit) (default: None)
+        :type bits: None | bytearray
+        :param encoding: Encoding of people (paps.si.app.peopleCodec)
+            (default: None)
+            None -> smallest
+        :type encoding: None | int
         :rtype: None
-        :raises ValueError: Message type not settable
+        :raises ValueError: Message type not settable or
+            people not encodable with encoding
         """
-        if people is None:
-            people = []
+        if bits is None:
+            bits = people_to_bits(people or [])
+        encoding, payload = encode_bits(bits, encoding)
+        self._view = None
+        """ Cached people view of payload
+            :type _view: None | paps.si.app.peopleCodec.PeopleView """
+        self._view_payload = None
+        """ Payload the cached view belongs to
+            :type _view_payload: None | str """
         super(APPUpdateMessage, self).__init__(
-            None, device_id, payload=self._pack_people(people)
+            None, device_id, payload=payload
+        )
+        self._header.flags |= self._encoding_flags[encoding]
+
+    @classmethod
+    def unpack_payload(cls, header, data, offset=0):
+        """
+        Create an instance from an already unpacked header and the data
+        following it (only the payload gets copied)
+
+        :param header: Unpacked header of message
+        :type header: APPHeader
+        :param data: Packed data
+        :type data: str | bytearray | memoryview
+        :param offset: Position of payload in data (default: 0)
+        :type offset: int
+        :return: Object instance and position after this message
+        :rtype: (APPUpdateMessage, int)
+        :raises ProtocolViolation: Data length smaller than payload length
+        """
+        body, end = super(APPUpdateMessage, cls).unpack_payload(
+            header, data, offset
         )
+        body._view = None
+        body._view_payload = None
+        return body, end
 
     @staticmethod
     def _pack_people(people):
@@ -729,73 +1240,78 @@ class APPUpdateMessage(APPMessage):
         :return: The packed people
         :rtype: str
         """
-        res = bytearray()
-        bits = bytearray([1])
+        return pack_bits(people_to_bits(people))
 
-        for person in people:
-            bits.extend(person.to_bits())
-        aByte = 0
+    @property
+    def encoding(self):
+        """
+        Get the encoding of the people in payload
 
-        for i, bit in enumerate(bits[::-1]):
-            mod = i % 8
-            aByte |= bit << mod
-            if mod == 7 or i == len(bits) - 1:
-                res.append(aByte)
-                aByte = 0
-        return struct.pack(APPUpdateMessage.fmt.format(len(res)), *res[::-1])
+        :return: The encoding (paps.si.app.peopleCodec)
+            None -> unknown
+        :rtype: None | int
+        """
+        return self.encodings.get(self._header.flags & self.encoding_mask)
 
-    def people(self):
+    def people_view(self):
         """
-        The people list stored in payload (decoded upon every call())
+        Lazy view of the people stored in payload
+        (decoded once per payload)
 
         :return: The people
-        :rtype: list[paps.people.People]
+        :rtype: paps.si.app.peopleCodec.PeopleView
         :raises ProtocolViolation:
-            Failed to find marker
+            Failed to decode payload (e.g. marker not found)
             Wrong number of bits in payload -> cannot decode into people
         """
-        people = []
-        bits = bytearray()
-        byts = struct.unpack(
-            APPUpdateMessage.fmt.format(len(self.payload)), self.payload
-        )[::-1]
-        # indices = range(7, -1, -1)
-        indices = range(8)
-        for aByte in byts[:-1]:
-            for i in indices:
-                bit = aByte >> i & 1
-                bits.append(bit)
-        # find marker
-        mark = 7
-        aByte = byts[-1]
-        while aByte >> mark == 0 and mark > 0:
-            mark -= 1
-        if aByte >> mark != 1:
-            raise ProtocolViolation(u"Failed to find marker ({})".format(
-                format_data(self.payload)
+        payload = self._payload
+        if self._view is not None and self._view_payload is payload:
+            return self._view
+        encoding = self.encoding
+        if encoding is None:
+            raise ProtocolViolation(u"Unknown people encoding ({})".format(
+                self._header.flags & self.encoding_mask
             ))
-        # remove marker and add the rest
-        for i in range(mark):
-            bit = aByte >> i & 1
-            bits.append(bit)
-
-        if len(bits) % Person.BITS_PER_PERSON != 0:
+        try:
+            bits = decode_bits(encoding, payload)
+        except ValueError as e:
+            raise ProtocolViolation(u"{} ({})".format(
+                e, format_data(payload)
+            ))
+        try:
+            view = PeopleView(bits)
+        except ValueError:
             raise ProtocolViolation(
                 u"Payload seems to be malformed"
                 u" - Can not decode into people ({})".format(
-                    format_data(self.payload)
+                    format_data(payload)
                 )
             )
-        # reverse
-        i = len(bits)
-        while i > 0:
-            p = Person()
-            # select the bits for this person and bring them in the right order
-            # bits is currently in reverse order
-            p.from_bits(bits[i - Person.BITS_PER_PERSON:i][::-1])
-            people.append(p)
-            i -= Person.BITS_PER_PERSON
-        return people
+        self._view = view
+        self._view_payload = payload
+        return view
+
+    def bits(self):
+        """
+        The bits of all people stored in payload
+
+        :return: Bits (one byte per bit)
+        :rtype: bytearray
+        :raises ProtocolViolation: Failed to decode payload
+        """
+        return self.people_view().bits
+
+    def people(self):
+        """
+        The people list stored in payload (new instances upon every call)
+
+        :return: The people
+        :rtype: list[paps.people.People]
+        :raises ProtocolViolation:
+            Failed to find marker
+            Wrong number of bits in payload -> cannot decode into people
+        """
+        return list(self.people_view())
 
     def __str__(self):
         """
@@ -822,3 +1338,139 @@ class APPUpdateMessage(APPMessage):
             self.header,
             [u"{}".format(person) for person in self.people()]
         )
+
+
+class APPDeltaMessage(APPMessage):
+    """
+    Message to update people relative to an acked UPDATE (baseline)
+
+    Payload is the sequence number of the baseline followed by the
+    indices of all people that differ from it (not only the ones changed
+    since the last DELTA - a lost DELTA needs no retransmit)
+    """
+
+    __slots__ = ()
+
+    struct_baseline = struct.Struct(BYTE_ORDER + "I")
+    """ Precompiled baseline field """
+    fmt_indices = BYTE_ORDER + "{}H"
+    MAX_INDEX = 0xffff
+    """ Highest person index transmittable """
+
+    def __init__(self, device_id=Id.REQUEST, baseline=0, indices=None):
+        """
+        Initialize object
+
+        :param device_id: Device id of sender (Id) (default: REQUEST)
+        :type device_id: int
+        :param baseline: Sequence number of acked UPDATE (default: 0)
+        :type baseline: int
+        :param indices: Indices of people differing from baseline
+            (default: None)
+        :type indices: None | list[int]
+        :rtype: None
+        :raises ValueError: Message type not settable
+        """
+        super(APPDeltaMessage, self).__init__(
+            None, device_id, payload=self._pack_delta(baseline, indices or [])
+        )
+
+    @classmethod
+    def _pack_delta(cls, baseline, indices):
+        """
+        Pack baseline and indices
+
+        :param baseline: Sequence number of acked UPDATE
+        :type baseline: int
+        :param indices: Indices of people differing from baseline
+        :type indices: list[int]
+        :return: The packed delta
+        :rtype: str
+        :raises struct.error: Value out of range
+        """
+        return cls.struct_baseline.pack(baseline) + struct.pack(
+            cls.fmt_indices.format(len(indices)), *indices
+        )
+
+    @staticmethod
+    def packed_size(number):
+        """
+        Payload size of a delta
+
+        :param number: Number of indices
+        :type number: int
+        :rtype: int
+        """
+        return APPDeltaMessage.struct_baseline.size + 2 * number
+
+    def baseline(self):
+        """
+        Sequence number of the UPDATE the indices refer to
+
+        :rtype: int
+        :raises ProtocolViolation: Payload too small
+        """
+        try:
+            return self.struct_baseline.unpack_from(self._payload)[0]
+        except struct.error:
+            raise ProtocolViolation("Delta payload too small")
+
+    def indices(self):
+        """
+        Indices of people differing from baseline
+
+        :rtype: tuple[int]
+        :raises ProtocolViolation: Malformed payload
+        """
+        payload = self._payload
+        size = self.struct_baseline.size
+        number, odd = divmod(len(payload) - size, 2)
+        if number < 0 or odd:
+            raise ProtocolViolation(
+                u"Delta payload malformed ({})".format(format_data(payload))
+            )
+        return struct.unpack_from(
+            self.fmt_indices.format(number), payload, size
+        )
+
+    def __str__(self):
+        """
+        String representation
+
+        :return: Representation
+        :rtype: str
+        """
+        return "<{}> ({}; Base:{}; Idx:{})".format(
+            type(self).__name__, self.header, self.baseline(), self.indices()
+        )
+
+    def __unicode__(self):
+        """
+        Unicode representation
+
+        :return: Representation
+        :rtype: unicode
+        """
+        return u"<{}> ({}; Base:{}; Idx:{})".format(
+            type(self).__name__, self.header, self.baseline(), self.indices()
+        )
+
+
+class APPResyncMessage(APPGuessMessage):
+    """ Message requesting an acked UPDATE (new DELTA baseline) """
+    __slots__ = ()
+
+
+message_classes = {
+    MsgType.ACK: APPMessage,
+    MsgType.JOIN: APPJoinMessage,
+    MsgType.CONFIG: APPConfigMessage,
+    MsgType.UNJOIN: APPUnjoinMessage,
+    MsgType.UPDATE: APPUpdateMessage,
+    MsgType.DATA: APPDataMessage,
+    MsgType.DELTA: APPDeltaMessage,
+    MsgType.RESYNC: APPResyncMessage,
+}
+""" Message type (MsgType) -> message class
+    :type message_classes: dict[int, type] """
+
@@ -0,0 +1,326 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-05"
+# Created: 2016-05-05 10:20
+"""
+Serializers for the payload of JOIN/CONFIG/DATA messages
+
+JSON is the default. The binary serializer is a compact tagged encoding
+of json-like values (big-endian). Lists of people dicts
+({'sitting': bool, 'id': ..}) are stored as a table: ids as one array
+and the sitting states as a bit string (see peopleCodec).
+"""
+
+import struct
+
+from flotils.loadable import loadJSON, saveJSON
+
+from .peopleCodec import pack_bits, unpack_bits
+
+try:
+    _text_type = unicode
+    _integer_types = (int, long)
+except NameError:
+    # running python3
+    _text_type = str
+    _integer_types = (int,)
+
+
+class Serializer(object):
+    """ Base class for payload serializers """
+
+    name = None
+    """ Name of serializer (used in settings)
+        :type name: str """
+
+    def dumps(self, value):
+        """
+        Encode value
+
+        :param value: Value to encode
+        :type value: None | dict | list | str | unicode | int | float | bool
+        :return: Encoded value
+        :rtype: str
+        :raises ValueError: Value not encodable
+        """
+        raise NotImplementedError("Please implement")
+
+    def loads(self, data):
+        """
+        Decode value
+
+        :param data: Encoded value
+        :type data: str
+        :return: Decoded value
+        :rtype: None | dict | list | unicode | int | float | bool
+        :raises ValueError: Data not decodable
+        """
+        raise NotImplementedError("Please implement")
+
+
+class JSONSerializer(Serializer):
+    """ JSON encoding (flotils) """
+
+    name = "json"
+
+    def dumps(self, value):
+        data = saveJSON(value, pretty=False)
+        if isinstance(data, _text_type):
+            data = data.encode("utf-8")
+        return data
+
+    def loads(self, data):
+        return loadJSON(data)
+
+
+class BinarySerializer(Serializer):
+    """ Compact tagged binary encoding """
+
+    name = "binary"
+
+    NONE = 0
+    FALSE = 1
+    TRUE = 2
+    INT8 = 3
+    INT16 = 4
+    INT32 = 5
+    INT64 = 6
+    FLOAT = 7
+    STRING = 8
+    LIST = 9
+    DICT = 10
+    PEOPLE = 11
+    """ Type tags """
+    IDS_VALUES = 0
+    IDS_UINT16 = 1
+    """ How the ids of a people table are stored """
+
+    _tag = struct.Struct(">B")
+    _length = struct.Struct(">H")
+    _table = struct.Struct(">HB")
+    _numbers = {
+        INT8: struct.Struct(">b"),
+        INT16: struct.Struct(">h"),
+        INT32: struct.Struct(">i"),
+        INT64: struct.Struct(">q"),
+        FLOAT: struct.Struct(">d"),
+    }
+
+    def dumps(self, value):
+        parts = []
+        try:
+            self._encode(value, parts)
+        except struct.error:
+            raise ValueError("Value too big for binary payload")
+        return b"".join(parts)
+
+    def loads(self, data):
+        try:
+            value, offset = self._decode(data, 0)
+        except (struct.error, IndexError, KeyError, UnicodeDecodeError):
+            raise ValueError("Malformed binary payload")
+        if offset != len(data):
+            raise ValueError("Trailing data in binary payload")
+        return value
+
+    def _encode(self, value, parts):
+        """
+        Encode value and append the encoded parts
+
+        :param value: Value to encode
+        :type value: None | dict | list | str | unicode | int | float | bool
+        :param parts: Encoded parts
+        :type parts: list[str]
+        :rtype: None
+        :raises ValueError: Value not encodable
+        """
+        tag = self._tag.pack
+        if value is None:
+            parts.append(tag(self.NONE))
+        elif value is True:
+            parts.append(tag(self.TRUE))
+        elif value is False:
+            parts.append(tag(self.FALSE))
+        elif isinstance(value, _integer_types):
+            for number_tag, limit in (
+                (self.INT8, 0x80), (self.INT16, 0x8000),
+                (self.INT32, 0x80000000), (self.INT64, 0x8000000000000000)
+            ):
+                if -limit <= value < limit:
+                    parts.append(tag(number_tag))
+                    parts.append(self._numbers[number_tag].pack(value))
+                    return
+            raise ValueError(u"Integer {} out of range".format(value))
+        elif isinstance(value, float):
+            parts.append(tag(self.FLOAT))
+            parts.append(self._numbers[self.FLOAT].pack(value))
+        elif isinstance(value, (bytes, _text_type)):
+            if isinstance(value, _text_type):
+                value = value.encode("utf-8")
+            parts.append(tag(self.STRING))
+            parts.append(self._length.pack(len(value)))
+            parts.append(value)
+        elif isinstance(value, dict):
+            parts.append(tag(self.DICT))
+            parts.append(self._length.pack(len(value)))
+            for key, item in value.items():
+                self._encode(key, parts)
+                self._encode(item, parts)
+        elif isinstance(value, (list, tuple)):
+            if value and self._is_people(value):
+                self._encode_people(value, parts)
+                return
+            parts.append(tag(self.LIST))
+            parts.append(self._length.pack(len(value)))
+            for item in value:
+                self._encode(item, parts)
+        else:
+            raise ValueError(u"Type {} not encodable".format(type(value)))
+
+    def _is_people(self, value):
+        """
+        Check if value is a list of people dicts
+
+        :param value: Value to check
+        :type value: list | tuple
+        :rtype: bool
+        """
+        for item in value:
+            if not isinstance(item, dict) or len(item) != 2 \
+                    or not isinstance(item.get('sitting'), bool) \
+                    or 'id' not in item:
+                return False
+        return True
+
+    def _encode_people(self, people, parts):
+        """
+        Encode list of people dicts as table
+
+        :param people: People dicts ({'sitting': bool, 'id': ..})
+        :type people: list[dict]
+        :param parts: Encoded parts
+        :type parts: list[str]
+        :rtype: None
+        """
+        ids = [person['id'] for person in people]
+        if all(
+            isinstance(i, _integer_types) and not isinstance(i, bool)
+            and 0 <= i <= 0xffff for i in ids
+        ):
+            ids_format = self.IDS_UINT16
+        else:
+            ids_format = self.IDS_VALUES
+        parts.append(self._tag.pack(self.PEOPLE))
+        parts.append(self._table.pack(len(ids), ids_format))
+        if ids_format == self.IDS_UINT16:
+            parts.append(struct.pack(">{}H".format(len(ids)), *ids))
+        else:
+            for i in ids:
+                self._encode(i, parts)
+        bits = pack_bits(bytearray([
+            1 if person['sitting'] else 0 for person in people
+        ]))
+        parts.append(self._length.pack(len(bits)))
+        parts.append(bits)
+
+    def _decode(self, data, offset):
+        """
+        Decode one value
+
+        :param data: Encoded data
+        :type data: str
+        :param offset: Position of value
+        :type offset: int
+        :return: Value and position after it
+        :rtype: (object, int)
+        """
+        tag, = self._tag.unpack_from(data, offset)
+        offset += 1
+        if tag == self.NONE:
+            return None, offset
+        elif tag == self.TRUE:
+            return True, offset
+        elif tag == self.FALSE:
+            return False, offset
+        elif tag in self._numbers:
+            number = self._numbers[tag]
+            return number.unpack_from(data, offset)[0], offset + number.size
+        elif tag == self.STRING:
+            length, = self._length.unpack_from(data, offset)
+            offset += 2
+            if offset + length > len(data):
+                raise IndexError("String exceeds data")
+            return data[offset:offset + length].decode("utf-8"), \
+                offset + length
+        elif tag == self.LIST:
+            length, = self._length.unpack_from(data, offset)
+            offset += 2
+            res = []
+            for _ in range(length):
+                item, offset = self._decode(data, offset)
+                res.append(item)
+            return res, offset
+        elif tag == self.DICT:
+            length, = self._length.unpack_from(data, offset)
+            offset += 2
+            res = {}
+            for _ in range(length):
+                key, offset = self._decode(data, offset)
+                res[key], offset = self._decode(data, offset)
+            return res, offset
+        elif tag == self.PEOPLE:
+            return self._decode_people(data, offset)
+        raise KeyError(tag)
+
+    def _decode_people(self, data, offset):
+        """
+        Decode a people table
+
+        :param data: Encoded data
+        :type data: str
+        :param offset: Position of table (after tag)
+        :type offset: int
+        :return: People dicts and position after them
+        :rtype: (list[dict], int)
+        """
+        count, ids_format = self._table.unpack_from(data, offset)
+        offset += self._table.size
+        if ids_format == self.IDS_UINT16:
+            fmt = ">{}H".format(count)
+            ids = struct.unpack_from(fmt, data, offset)
+            offset += struct.calcsize(fmt)
+        elif ids_format == self.IDS_VALUES:
+            ids = []
+            for _ in range(count):
+                i, offset = self._decode(data, offset)
+                ids.append(i)
+        else:
+            raise KeyError(ids_format)
+        length, = self._length.unpack_from(data, offset)
+        offset += 2
+        if offset + length > len(data):
+            raise IndexError("People exceed data")
+        try:
+            bits = unpack_bits(data[offset:offset + length])
+        except ValueError:
+            raise IndexError("Failed to decode people")
+        if len(bits) != count:
+            raise IndexError("Number of ids and people do not match")
+        return [
+            {'sitting': bit == 1, 'id': i} for i, bit in zip(ids, bits)
+        ], offset + length
+
+
+JSON_SERIALIZER = JSONSerializer()
+""" Default serializer """
+BINARY_SERIALIZER = BinarySerializer()
+""" Compact binary serializer """
@@ -0,0 +1,649 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-03"
+# Created: 2016-05-03 09:40
+"""
+Bulk encoding of people states for APP UPDATE messages
+
+The payload is a big-endian bit string starting with a marker bit (1)
+followed by the bits of every person in order. Bits are handled as a
+bytearray with one byte (0 or 1) per bit, so no per-bit python loop is
+necessary.
+
+Besides this raw bitmap two more compact encodings are available for
+mostly uniform states (e.g. a whole row sitting):
+- run-length: value of the first run (one byte) followed by the length
+  of every run (varint - 7 bits per byte, least significant first,
+  high bit set on all but the last byte)
+- sparse: majority value (one byte), number of bits (16 bit) and the
+  indices of the bits differing from the majority (16 bit each)
+encode_bits() picks the smallest one, if no encoding is given.
+"""
+
+import binascii
+import struct
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from ...person import Person
+
+
+NUMPY_MIN_BITS = 1024
+""" Use numpy (if available) from this number of bits upwards """
+NUMPY_MIN_RUNS = 32
+""" Use numpy (if available) from this number of runs upwards """
+NUMPY_MIN_INDICES = 64
+""" Use numpy (if available) from this number of sparse indices upwards """
+_BIT_TO_CHAR = b"01" + b"\x00" * 254
+""" Translate table: bit value (0/1) -> ascii digit """
+_CHAR_TO_BIT = b"\x00" * 48 + b"\x00\x01" + b"\x00" * 206
+""" Translate table: ascii digit -> bit value (0/1) """
+
+ENCODING_RAW = 0
+""" Bitmap with leading marker bit """
+ENCODING_RLE = 1
+""" Run lengths """
+ENCODING_SPARSE = 2
+""" Indices of bits differing from the majority """
+ENCODING_NAMES = {
+    "raw": ENCODING_RAW,
+    "rle": ENCODING_RLE,
+    "sparse": ENCODING_SPARSE,
+}
+""" Name -> encoding """
+MAX_BITS = 65507 * 8
+""" Most bits a raw payload carries in one datagram - longer run-length
+    payloads are rejected (a few bytes would decode to huge states) """
+SPARSE_MAX_BITS = 0xffff
+""" Most bits of a sparse payload (16 bit indices) """
+_SPARSE_HEAD = struct.Struct(">BH")
+""" Majority value and number of bits """
+_SPARSE_INDICES = ">{}H"
+_BIT_BYTES = (b"\x00", b"\x01")
+""" Bit value -> byte to search for """
+
+
+def people_to_bits(people):
+    """
+    Get the bits of people
+
+    :param people: People to encode
+    :type people: list[paps.person.Person]
+    :return: Bits (one byte per bit)
+    :rtype: bytearray
+    """
+    if Person.BITS_PER_PERSON == 1:
+        return bytearray([1 if person.sitting else 0 for person in people])
+    bits = bytearray()
+    for person in people:
+        bits.extend(person.to_bits())
+    return bits
+
+
+def pack_bits(bits):
+    """
+    Pack bits (prefixed with the marker) into bytes
+
+    :param bits: Bits to pack (one byte per bit)
+    :type bits: bytearray
+    :return: Packed bits
+    :rtype: str
+    """
+    if numpy is not None and len(bits) >= NUMPY_MIN_BITS:
+        return _pack_bits_numpy(bits)
+    value = int(b"1" + bytes(bits.translate(_BIT_TO_CHAR)), 2)
+    hexed = "%x" % value
+    if len(hexed) % 2:
+        hexed = "0" + hexed
+    return binascii.unhexlify(hexed)
+
+
+def _pack_bits_numpy(bits):
+    """
+    Pack bits with numpy.packbits
+
+    :param bits: Bits to pack (one byte per bit)
+    :type bits: bytearray
+    :return: Packed bits
+    :rtype: str
+    """
+    padding = 7 - len(bits) % 8
+    arr = numpy.zeros(padding + 1 + len(bits), dtype=numpy.uint8)
+    arr[padding] = 1
+    arr[padding + 1:] = numpy.frombuffer(bytes(bits), dtype=numpy.uint8)
+    return numpy.packbits(arr).tobytes()
+
+
+def unpack_bits(data):
+    """
+    Unpack bytes into bits (marker removed)
+
+    :param data: Packed bits
+    :type data: str | bytearray
+    :return: Bits (one byte per bit)
+    :rtype: bytearray
+    :raises ValueError: Failed to find marker
+    """
+    if not data or not bytearray(data[:1])[0]:
+        # Marker has to be in the first byte
+        raise ValueError("Failed to find marker")
+    if numpy is not None and len(data) * 8 >= NUMPY_MIN_BITS:
+        return _unpack_bits_numpy(data)
+    # bin() -> '0b1...' - strip prefix and marker
+    return bytearray(
+        bin(int(binascii.hexlify(data), 16))[3:].encode("ascii")
+    ).translate(_CHAR_TO_BIT)
+
+
+def _unpack_bits_numpy(data):
+    """
+    Unpack bytes with numpy.unpackbits
+
+    :param data: Packed bits
+    :type data: str | bytearray
+    :return: Bits (one byte per bit)
+    :rtype: bytearray
+    """
+    arr = numpy.unpackbits(numpy.frombuffer(bytes(data), dtype=numpy.uint8))
+    marker = int(numpy.argmax(arr[:8]))
+    return bytearray(arr[marker + 1:].tobytes())
+
+
+def diff_bits(old, new, size):
+    """
+    Get the indices of bits that differ between two packed bit strings
+    (XOR of both) without unpacking them
+
+    :param old: Packed bits (known to be valid)
+    :type old: str | bytearray
+    :param new: Packed bits
+    :type new: str | bytearray
+    :param size: Number of bits in old (without marker)
+    :type size: int
+    :return: Indices of differing bits (ascending)
+        None -> not comparable (length or marker differs)
+    :rtype: None | list[int]
+    """
+    if len(old) != len(new):
+        return None
+    diff = int(binascii.hexlify(old), 16) ^ int(binascii.hexlify(new), 16)
+    if diff >> size:
+        # Marker (or padding) differs
+        return None
+    res = []
+    while diff:
+        lowest = diff & -diff
+        # Bit i (from the right) belongs to index size - 1 - i
+        res.append(size - lowest.bit_length())
+        diff ^= lowest
+    res.reverse()
+    return res
+
+
+def diff_seats(old, new):
+    """
+    Get the indices of bits that differ between two bit arrays
+    (XOR of both - no per bit python loop)
+
+    :param old: Bits (one byte per bit)
+    :type old: bytearray
+    :param new: Bits (one byte per bit - same length as old)
+    :type new: bytearray
+    :return: Indices of differing bits (ascending)
+    :rtype: list[int]
+    """
+    if old == new:
+        return []
+    diff = int(binascii.hexlify(old), 16) ^ int(binascii.hexlify(new), 16)
+    # Back to one byte (0/1) per bit
+    diff = bytearray(binascii.unhexlify("%0*x" % (2 * len(old), diff)))
+    one = _BIT_BYTES[1]
+    find = diff.find
+    res = []
+    index = find(one)
+    while index >= 0:
+        res.append(index)
+        index = find(one, index + 1)
+    return res
+
+
+def _runs(bits, limit=None):
+    """
+    Get the run lengths of bits
+
+    Runs are searched one by one - from NUMPY_MIN_RUNS on numpy (if
+    available) finds all of them at once
+
+    :param bits: Bits (one byte per bit)
+    :type bits: bytearray
+    :param limit: Stop as soon as the encoded runs would reach this many
+        bytes (default: None)
+        None -> no limit
+    :type limit: None | int
+    :return: Run lengths (None - limit reached)
+    :rtype: None | list[int]
+    """
+    size = len(bits)
+    res = []
+    # Value byte
+    total = 1
+    pos = 0
+    value = bits[0] if size else 0
+    find = bits.find
+    while pos < size:
+        if numpy is not None and len(res) == NUMPY_MIN_RUNS:
+            res = _runs_numpy(bits)
+            # At least one byte per run
+            if limit is not None and (
+                len(res) >= limit or _rle_size(res) >= limit
+            ):
+                return None
+            return res
+        # Run ends where the other value starts
+        value ^= 1
+        end = find(_BIT_BYTES[value], pos)
+        if end < 0:
+            end = size
+        length = end - pos
+        total += (length.bit_length() + 6) // 7
+        if limit is not None and total >= limit:
+            return None
+        res.append(length)
+        pos = end
+    return res
+
+
+def _rle_size(runs):
+    """
+    Get the size of the run-length encoding of runs
+
+    :param runs: Run lengths
+    :type runs: list[int]
+    :return: Number of bytes
+    :rtype: int
+    """
+    return 1 + sum((length.bit_length() + 6) // 7 for length in runs)
+
+
+def _pack_runs(first, runs):
+    """
+    Encode runs
+
+    :param first: Value of first run
+    :type first: int
+    :param runs: Run lengths
+    :type runs: list[int]
+    :return: Value of first run and varint run lengths
+    :rtype: str
+    """
+    res = bytearray(_BIT_BYTES[first])
+    for length in runs:
+        while length > 0x7f:
+            res.append(0x80 | length & 0x7f)
+            length >>= 7
+        res.append(length)
+    return bytes(res)
+
+
+def rle_size(bits):
+    """
+    Get the size of the run-length encoding of bits
+
+    :param bits: Bits (one byte per bit)
+    :type bits: bytearray
+    :return: Number of bytes
+    :rtype: int
+    """
+    return _rle_size(_runs(bits))
+
+
+def sparse_size(bits):
+    """
+    Get the size of the sparse encoding of bits
+
+    :param bits: Bits (one byte per bit)
+    :type bits: bytearray
+    :return: Number of bytes (None - too many bits)
+    :rtype: None | int
+    """
+    size = len(bits)
+    if size > SPARSE_MAX_BITS:
+        return None
+    ones = bits.count(_BIT_BYTES[1])
+    return _SPARSE_HEAD.size + 2 * min(ones, size - ones)
+
+
+def _choose(bits):
+    """
+    Get the encoding producing the smallest payload
+    (raw on a tie, then sparse)
+
+    :param bits: Bits (one byte per bit)
+    :type bits: bytearray
+    :return: The encoding and the runs (only for ENCODING_RLE)
+    :rtype: (int, None | list[int])
+    """
+    best = ENCODING_RAW
+    best_size = len(bits) // 8 + 1
+    size = sparse_size(bits)
+    if size is not None and size < best_size:
+        best = ENCODING_SPARSE
+        best_size = size
+    if len(bits) <= MAX_BITS:
+        # Only counted as long as smaller than the best so far
+        runs = _runs(bits, best_size)
+        if runs is not None and _rle_size(runs) < best_size:
+            return ENCODING_RLE, runs
+    return best, None
+
+
+def choose_encoding(bits):
+    """
+    Get the encoding producing the smallest payload
+    (raw on a tie, then sparse)
+
+    :param bits: Bits (one byte per bit)
+    :type bits: bytearray
+    :return: The encoding
+    :rtype: int
+    """
+    return _choose(bits)[0]
+
+
+def encode_bits(bits, encoding=None):
+    """
+    Encode bits
+
+    :param bits: Bits (one byte per bit)
+    :type bits: bytearray
+    :param encoding: Encoding to use (default: None)
+        None -> smallest (choose_encoding())
+    :type encoding: None | int
+    :return: Used encoding and encoded bits
+    :rtype: (int, str)
+    :raises ValueError: Unknown encoding or too many bits for it
+    """
+    if encoding is None:
+        encoding, runs = _choose(bits)
+        if runs is not None:
+            return encoding, _pack_runs(bits[0], runs)
+    if encoding == ENCODING_RAW:
+        return encoding, pack_bits(bits)
+    elif encoding == ENCODING_RLE:
+        return encoding, pack_rle(bits)
+    elif encoding == ENCODING_SPARSE:
+        return encoding, pack_sparse(bits)
+    raise ValueError(u"Unknown encoding {}".format(encoding))
+
+
+def decode_bits(encoding, data):
+    """
+    Decode bits
+
+    :param encoding: Encoding of data
+    :type encoding: int
+    :param data: Encoded bits
+    :type data: str | bytearray
+    :return: Bits (one byte per bit)
+    :rtype: bytearray
+    :raises ValueError: Unknown encoding or malformed data
+    """
+    if encoding == ENCODING_RAW:
+        return unpack_bits(data)
+    elif encoding == ENCODING_RLE:
+        return unpack_rle(data)
+    elif encoding == ENCODING_SPARSE:
+        return unpack_sparse(data)
+    raise ValueError(u"Unknown encoding {}".format(encoding))
+
+
+def pack_rle(bits):
+    """
+    Run-length encode bits
+
+    :param bits: Bits (one byte per bit)
+    :type bits: bytearray
+    :return: Value of first run and varint run lengths
+    :rtype: str
+    :raises ValueError: Too many bits
+    """
+    if len(bits) > MAX_BITS:
+        raise ValueError("Too many bits for run-length encoding")
+    return _pack_runs(bits[0] if bits else 0, _runs(bits))
+
+
+def unpack_rle(data):
+    """
+    Decode run-length encoded bits
+
+    :param data: Value of first run and varint run lengths
+    :type data: str | bytearray
+    :return: Bits (one byte per bit)
+    :rtype: bytearray
+    :raises ValueError: Malformed data
+    """
+    data = bytearray(data)
+    if not data or data[0] > 1:
+        raise ValueError("Invalid value of first run")
+    if data[-1] & 0x80:
+        raise ValueError("Truncated run length")
+    if numpy is not None and len(data) > NUMPY_MIN_RUNS * 2:
+        return _unpack_rle_numpy(data)
+    runs = data[1:]
+    if runs and max(runs) & 0x80:
+        # Multi byte lengths
+        lengths = []
+        length = 0
+        shift = 0
+        for byte in runs:
+            length |= (byte & 0x7f) << shift
+            if byte & 0x80:
+                shift += 7
+                continue
+            lengths.append(length)
+            length = 0
+            shift = 0
+        runs = lengths
+    if sum(runs) > MAX_BITS:
+        raise ValueError("Too many bits")
+    value = data[0]
+    res = bytearray()
+    for length in runs:
+        res += _BIT_BYTES[value] * length
+        value ^= 1
+    return res
+
+
+def pack_sparse(bits):
+    """
+    Encode bits as the indices differing from the majority
+
+    :param bits: Bits (one byte per bit)
+    :type bits: bytearray
+    :return: Majority value, number of bits and indices
+    :rtype: str
+    :raises ValueError: Too many bits
+    """
+    size = len(bits)
+    if size > SPARSE_MAX_BITS:
+        raise ValueError("Too many bits for sparse encoding")
+    ones = bits.count(_BIT_BYTES[1])
+    majority = 1 if ones * 2 > size else 0
+    if numpy is not None and min(ones, size - ones) >= NUMPY_MIN_INDICES:
+        indices = numpy.flatnonzero(
+            numpy.frombuffer(bytes(bits), dtype=numpy.uint8) != majority
+        ).astype(">u2").tobytes()
+    else:
+        other = _BIT_BYTES[majority ^ 1]
+        find = bits.find
+        res = []
+        index = find(other)
+        while index >= 0:
+            res.append(index)
+            index = find(other, index + 1)
+        indices = struct.pack(_SPARSE_INDICES.format(len(res)), *res)
+    return _SPARSE_HEAD.pack(majority, size) + indices
+
+
+def unpack_sparse(data):
+    """
+    Decode sparse encoded bits
+
+    :param data: Majority value, number of bits and indices
+    :type data: str | bytearray
+    :return: Bits (one byte per bit)
+    :rtype: bytearray
+    :raises ValueError: Malformed data
+    """
+    head = _SPARSE_HEAD.size
+    number, odd = divmod(len(data) - head, 2)
+    if number < 0 or odd:
+        raise ValueError("Malformed sparse data")
+    majority, size = _SPARSE_HEAD.unpack_from(data)
+    if majority > 1:
+        raise ValueError("Invalid majority value")
+    if numpy is not None and number >= NUMPY_MIN_INDICES:
+        indices = numpy.frombuffer(bytes(data[head:]), dtype=">u2")
+        if indices.max() >= size:
+            raise ValueError("Sparse index out of range")
+        arr = numpy.full(size, majority, dtype=numpy.uint8)
+        arr[indices] = majority ^ 1
+        return bytearray(arr.tobytes())
+    res = bytearray(_BIT_BYTES[majority] * size)
+    other = majority ^ 1
+    try:
+        for index in struct.unpack_from(
+            _SPARSE_INDICES.format(number), data, head
+        ):
+            res[index] = other
+    except IndexError:
+        raise ValueError("Sparse index out of range")
+    return res
+
+
+def _runs_numpy(bits):
+    """
+    Get the run lengths of bits with numpy
+
+    :param bits: Bits (one byte per bit)
+    :type bits: bytearray
+    :return: Run lengths
+    :rtype: list[int]
+    """
+    arr = numpy.frombuffer(bytes(bits), dtype=numpy.uint8)
+    # Positions where a new run starts (plus both ends)
+    edges = numpy.concatenate((
+        [0], numpy.flatnonzero(arr[1:] != arr[:-1]) + 1, [len(arr)]
+    ))
+    return numpy.diff(edges).tolist()
+
+
+def _unpack_rle_numpy(data):
+    """
+    Decode run-length encoded bits with numpy
+
+    :param data: Value of first run and varint run lengths
+        (first run value and last byte validated)
+    :type data: bytearray
+    :return: Bits (one byte per bit)
+    :rtype: bytearray
+    :raises ValueError: Malformed data
+    """
+    arr = numpy.frombuffer(bytes(data[1:]), dtype=numpy.uint8)
+    if arr.max() < 0x80:
+        # Single byte lengths
+        lengths = arr
+    else:
+        ends = numpy.flatnonzero(arr < 0x80)
+        starts = numpy.concatenate(([0], ends[:-1] + 1))
+        sizes = ends - starts + 1
+        if sizes.max() > 3:
+            # Values above MAX_BITS
+            raise ValueError("Too many bits")
+        # Position of each byte in its varint -> shift of its 7 bits
+        shifts = 7 * (numpy.arange(len(arr)) - numpy.repeat(starts, sizes))
+        lengths = numpy.add.reduceat(
+            (arr & 0x7f).astype(numpy.int64) << shifts, starts
+        )
+    if lengths.sum(dtype=numpy.int64) > MAX_BITS:
+        raise ValueError("Too many bits")
+    values = (numpy.arange(len(lengths)) + data[0]) & 1
+    return bytearray(
+        numpy.repeat(values.astype(numpy.uint8), lengths).tobytes()
+    )
+
+
+class PeopleView(object):
+    """
+    Read-only sequence of people backed by bits
+
+    People are only created when accessed
+    """
+
+    __slots__ = ("bits",)
+
+    def __init__(self, bits):
+        """
+        Initialize object
+
+        :param bits: Bits of all people (one byte per bit)
+        :type bits: bytearray
+        :rtype: None
+        :raises ValueError: Number of bits does not match people
+        """
+        super(PeopleView, self).__init__()
+        if len(bits) % Person.BITS_PER_PERSON != 0:
+            raise ValueError("Can not decode into people")
+        self.bits = bits
+        """ Bits of all people (one byte per bit)
+            :type bits: bytearray """
+
+    def sitting(self, index):
+        """
+        Get the sitting state of a person without creating it
+
+        :param index: Index of person
+        :type index: int
+        :return: Is the person sitting
+        :rtype: bool
+        :raises IndexError: Index out of range
+        """
+        if Person.BITS_PER_PERSON != 1:
+            return self[index].sitting
+        return bool(self.bits[index])
+
+    def __len__(self):
+        return len(self.bits) // Person.BITS_PER_PERSON
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        size = len(self)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("Person index out of range")
+        start = index * Person.BITS_PER_PERSON
+        return Person().from_bits(
+            self.bits[start:start + Person.BITS_PER_PERSON]
+        )
+
+    def __iter__(self):
+        if Person.BITS_PER_PERSON == 1:
+            for bit in self.bits:
+                yield Person(sitting=bit == 1)
+        else:
+            for index in range(len(self)):
+                yield self[index]
@@ -0,0 +1,128 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-10"
+# Created: 2016-05-10 14:10
+"""
+Round trip time estimation for the retransmission timeout (RFC 6298)
+
+Only packets acked on their first transmission give a sample
+(Karn's rule) - the caller has to take care of that.
+"""
+
+
+class RTTEstimator(object):
+    """ Smoothed round trip time and retransmission timeout of one peer """
+
+    __slots__ = (
+        "srtt", "rttvar", "_rto", "min_rto", "max_rto",
+        "samples", "retransmits"
+    )
+
+    ALPHA = 1 / 8
+    """ Gain of srtt """
+    BETA = 1 / 4
+    """ Gain of rttvar """
+    K = 4
+    """ Weight of rttvar in rto """
+
+    def __init__(self, initial_rto=1.0, min_rto=0.2, max_rto=60.0):
+        """
+        Initialize object
+
+        :param initial_rto: Retransmission timeout before the first sample
+            (default: 1.0)
+        :type initial_rto: float
+        :param min_rto: Lower bound of retransmission timeout (default: 0.2)
+        :type min_rto: float
+        :param max_rto: Upper bound of retransmission timeout (default: 60.0)
+        :type max_rto: float
+        :rtype: None
+        """
+        self.srtt = None
+        """ Smoothed round trip time (None - no sample yet)
+            :type srtt: None | float """
+        self.rttvar = None
+        """ Round trip time variation (None - no sample yet)
+            :type rttvar: None | float """
+        self._rto = initial_rto
+        """ Current retransmission timeout
+            :type _rto: float """
+        self.min_rto = min_rto
+        """ Lower bound of retransmission timeout
+            :type min_rto: float """
+        self.max_rto = max_rto
+        """ Upper bound of retransmission timeout
+            :type max_rto: float """
+        self.samples = 0
+        """ Number of round trip samples
+            :type samples: int """
+        self.retransmits = 0
+        """ Number of retransmissions
+            :type retransmits: int """
+
+    @property
+    def rto(self):
+        """
+        Get the retransmission timeout
+
+        :return: Seconds to wait for an ack
+        :rtype: float
+        """
+        return self._rto
+
+    def update(self, rtt):
+        """
+        Add a round trip time sample
+
+        :param rtt: Measured round trip time in seconds
+        :type rtt: float
+        :rtype: None
+        """
+        if rtt < 0:
+            return
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.samples += 1
+        self._rto = min(
+            self.max_rto, max(self.min_rto, self.srtt + self.K * self.rttvar)
+        )
+
+    def backoff(self, num_try):
+        """
+        Get the timeout after a retransmission (exponential backoff)
+
+        :param num_try: Number of retransmissions so far
+        :type num_try: int
+        :return: Seconds to wait for an ack
+        :rtype: float
+        """
+        self.retransmits += 1
+        return min(self.max_rto, self._rto * 2 ** num_try)
+
+    def stats(self):
+        """
+        Get the current estimates
+
+        :return: srtt, rttvar, rto, samples and retransmits
+        :rtype: dict
+        """
+        return {
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'rto': self._rto,
+            'samples': self.samples,
+            'retransmits': self.retransmits,
+        }
@@ -12,11 +12,9 @@ __version__ = "0.1.0"
 __date__ = "2016-03-29"
 # Created: 2015-03-21 24:00
 
-try:
-    import Queue as queue
-except ImportError:
-    # running python3
-    import queue
+import errno
+import logging
+import random
 import select
 import socket
 import threading
@@ -27,8 +25,18 @@ from flotils.runable import StartStopable
 from flotils.loadable import Loadable
 
 from paps.si.app.message import MsgType, Id, APPHeader, APPMessage, \
-    guess_class
+    APPDataMessage, ProtocolViolation, message_classes
 from paps.si.sensorInterface import SensorStartException
+from paps.si.app.timerQueue import TimerQueue
+from paps.si.app.inbox import Inbox
+from paps.si.app.rttEstimator import RTTEstimator
+from paps.si.app.seqWindow import SequenceWindow, SEQ_MASK
+
+
+_MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+""" Flag for non-blocking receives (0 - not supported on platform) """
+_SocketError = socket.error
+""" Error of socket operations (parameters named socket shadow module) """
 
 
 class Sensor(Loadable, StartStopable):
@@ -57,16 +65,56 @@ class Sensor(Loadable, StartStopable):
         """ Listen at address for messages """
         self._listen_port = settings.get("listen_port", 2346)
         """ Port of listen socket """
-        self._select_timeout = settings.get("select_timeout", 2.5)
-        """ Timeout for select statement """
-        self._start_block_timeout = self._select_timeout
-        """ Timeout in start statement """
+        self._select_timeout = settings.get("select_timeout", None)
+        """ Timeout for select statement
+            (None - wait until a socket is readable or stop() is called) """
+        self._join_timeout = settings.get("thread_join_timeout", 5.0)
+        """ Max seconds stop() waits for each thread to exit """
         self._retransmit_timeout = settings.get("retransmit_timeout", 1)
-        """ Timeout to retransmit packets """
+        """ Timeout to retransmit packets (until a round trip got measured) """
+        self._retransmit_timeout_min = settings.get(
+            "retransmit_timeout_min", 0.2
+        )
+        """ Lower bound of measured retransmit timeout """
+        self._retransmit_timeout_max = settings.get(
+            "retransmit_timeout_max", 60.0
+        )
+        """ Upper bound of retransmit timeout (including backoff) """
         self._retransmit_max_tries = settings.get("retransmit_max_tries", 3)
         """ Max number of tries to retransmit """
         self._buffer_size = settings.get("receive_buffer_size", 4096)
         """ Size of receiving buffer """
+        self._receive_drain_max = settings.get("receive_drain_max", 256)
+        """ Max number of datagrams read from a socket per wakeup """
+        self._receive_buffer = bytearray(self._buffer_size)
+        """ Buffer datagrams are received into (reused - messages copy
+            their payload out of it)
+            :type _receive_buffer: bytearray """
+        self._receive_view = memoryview(self._receive_buffer)
+        """ View on receive buffer to slice it without copying
+            :type _receive_view: memoryview """
+        self._payload_serializer = APPDataMessage.serializer_flags(
+            settings.get("payload_serializer", "json")
+        )
+        """ Header flags of serializer for data payloads (json/binary) """
+        self._protocol_version_minor = settings.get(
+            "protocol_version_minor", 0
+        )
+        """ Minor protocol version to send (1: microsecond timestamps) """
+        self._coalesce_window = settings.get("coalesce_window", 0.0)
+        """ Seconds to collect messages for the same peer into one datagram
+            (0 - send every message on its own) """
+        self._coalesce_max_size = settings.get("coalesce_max_size", 1400)
+        """ Max size of a coalesced datagram """
+        self._ack_delay = settings.get("ack_delay", 0.0)
+        """ Seconds an ack waits to be sent with another packet to the peer
+            (0 - send acks immediately) """
+        dispatch_mode = settings.get("dispatch_mode", "queue")
+        if dispatch_mode not in ("queue", "inline"):
+            raise ValueError(u"Unknown dispatch mode {}".format(dispatch_mode))
+        self._dispatch_inline = dispatch_mode == "inline"
+        """ Handle packets on the receive thread instead of queueing them
+            for the packet loop (keep queue for slow changers) """
 
         self._membership_request = None
         """ A membership request """
@@ -75,19 +123,50 @@ class Sensor(Loadable, StartStopable):
             :type : socket.socket """
         self._listening = []
         """ Listen on this sockets (via select()) """
-
-        self._send_seq_num = 0
+        self._wakeup_sockets = None
+        """ Socket pair to wake up select() (self-pipe)
+            :type _wakeup_sockets: None | (socket.socket, socket.socket) """
+        self._threads = []
+        """ Running threads (joined on stop)
+            :type _threads: list[threading.Thread] """
+
+        self._send_seq_num = settings.get("initial_sequence_number")
         """ Sequence number for transmitting packets """
-        self.inbox = queue.Queue()
-        """ Packet inbox """
-        self._to_ack = queue.Queue()
-        """ Queue of packets that are waiting to be acked """
-        self.new_packet = threading.Event()
-        """ Event for waiting for new packet received """
-        self._seq_ack = set()
-        """ Sequence numbers of packets waiting to be acked """
+        if self._send_seq_num is None:
+            # Random start - a restarted sensor is not taken as duplicate
+            self._send_seq_num = random.randint(0, SEQ_MASK)
+        self._sequence_window = settings.get("sequence_window", 1024)
+        """ Number of received sequence numbers remembered per peer """
+        self._seq_windows = {}
+        """ Received sequence numbers per peer - (ip, port) -> window
+            :type _seq_windows: dict[(str, int), SequenceWindow] """
+        self.inbox = Inbox(settings.get("inbox_size", 4096))
+        """ Packet inbox (control packets first,
+            UPDATEs of a device replace older ones)
+            :type inbox: paps.si.app.inbox.Inbox """
+        self._seq_ack = {}
+        """ Packets waiting to be acked - sequence number ->
+            (retransmit timer (None - not retransmitted),
+            send time (None once retransmitted), estimator)
+            :type _seq_ack: dict[int, tuple] """
+        self._rtt = {}
+        """ Round trip time estimation per peer - (ip, port) -> estimator
+            :type _rtt: dict[(str, int), RTTEstimator] """
         self._seq_ack_lock = threading.Lock()
         """ Lock for _seq_ack """
+        self._timers = TimerQueue()
+        """ Timers for delayed work
+            :type _timers: paps.si.app.timerQueue.TimerQueue """
+        self._coalesced = {}
+        """ Messages waiting to be sent - (ip, port) -> [size, [data]]
+            :type _coalesced: dict[(str, int), list] """
+        self._coalesce_lock = threading.Lock()
+        """ Lock for _coalesced """
+        self._pending_acks = {}
+        """ Sequence numbers waiting to be acked - (ip, port) -> [seq]
+            :type _pending_acks: dict[(str, int), list[int]] """
+        self._pending_acks_lock = threading.Lock()
+        """ Lock for _pending_acks """
 
         self._device_id = settings.get('device_id', Id.REQUEST)
         """ Device id of this instance """
@@ -148,6 +227,92 @@ class Sensor(Loadable, StartStopable):
         """
         return self._listen_socket.sendto(data, (ip, port))
 
+    def _schedule(self, delay, callback, *args):
+        """
+        Run callback after delay (in timer thread)
+
+        :param delay: Seconds to wait
+        :type delay: float
+        :param callback: Function to call
+        :type callback: callable
+        :param args: Arguments for callback
+        :return: Handle to cancel timer
+        :rtype: paps.si.app.timerQueue.Timer
+        """
+        return self._timers.schedule(delay, callback, *args)
+
+    def _cancel(self, timer):
+        """
+        Cancel a timer returned by _schedule()
+
+        :param timer: Timer to cancel
+        :type timer: paps.si.app.timerQueue.Timer
+        :rtype: None
+        """
+        self._timers.cancel(timer)
+
+    def _send_coalesced(self, ip, port, data):
+        """
+        Send data - collected with other messages for the same peer
+        if coalescing is enabled
+
+        :param ip: Ip to send to
+        :type ip: str
+        :param port: Port to send to
+        :type port: int
+        :param data: Packed message
+        :type data: str
+        :rtype: None
+        """
+        if not self._coalesce_window \
+                or len(data) >= self._coalesce_max_size:
+            self._send(ip, port, data)
+            return
+        address = (ip, port)
+        full = None
+        with self._coalesce_lock:
+            pending = self._coalesced.get(address)
+            if pending is not None \
+                    and pending[0] + len(data) > self._coalesce_max_size:
+                # Does not fit anymore -> send what we have
+                full = self._coalesced.pop(address)
+                pending = None
+            if pending is None:
+                pending = [0, []]
+                self._coalesced[address] = pending
+                self._schedule(
+                    self._coalesce_window, self._flush_coalesced,
+                    address, pending
+                )
+            pending[0] += len(data)
+            pending[1].append(data)
+        if full is not None:
+            self._send(ip, port, b"".join(full[1]))
+
+    def _flush_coalesced(self, address=None, pending=None):
+        """
+        Send collected messages
+
+        :param address: Only flush this peer (default: None)
+            None -> flush all peers
+        :type address: None | (str, int)
+        :param pending: Only flush if these are still the collected messages
+            (default: None)
+        :type pending: None | list
+        :rtype: None
+        """
+        with self._coalesce_lock:
+            if address is None:
+                flush = list(self._coalesced.items())
+                self._coalesced = {}
+            elif self._coalesced.get(address) is pending:
+                flush = [(address, self._coalesced.pop(address))]
+            else:
+                # Already sent
+                return
+        for (ip, port), (_, parts) in flush:
+            self._send(ip, port, b"".join(parts))
+
     def _send_packet(
             self, ip, port, packet,
             update_timestamp=True, acknowledge_packet=True
@@ -169,27 +334,40 @@ class Sensor(Loadable, StartStopable):
         """
         if acknowledge_packet:
             packet.header.sequence_number = self._send_seq_num
-            self._send_seq_num += 1
+            self._send_seq_num = (self._send_seq_num + 1) & SEQ_MASK
         packet.header.device_id = self._device_id
+        packet.header.version_minor = self._protocol_version_minor
+        if self._pending_acks and packet.header.ack_sequence_number is None:
+            # Piggyback waiting acks
+            self._take_acks(ip, port, packet.header)
         try:
             packed = packet.pack(update_timestamp=update_timestamp)
         except ValueError:
             self.exception("Failed to pack packet")
             return
-        self._send(ip, port, packed)
-        # TODO: add to wait for ack list
         if acknowledge_packet:
+            # Before sending - the ack may arrive before send returns
             with self._seq_ack_lock:
-                self._seq_ack.add(packet.header.sequence_number)
-            self._to_ack.put(
-                (time.time() + self._retransmit_timeout, 1, (ip, port), packet)
-            )
-        self.debug(u"Send: {}".format(packet))
+                rtt = self._get_rtt(ip, port)
+                self._seq_ack[packet.header.sequence_number] = (
+                    self._schedule(
+                        rtt.rto, self._retransmit, ip, port, packet, 1
+                    ),
+                    time.time(),
+                    rtt
+                )
+        self._send_coalesced(ip, port, packed)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            # Formatting a packet is expensive - only do it when needed
+            self.debug(u"Send: {}".format(packet))
 
     def _send_ack(self, ip, port, packet, update_timestamp=True):
         """
         Send an ack packet
 
+        With an ack delay the ack waits to be sent with the next packet
+        to the peer (or together with other acks)
+
         :param ip: Ip to send to
         :type ip: str
         :param port: Port to send to
@@ -200,8 +378,18 @@ class Sensor(Loadable, StartStopable):
         :type update_timestamp: bool
         :rtype: None
         """
-        # TODO: maybe wait a bit, so the ack could get attached to another
-        # packet
+        if self._ack_delay:
+            address = (ip, port)
+            with self._pending_acks_lock:
+                pending = self._pending_acks.get(address)
+                if pending is None:
+                    pending = []
+                    self._pending_acks[address] = pending
+                    self._schedule(
+                        self._ack_delay, self._flush_acks, address, pending
+                    )
+                pending.append(packet.header.sequence_number)
+            return
         ack = APPMessage(message_type=MsgType.ACK)
         ack.header.ack_sequence_number = packet.header.sequence_number
         self._send_packet(
@@ -209,6 +397,65 @@ class Sensor(Loadable, StartStopable):
             update_timestamp=update_timestamp, acknowledge_packet=False
         )
 
+    def _take_acks(self, ip, port, header):
+        """
+        Move waiting acks for a peer into header
+        (as many as fit into ack sequence number and ack mask)
+
+        :param ip: Ip of peer
+        :type ip: str
+        :param port: Port of peer
+        :type port: int
+        :param header: Header to set acks in
+        :type header: paps.si.app.message.APPHeader
+        :return: Were acks set
+        :rtype: bool
+        """
+        address = (ip, port)
+        with self._pending_acks_lock:
+            pending = self._pending_acks.get(address)
+            if not pending:
+                return False
+            ack_seq = pending[0]
+            mask = 0
+            rest = []
+            for seq in pending[1:]:
+                diff = (seq - ack_seq - 1) & 0xffffffff
+                if diff < APPHeader.ACK_MASK_BITS:
+                    mask |= 1 << diff
+                elif seq != ack_seq:
+                    rest.append(seq)
+            if rest:
+                # Keep list (flush timer belongs to it)
+                pending[:] = rest
+            else:
+                del self._pending_acks[address]
+        header.ack_sequence_number = ack_seq
+        header.ack_mask = mask or None
+        return True
+
+    def _flush_acks(self, address, pending):
+        """
+        Send waiting acks that did not get sent with another packet
+
+        :param address: Peer (ip, port)
+        :type address: (str, int)
+        :param pending: Only flush if these are still the waiting acks
+        :type pending: list[int]
+        :rtype: None
+        """
+        ip, port = address
+        while True:
+            with self._pending_acks_lock:
+                if self._pending_acks.get(address) is not pending:
+                    # Sent with other packets
+                    return
+            # Acks get attached in _send_packet
+            self._send_packet(
+                ip, port, APPMessage(message_type=MsgType.ACK),
+                acknowledge_packet=False
+            )
+
     def _unpack(self, data):
         """
         Unpack data into message
@@ -220,41 +467,227 @@ class Sensor(Loadable, StartStopable):
         """ | APPJoinMessage | APPDataMessage | APPConfigMessage
         :raises paps.si.app.message.ProtocolViolation: Failed to decode
         """
-        header, _ = APPHeader.unpack(data)
-        cls = guess_class(header.message_type)
+        packet, offset = self._unpack_from(data)
+        return packet, data[offset:]
+
+    def _unpack_from(self, data, offset=0):
+        """
+        Unpack one message from data (header is only unpacked once)
+
+        :param data: Data to be unpacked
+        :type data: str | bytearray | memoryview
+        :param offset: Start reading at this position (default: 0)
+        :type offset: int
+        :return: Unpacked message and position after it
+        :rtype: (APPMessage, int)
+        :raises paps.si.app.message.ProtocolViolation: Failed to decode
+        """
+        header, offset = APPHeader.unpack_from(data, offset)
+        cls = message_classes.get(header.message_type)
         if cls is None:
             self.warning(u"Unknown type {}\nHeader: {}".format(
                 header.message_type, header
             ))
             cls = APPMessage
-        return cls.unpack(data)
+        return cls.unpack_payload(header, data, offset)
 
     def _get_packet(self, socket):
         """
-        Read packet and put it into inbox
+        Read all waiting datagrams (without blocking after the first one)
+        and put their packets into inbox
 
         :param socket: Socket to read from
         :type socket: socket.socket
-        :return: Read packet
-        :rtype: APPMessage
+        :return: Read packets
+        :rtype: list[APPMessage]
         """
-        data, (ip, port) = socket.recvfrom(self._buffer_size)
-        packet, remainder = self._unpack(data)
-        self.inbox.put((ip, port, packet))
-        self.new_packet.set()
-        self.debug(u"RX: {}".format(packet))
+        packets = []
+        buff = self._receive_buffer
+        view = self._receive_view
+        nbytes, (ip, port) = socket.recvfrom_into(buff, self._buffer_size)
+        num = 1
+        while True:
+            try:
+                packets.extend(
+                    self._handle_datagram(ip, port, view[:nbytes])
+                )
+            except ProtocolViolation:
+                self.exception(
+                    u"Failed to decode datagram from {}:{}".format(ip, port)
+                )
+            if num >= self._receive_drain_max or not _MSG_DONTWAIT:
+                # Leave the rest for the next wakeup
+                break
+            try:
+                nbytes, (ip, port) = socket.recvfrom_into(
+                    buff, self._buffer_size, _MSG_DONTWAIT
+                )
+            except _SocketError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # Drained
+                    break
+                raise
+            num += 1
+        return packets
+
+    def _handle_datagram(self, ip, port, data):
+        """
+        Handle every packet in a datagram
 
-        if packet.header.sequence_number is not None:
-            # Packet needs to be acknowledged
-            self._send_ack(ip, port, packet)
-        ack_seq = packet.header.ack_sequence_number
-        if ack_seq is not None:
-            # Packet got acknowledged
+        :param ip: Ip of sender
+        :type ip: str
+        :param port: Port of sender
+        :type port: int
+        :param data: Received datagram
+        :type data: str
+        :return: Delivered packets (without duplicates)
+        :rtype: list[APPMessage]
+        :raises paps.si.app.message.ProtocolViolation: Failed to decode
+        """
+        packets = []
+        offset = 0
+        size = len(data)
+        while offset < size:
+            packet, offset = self._unpack_from(data, offset)
+            if self._handle_packet(ip, port, packet):
+                packets.append(packet)
+        return packets
+
+    def _handle_packet(self, ip, port, packet):
+        """
+        Handle acknowledgement and put packet into inbox
+
+        Duplicates of sequenced packets get acked again,
+        but are not put into inbox
+
+        :param ip: Ip of sender
+        :type ip: str
+        :param port: Port of sender
+        :type port: int
+        :param packet: Received packet
+        :type packet: APPMessage
+        :return: Was packet put into inbox
+        :rtype: bool
+        """
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self.debug(u"RX: {}".format(packet))
+        header = packet.header
+        if header.ack_sequence_number is not None:
+            # Packets got acknowledged
+            now = time.time()
             with self._seq_ack_lock:
-                if ack_seq in self._seq_ack:
-                    self.debug(u"Seq {} got acked".format(ack_seq))
-                    self._seq_ack.remove(ack_seq)
-        return packet
+                for ack_seq in header.acked_sequence_numbers():
+                    waiting = self._seq_ack.pop(ack_seq, None)
+                    if waiting is not None:
+                        self._packet_acked(ack_seq, waiting, now)
+        if header.sequence_number is not None:
+            window = self._seq_windows.get((ip, port))
+            if window is None:
+                window = SequenceWindow(self._sequence_window)
+                self._seq_windows[(ip, port)] = window
+            if not self._dispatch_inline \
+                    and header.sequence_number not in window \
+                    and not self.inbox.accepts((ip, port, packet)):
+                # Inbox full - not acked, so the sender retransmits it
+                if self._logger.isEnabledFor(logging.DEBUG):
+                    self.debug(u"Inbox full - seq {} from {}:{}".format(
+                        header.sequence_number, ip, port
+                    ))
+                return False
+            # Packet needs to be acknowledged (again, if ack got lost)
+            self._send_ack(ip, port, packet)
+            if not window.add(header.sequence_number):
+                if self._logger.isEnabledFor(logging.DEBUG):
+                    self.debug(u"Duplicate seq {} from {}:{}".format(
+                        header.sequence_number, ip, port
+                    ))
+                return False
+        self._deliver(ip, port, packet)
+        return True
+
+    def _packet_acked(self, seq, waiting, now):
+        """
+        Packet got acknowledged - stop retransmitting it
+        (_seq_ack_lock is held)
+
+        :param seq: Sequence number of acked packet
+        :type seq: int
+        :param waiting: Removed _seq_ack entry of packet
+        :type waiting: tuple
+        :param now: Time the ack was received
+        :type now: float
+        :rtype: None
+        """
+        timer, sent, rtt = waiting
+        if timer is not None:
+            self._cancel(timer)
+        if sent is not None:
+            # Karn: only packets acked on first transmission
+            rtt.update(now - sent)
+
+    def _stop_retransmit(self, seq):
+        """
+        Stop retransmitting a packet, but still take its ack
+        (_seq_ack_lock has to be held - entry has to be removed by caller
+        once no longer needed)
+
+        :param seq: Sequence number of packet
+        :type seq: int
+        :rtype: None
+        """
+        waiting = self._seq_ack.get(seq)
+        if waiting is not None and waiting[0] is not None:
+            self._cancel(waiting[0])
+            self._seq_ack[seq] = (None,) + waiting[1:]
+
+    def _packet_lost(self, ip, port, packet):
+        """
+        Packet did not get acked after all retransmissions
+
+        :param ip: Ip packet was sent to
+        :type ip: str
+        :param port: Port packet was sent to
+        :type port: int
+        :param packet: Lost packet
+        :type packet: APPMessage
+        :rtype: None
+        """
+        self.warning("Exceeded max tries")
+
+    def _deliver(self, ip, port, packet):
+        """
+        Hand received packet to packet processing
+        (inbox or _do_packet() for inline dispatch)
+
+        :param ip: Ip of sender
+        :type ip: str
+        :param port: Port of sender
+        :type port: int
+        :param packet: Received packet
+        :type packet: APPMessage
+        :rtype: None
+        """
+        if self._dispatch_inline:
+            try:
+                self._do_packet(packet, ip, port)
+            except:
+                self.exception("Failed to handle packet")
+            return
+        self.inbox.put((ip, port, packet))
+
+    def _do_packet(self, packet, ip, port):
+        """
+        React to incoming packet
+
+        :param packet: Packet to handle
+        :type packet: T >= paps.si.app.message.APPMessage
+        :param ip: Sender ip address
+        :type ip: unicode
+        :param port: Sender port
+        :type port: int
+        :rtype: None
+        """
+        raise NotImplementedError("Please implement")
 
     def _thread_wrapper(self, function):
         """
@@ -269,72 +702,178 @@ class Sensor(Loadable, StartStopable):
         except:
             self.exception("Threaded execution failed")
 
+    def _start_thread(self, function):
+        """
+        Run function in a daemon thread (joined on stop)
+
+        :param function: Function to run
+        :type function: callable
+        :rtype: None
+        """
+        a_thread = threading.Thread(
+            target=self._thread_wrapper,
+            args=(function,)
+        )
+        a_thread.daemon = True
+        a_thread.start()
+        self._threads.append(a_thread)
+
+    def _join_threads(self):
+        """
+        Wait for started threads to exit
+
+        :rtype: None
+        """
+        current = threading.current_thread()
+        threads, self._threads = self._threads, []
+        for a_thread in threads:
+            if a_thread is current:
+                # stop() called from within a loop
+                continue
+            a_thread.join(self._join_timeout)
+            if a_thread.is_alive():
+                self.warning(u"Thread {} did not exit".format(a_thread.name))
+
+    def _wakeup(self):
+        """
+        Wake up receiving loop
+
+        :rtype: None
+        """
+        if self._wakeup_sockets is None:
+            return
+        try:
+            self._wakeup_sockets[1].send(b"\0")
+        except _SocketError:
+            # Full - already woken up
+            pass
+
     def _receiving(self):
         """
-        Receiving loop
+        Receiving loop (blocks until a socket is readable or woken up)
 
         :rtype: None
         """
+        wakeup = self._wakeup_sockets[0]
         while self._is_running:
             try:
                 rlist, wlist, xlist = select.select(
-                    self._listening, [], [],
+                    self._listening + [wakeup], [], [],
                     self._select_timeout
                 )
             except:
                 self.exception("Failed to select socket")
                 continue
             for sock in rlist:
+                if sock is wakeup:
+                    try:
+                        wakeup.recv(self._buffer_size)
+                    except _SocketError:
+                        pass
+                    continue
                 try:
                     self._get_packet(sock)
                 except:
                     self.exception("Failed to receive packet")
 
-    def _acking(self, params=None):
+    def _timing(self):
         """
-        Packet acknowledge and retry loop
+        Timer loop
 
-        :param params: Ignore
-        :type params: None
         :rtype: None
         """
         while self._is_running:
             try:
-                t, num_try, (ip, port), packet = self._to_ack.get(
-                    timeout=self._select_timeout
-                )
-            except queue.Empty:
-                # Timed out
-                continue
+                self._timers.run_pending()
+            except:
+                self.exception("Failed to run timer")
+            self._timers.wait()
 
-            diff = t - time.time()
-            if diff > 0:
-                time.sleep(diff)
+    def _get_rtt(self, ip, port):
+        """
+        Get the round trip time estimation of a peer
 
-            with self._seq_ack_lock:
-                if packet.header.sequence_number not in self._seq_ack:
-                    # Not waiting for this?
-                    continue
+        :param ip: Ip of peer
+        :type ip: str
+        :param port: Port of peer
+        :type port: int
+        :return: Estimation (created if not existing)
+        :rtype: paps.si.app.rttEstimator.RTTEstimator
+        """
+        rtt = self._rtt.get((ip, port))
+        if rtt is None:
+            rtt = RTTEstimator(
+                self._retransmit_timeout,
+                self._retransmit_timeout_min,
+                self._retransmit_timeout_max
+            )
+            self._rtt[(ip, port)] = rtt
+        return rtt
 
-            if num_try <= self._retransmit_max_tries:
-                # Try again
-                self._send(ip, port, packet.pack(True))
-                self._to_ack.put(
-                    (
-                        time.time() + self._retransmit_timeout,
-                        num_try + 1,
-                        (ip, port),
-                        packet
-                    )
-                )
+    def _forget_peer(self, ip, port):
+        """
+        Drop per peer state (received sequence numbers, round trip time)
+        of a peer that left
+
+        :param ip: Ip of peer
+        :type ip: str
+        :param port: Port of peer
+        :type port: int
+        :rtype: None
+        """
+        self._seq_windows.pop((ip, port), None)
+        with self._seq_ack_lock:
+            self._rtt.pop((ip, port), None)
+
+    def rtt_stats(self):
+        """
+        Get the round trip time estimations of all peers
+
+        :return: (ip, port) -> srtt, rttvar, rto, samples and retransmits
+        :rtype: dict[(str, int), dict]
+        """
+        with self._seq_ack_lock:
+            return dict(
+                (address, rtt.stats()) for address, rtt in self._rtt.items()
+            )
+
+    def _retransmit(self, ip, port, packet, num_try):
+        """
+        Retransmit packet that did not get acked in time (timer callback)
+
+        :param ip: Ip to send to
+        :type ip: str
+        :param port: Port to send to
+        :type port: int
+        :param packet: Packet waiting to be acked
+        :type packet: APPMessage
+        :param num_try: Number of this retransmission
+        :type num_try: int
+        :rtype: None
+        """
+        seq = packet.header.sequence_number
+        with self._seq_ack_lock:
+            waiting = self._seq_ack.get(seq)
+            if waiting is None or waiting[0] is None:
+                # Got acked/stopped meanwhile
+                return
+            rtt = waiting[2]
+            failed = num_try > self._retransmit_max_tries
+            if failed:
+                del self._seq_ack[seq]
             else:
-                # Failed to ack
-                with self._seq_ack_lock:
-                    try:
-                        self._seq_ack.remove(packet.header.sequence_number)
-                    except KeyError:
-                        pass
-                self.warning("Exceeded max tries")
+                self._seq_ack[seq] = (
+                    self._schedule(
+                        rtt.backoff(num_try), self._retransmit,
+                        ip, port, packet, num_try + 1
+                    ),
+                    None,
+                    rtt
+                )
+        if failed:
+            self._packet_lost(ip, port, packet)
+            return
+        self._send(ip, port, packet.pack(True))
 
     def start(self, blocking=False):
         """
@@ -358,29 +897,44 @@ class Sensor(Loadable, StartStopable):
             self._listen_ip, self._listen_port
         ))
 
+        self._wakeup_sockets = socket.socketpair()
+        for sock in self._wakeup_sockets:
+            sock.setblocking(False)
+
         super(Sensor, self).start(False)
         try:
-            a_thread = threading.Thread(
-                target=self._thread_wrapper,
-                args=(self._receiving,)
-            )
-            a_thread.daemon = True
-            a_thread.start()
+            self._start_thread(self._receiving)
         except:
             self.exception("Failed to run receive loop")
             raise SensorStartException("Packet loop failed")
+        try:
+            self._start_thread(self._timing)
+        except:
+            self.exception("Failed to run timer loop")
+            raise SensorStartException("Timer loop failed")
         super(Sensor, self).start(blocking)
 
     def stop(self):
         """
-        Stop the interface
+        Stop the interface (returns once all threads exited)
 
         :rtype: None
         """
-        should_sleep = self._is_running
         super(Sensor, self).stop()
-        if should_sleep:
-            # Make sure everything has enough time to exit
-            time.sleep(max(self._select_timeout, self._retransmit_timeout) + 1)
+        # Unblock all loops
+        self._wakeup()
+        self._timers.wake()
+        self.inbox.wake()
+        self._join_threads()
+        if self._wakeup_sockets is not None:
+            for sock in self._wakeup_sockets:
+                sock.close()
+            self._wakeup_sockets = None
         if self._listen_socket is not None:
+            try:
+                for address, pending in list(self._pending_acks.items()):
+                    self._flush_acks(address, pending)
+                self._flush_coalesced()
+            except:
+                self.exception("Failed to send waiting messages")
             self._shutdown_listen_socket()
@@ -12,15 +12,22 @@ __version__ = "0.1.0"
 __date__ = "2016-03-29"
 # Created: 2015-03-21 24:00
 
-import time
+try:
+    import Queue as queue
+except ImportError:
+    # running python3
+    import queue
 import threading
+import time
 
 from .sensor import Sensor
 from ..sensorInterface import SensorClientInterface, \
     SensorUpdateException, SensorJoinException, SensorStartException
 from .message import MsgType, Id, \
-    APPJoinMessage, APPUnjoinMessage, APPUpdateMessage, \
+    APPJoinMessage, APPUnjoinMessage, APPUpdateMessage, APPDeltaMessage, \
     format_data
+from .peopleCodec import people_to_bits, pack_bits, diff_bits, \
+    ENCODING_NAMES, ENCODING_RAW
 
 
 class SensorClient(Sensor, SensorClientInterface):
@@ -30,12 +37,6 @@ class SensorClient(Sensor, SensorClientInterface):
         if settings is None:
             settings = {}
         super(SensorClient, self).__init__(settings)
-        self._packet_timeout = settings.get('packet_wait_timeout', 1.5)
-        """ Time to wait for new packet event """
-        self._start_block_timeout = max(
-            self._packet_timeout, self._select_timeout
-        )
-        """ Time to block in start """
         self._join_retry_timeout = settings.get('join_retry_timeout', 5.0)
         """ Time to wait before resending join packet """
         self._join_retry_count = settings.get('join_retry_number', 3)
@@ -49,6 +50,60 @@ class SensorClient(Sensor, SensorClientInterface):
             :type : None | int """
         self._joined = threading.Event()
         """ If set, currently joined the audience """
+        self._leave_timeout = settings.get('leave_timeout', 2.0)
+        """ Max seconds stop() waits for the unjoin to be acked """
+        self._left = threading.Event()
+        """ If set, no unjoin is waiting to be acked """
+        self._left.set()
+        self._unjoin_seq = None
+        """ Sequence number of last unjoin packet """
+        self._update_suppress = settings.get(
+            'update_suppress_duplicates', True
+        )
+        """ Do not send a state that equals the last sent one """
+        self._update_min_interval = settings.get('update_min_interval', 0.0)
+        """ Min seconds between UPDATEs - changes in between are collected
+            and only the latest state is sent (0 - no limit) """
+        self._update_keepalive = settings.get('update_keepalive', 5.0)
+        """ Resend the last state after this many seconds without UPDATE
+            (recovers lost UPDATEs) (0 - never) """
+        self._update_lock = threading.Lock()
+        """ Lock for update state """
+        self._update_bits = None
+        """ Last sent state (None - nothing sent yet)
+            :type _update_bits: None | bytearray """
+        self._update_sent = 0.0
+        """ Time last UPDATE was sent """
+        self._update_pending = None
+        """ State waiting for the rate limit (None - nothing waiting)
+            :type _update_pending: None | bytearray """
+        self._update_timer = None
+        """ Timer sending the pending state """
+        self._keepalive_timer = None
+        """ Timer resending the last state """
+        encoding = settings.get('update_encoding', "raw")
+        self._update_encoding = None if encoding == "auto" \
+            else ENCODING_NAMES[encoding]
+        """ Encoding of people in UPDATEs (None - "auto": smallest per packet)
+            (server has to support rle/sparse flags - not the case for
+            older ones) """
+        self._update_delta = settings.get('update_delta', False)
+        """ Send only people differing from an acked UPDATE (DELTA)
+            (server has to support DELTA) """
+        self._delta_keyframe_interval = settings.get(
+            'delta_keyframe_interval', 32
+        )
+        """ Send an acked UPDATE (new baseline) after this many DELTAs """
+        self._delta_baseline = None
+        """ Acked UPDATE - sequence number, bits, packed bits
+            :type _delta_baseline: None | (int, bytearray, str) """
+        self._delta_pending = []
+        """ UPDATEs waiting to be acked (oldest first - only the newest is
+            retransmitted) - packet, bits, packed bits (_seq_ack_lock)
+            :type _delta_pending: list[
+                (paps.si.app.message.APPUpdateMessage, bytearray, str)] """
+        self._delta_count = 0
+        """ Number of DELTAs sent since last acked UPDATE """
 
     def join(self, people):
         """
@@ -65,6 +120,7 @@ class SensorClient(Sensor, SensorClientInterface):
         tries = 0
         if not people:
             raise SensorJoinException("No people given")
+        self._update_reset()
         ids = set()
         for person in people:
             if not person.id and person.id != 0:
@@ -77,7 +133,8 @@ class SensorClient(Sensor, SensorClientInterface):
 
         while self._is_running and tries < self._join_retry_count:
             packet = APPJoinMessage(
-                payload={'people': [person.to_dict() for person in people]}
+                payload={'people': [person.to_dict() for person in people]},
+                serializer=self._payload_serializer
             )
             self._send_packet(self._multicast_group, self._multicast_port,
                               packet)
@@ -111,10 +168,57 @@ class SensorClient(Sensor, SensorClientInterface):
         self.debug("()")
         if self._joined.is_set():
             packet = APPUnjoinMessage(device_id=Id.NOT_SET)
+            self._left.clear()
             self._send_packet(self._server_ip, self._server_port, packet)
+            with self._seq_ack_lock:
+                if packet.header.sequence_number in self._seq_ack:
+                    self._unjoin_seq = packet.header.sequence_number
+                else:
+                    # Already acked (or not sent)
+                    self._left.set()
             self._joined.clear()
+            self._update_reset()
             self.info("Left the audience")
 
+    def _packet_acked(self, seq, waiting, now):
+        super(SensorClient, self)._packet_acked(seq, waiting, now)
+        if seq == self._unjoin_seq:
+            self._left.set()
+        pending = self._delta_done(seq)
+        if pending is not None:
+            # Server knows this state - new baseline
+            # (no update lock - it is held while sending)
+            self._delta_baseline = (seq, pending[1], pending[2])
+
+    def _packet_lost(self, ip, port, packet):
+        super(SensorClient, self)._packet_lost(ip, port, packet)
+        seq = packet.header.sequence_number
+        if seq == self._unjoin_seq:
+            self._left.set()
+        with self._seq_ack_lock:
+            self._delta_done(seq)
+
+    def _delta_done(self, seq):
+        """
+        Baseline UPDATE got acked/lost - forget it and the older ones
+        (superseded by it - no longer retransmitted)
+        (_seq_ack_lock has to be held)
+
+        :param seq: Sequence number of packet
+        :type seq: int
+        :return: Packet, bits and packed bits (None - not a pending baseline)
+        :rtype: None | (paps.si.app.message.APPUpdateMessage, bytearray, str)
+        """
+        pending = self._delta_pending
+        for index, entry in enumerate(pending):
+            if entry[0].header.sequence_number == seq:
+                for older in pending[:index]:
+                    # Nothing else removes them (no retransmit timer)
+                    self._seq_ack.pop(older[0].header.sequence_number, None)
+                del pending[:index + 1]
+                return entry
+        return None
+
     def config(self, settings):
         """
         Configuration has changed - config this module and lower layers
@@ -130,10 +234,6 @@ class SensorClient(Sensor, SensorClientInterface):
         try:
             self._device_id = settings['device_id']
 
-            self._packet_timeout = settings.get(
-                'packet_wait_timeout',
-                self._packet_timeout
-            )
             self._server_ip = settings.get('server_ip', self._server_ip)
             self._server_port = settings.get('server_port', self._server_port)
         except KeyError:
@@ -150,17 +250,162 @@ class SensorClient(Sensor, SensorClientInterface):
         """
         Update the status of people
 
+        Depending on settings, an unchanged state is not sent and states
+        faster than the rate limit are collected (only the latest is sent)
+
         :param people: All people of this sensor
         :type people: list[paps.person.Person]
         :rtype: None
         :raises SensorUpdateException: Failed to update
         """
+        bits = people_to_bits(people)
+        with self._update_lock:
+            if self._update_pending is not None:
+                # Timer sends the latest state
+                self._update_pending = bits
+                return
+            if self._update_suppress and bits == self._update_bits:
+                return
+            now = time.time()
+            wait = self._update_sent + self._update_min_interval - now
+            if self._update_min_interval and wait > 0:
+                self._update_pending = bits
+                self._update_timer = self._schedule(wait, self._update_flush)
+                return
+            self._update_send(bits, now)
+
+    def _update_send(self, bits, now):
+        """
+        Send UPDATE (update lock has to be held)
 
-        packet = APPUpdateMessage(device_id=Id.NOT_SET, people=people)
+        :param bits: State to send
+        :type bits: bytearray
+        :param now: Current time
+        :type now: float
+        :rtype: None
+        """
+        if self._update_delta:
+            packet, packed = self._delta_packet(bits)
+        else:
+            packet = APPUpdateMessage(
+                device_id=Id.NOT_SET, bits=bits, encoding=self._update_encoding
+            )
+            packed = None
+        if packed is not None:
+            with self._seq_ack_lock:
+                for older in self._delta_pending:
+                    # Resending an outdated state would set the server back
+                    # (its ack is still taken as baseline)
+                    self._stop_retransmit(older[0].header.sequence_number)
+                # Set before sending - ack may arrive before send returns
+                self._delta_pending.append((packet, bits, packed))
+        # Only baselines are acked (and retransmitted)
         self._send_packet(
             self._server_ip, self._server_port, packet,
-            acknowledge_packet=False
+            acknowledge_packet=packed is not None
+        )
+        self._update_bits = bits
+        self._update_sent = now
+        if self._update_keepalive and self._keepalive_timer is None:
+            self._keepalive_timer = self._schedule(
+                self._update_keepalive, self._update_keepalive_due
+            )
+
+    def _delta_packet(self, bits):
+        """
+        Create DELTA to baseline or (periodically/if smaller/without
+        baseline) an UPDATE to be acked as new baseline
+
+        :param bits: State to send
+        :type bits: bytearray
+        :return: Packet and the bits packed as bitmap (None - DELTA)
+        :rtype: (paps.si.app.message.APPMessage, None | str)
+        """
+        packet = APPUpdateMessage(
+            device_id=Id.NOT_SET, bits=bits, encoding=self._update_encoding
         )
+        if packet.encoding == ENCODING_RAW:
+            packed = packet.raw_payload
+        else:
+            # Bitmap needed to diff against later states
+            packed = pack_bits(bits)
+        baseline = self._delta_baseline
+        if baseline is not None \
+                and self._delta_count < self._delta_keyframe_interval:
+            indices = diff_bits(baseline[2], packed, len(baseline[1]))
+            if indices is not None \
+                    and APPDeltaMessage.packed_size(len(indices)) \
+                    < len(packet.raw_payload) \
+                    and (not indices
+                         or indices[-1] <= APPDeltaMessage.MAX_INDEX):
+                self._delta_count += 1
+                return APPDeltaMessage(
+                    device_id=Id.NOT_SET, baseline=baseline[0],
+                    indices=indices
+                ), None
+        self._delta_count = 0
+        return packet, packed
+
+    def _update_flush(self):
+        """
+        Send the state collected during the rate limit (timer callback)
+
+        :rtype: None
+        """
+        with self._update_lock:
+            bits = self._update_pending
+            self._update_pending = None
+            self._update_timer = None
+            if bits is None or not self._is_running:
+                return
+            if self._update_suppress and bits == self._update_bits:
+                return
+            self._update_send(bits, time.time())
+
+    def _update_keepalive_due(self):
+        """
+        Resend the last state if nothing was sent for a while
+        (timer callback)
+
+        :rtype: None
+        """
+        with self._update_lock:
+            self._keepalive_timer = None
+            if self._update_bits is None or not self._is_running \
+                    or not self._joined.is_set():
+                return
+            now = time.time()
+            wait = self._update_sent + self._update_keepalive - now
+            if wait > 0:
+                # Sent meanwhile
+                self._keepalive_timer = self._schedule(
+                    wait, self._update_keepalive_due
+                )
+                return
+            self._update_send(self._update_bits, now)
+
+    def _update_reset(self):
+        """
+        Forget update state (next state is sent in any case)
+
+        :rtype: None
+        """
+        with self._update_lock:
+            for timer in (self._update_timer, self._keepalive_timer):
+                if timer is not None:
+                    self._cancel(timer)
+            self._update_timer = None
+            self._keepalive_timer = None
+            self._update_pending = None
+            self._update_bits = None
+            self._update_sent = 0.0
+            self._delta_baseline = None
+            with self._seq_ack_lock:
+                for older in self._delta_pending[:-1]:
+                    # Not retransmitted - would never be removed
+                    self._seq_ack.pop(older[0].header.sequence_number, None)
+                del self._delta_pending[:]
+            self._delta_count = 0
 
     def _packet_loop(self):
         """
@@ -169,17 +414,56 @@ class SensorClient(Sensor, SensorClientInterface):
         :rtype: None
         """
         while self._is_running:
-            # Only wait if there are no more packets in the inbox
-            if self.inbox.empty() \
-                    and not self.new_packet.wait(self._packet_timeout):
+            try:
+                ip, port, packet = self.inbox.get()
+            except queue.Empty:
+                # Woken up by stop()
                 continue
-            ip, port, packet = self.inbox.get()
-            if self.inbox.empty():
-                self.new_packet.clear()
-            self.debug(u"{}".format(packet))
+            self._do_packet(packet, ip, port)
+
+    def _do_packet(self, packet, ip, port):
+        """
+        React to incoming packet
+
+        :param packet: Packet to handle
+        :type packet: T >= paps.si.app.message.APPMessage
+        :param ip: Server ip address
+        :type ip: unicode
+        :param port: Server port
+        :type port: int
+        :rtype: None
+        """
+        self.debug(u"{}".format(packet))
 
-            if packet.header.message_type == MsgType.CONFIG:
-                self._do_config_packet(packet, ip, port)
+        msg_type = packet.header.message_type
+        if msg_type == MsgType.CONFIG:
+            self._do_config_packet(packet, ip, port)
+        elif msg_type == MsgType.RESYNC:
+            self._do_resync_packet(packet, ip, port)
+
+    def _do_resync_packet(self, packet, ip, port):
+        """
+        Server does not know DELTA baseline - send new one
+
+        :param packet: Resync packet
+        :type packet: paps.si.app.message.APPResyncMessage
+        :param ip: Ip of server
+        :type ip: str
+        :param port: Port of server
+        :type port: int
+        :rtype: None
+        """
+        if packet.header.device_id != Id.SERVER:
+            self.warning("Resync packets only allowed from server")
+            return
+        with self._update_lock:
+            self._delta_baseline = None
+            if self._delta_pending:
+                # New baseline already on its way
+                return
+            if self._update_bits is None or not self._joined.is_set():
+                return
+            self._update_send(self._update_bits, time.time())
 
     def _do_config_packet(self, packet, ip, port):
         """
@@ -212,7 +496,9 @@ class SensorClient(Sensor, SensorClientInterface):
             self._joined.set()
         except:
             self.exception("Failed to configure")
-            self.error(u"Faulty packet {}".format(format_data(packet.payload)))
+            self.error(u"Faulty packet {}".format(
+                format_data(packet.raw_payload)
+            ))
             return
 
     def start(self, blocking=False):
@@ -227,16 +513,12 @@ class SensorClient(Sensor, SensorClientInterface):
         """
         self.debug("()")
         super(SensorClient, self).start(blocking=False)
-        try:
-            a_thread = threading.Thread(
-                target=self._thread_wrapper,
-                args=(self._packet_loop,)
-            )
-            a_thread.daemon = True
-            a_thread.start()
-        except:
-            self.exception("Failed to run packet loop")
-            raise SensorStartException("Packet loop failed")
+        if not self._dispatch_inline:
+            try:
+                self._start_thread(self._packet_loop)
+            except:
+                self.exception("Failed to run packet loop")
+                raise SensorStartException("Packet loop failed")
         self.info("Started")
         # Blocking - call StartStopable.start
         super(Sensor, self).start(blocking)
@@ -250,7 +532,8 @@ class SensorClient(Sensor, SensorClientInterface):
         self.debug("()")
         try:
             self.unjoin()
-            time.sleep(2)
+            # Give server the chance to ack (and retransmit if lost)
+            self._left.wait(self._leave_timeout)
         except:
             self.exception("Failed to leave audience")
         super(SensorClient, self).stop()
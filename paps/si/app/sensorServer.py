@@ -12,6 +12,12 @@ __version__ = "0.1.0"
 __date__ = "2016-03-31"
 # Created: 2015-03-21 24:00
 
+try:
+    import Queue as queue
+except ImportError:
+    # running python3
+    import queue
+import logging
 import socket
 import platform
 import threading
@@ -19,8 +25,10 @@ import threading
 from ..sensorInterface import SensorServerInterface, \
     SensorStartException
 from .sensor import Sensor
+from .clientRegistry import ClientRegistry
+from .seqWindow import seq_after
 from .message import Id, MsgType, \
-    ProtocolViolation, APPConfigMessage, APPMessage
+    ProtocolViolation, APPConfigMessage, APPMessage, APPResyncMessage
 from ...person import Person
 
 
@@ -32,21 +40,15 @@ class SensorServer(Sensor, SensorServerInterface):
             settings = {}
         super(SensorServer, self).__init__(settings)
         self._device_id = Id.SERVER
-        self._packet_wait = settings.get("packet_wait_timeout", 1.5)
-        """ Wait for a packet wait time
-        :type _packet_wait: float """
         self._multicast_bind_port = settings.get(
             "multicast_bind_port",
             self._multicast_port
         )
         """ Listen at port for multicast messages
             :type : int """
-        self._clients = {}
-        """ Map of registered clients """
-        self._key2deviceId = {}
-        """ key (ip:port) -> device_id lookup
-        :type : dict[unicode, unicode] """
-        # TODO sync access to clients
+        self._clients = ClientRegistry()
+        """ Registered clients
+            :type : paps.si.app.clientRegistry.ClientRegistry """
 
         self._multicast_socket = None
         """ Socket listening for multicast messages
@@ -62,14 +64,11 @@ class SensorServer(Sensor, SensorServerInterface):
         :rtype: None
         """
         while not self._is_stopped.is_set():
-            if self.inbox.empty() and \
-                    not self.new_packet.wait(self._packet_wait):
+            try:
+                ip, port, packet = self.inbox.get()
+            except queue.Empty:
+                # Woken up by stop()
                 continue
-            ip, port, packet = self.inbox.get()
-
-            if self.inbox.empty():
-                self.new_packet.clear()
-
             self._do_packet(packet, ip, port)
 
     def _do_packet(self, packet, ip, port):
@@ -92,6 +91,8 @@ class SensorServer(Sensor, SensorServerInterface):
             self._do_unjoin_packet(packet, ip, port)
         elif msg_type == MsgType.UPDATE:
             self._do_update_packet(packet, ip, port)
+        elif msg_type == MsgType.DELTA:
+            self._do_delta_packet(packet, ip, port)
 
     def _do_join_packet(self, packet, ip, port):
         """
@@ -107,12 +108,20 @@ class SensorServer(Sensor, SensorServerInterface):
         """
         self.debug("()")
         device_id = packet.header.device_id
-        key = u"{}:{}".format(ip, port)
+        address = (ip, port)
 
-        if device_id == Id.REQUEST:
-            device_id = self._new_device_id(key)
+        try:
+            if device_id == Id.REQUEST:
+                device_id = self._clients.allocate(address)
+            elif device_id <= Id.SERVER:
+                self.error("ProtocolViolation: Invalid device id")
+                return
+            else:
+                self._clients.reserve(device_id)
+        except ValueError:
+            self.exception("Failed to allocate device id")
+            return
 
-        client = self._clients.get(device_id, {})
         data = {}
 
         if packet.payload:
@@ -121,8 +130,6 @@ class SensorServer(Sensor, SensorServerInterface):
             except:
                 data = {}
 
-        client['device_id'] = device_id
-        client['key'] = key
         people = []
         try:
             for index, person_dict in enumerate(data['people']):
@@ -134,17 +141,50 @@ class SensorServer(Sensor, SensorServerInterface):
             self.changer.on_person_new(people)
         except:
             self.exception("Failed to update people")
+            self._clients.release(device_id)
             return
 
-        # Original ids (without device id)
-        client['people'] = people
-        # Add config to client data?
-        client_dict = dict(client)
-        del client_dict['people']
+        # Answer with the serializer the client used
+        self._send_packet(ip, port, APPConfigMessage(
+            payload={
+                'device_id': device_id,
+                'key': u"{}:{}".format(ip, port),
+            },
+            serializer=packet.serializer
+        ))
+        old = self._clients.get(device_id)
+        self._clients.add(device_id, address, people)
+        if old is not None and old.address != address:
+            # Rejoined from new address
+            self._forget_peer(*old.address)
+
+    def _get_client(self, device_id, ip, port):
+        """
+        Get record of registered client sending from ip/port
 
-        self._send_packet(ip, port, APPConfigMessage(payload=client_dict))
-        self._clients[device_id] = client
-        self._key2deviceId[key] = device_id
+        :param device_id: Device id in packet
+        :type device_id: int
+        :param ip: Client ip address
+        :type ip: unicode
+        :param port: Client port
+        :type port: int
+        :return: The record (None - invalid sender)
+        :rtype: None | paps.si.app.clientRegistry.ClientRecord
+        """
+        if device_id <= Id.SERVER:
+            self.error("ProtocolViolation: Invalid device id")
+            return None
+        client = self._clients.get(device_id)
+        if client is None:
+            self.error("ProtocolViolation: Client is not registered")
+            return None
+        if client.address != (ip, port):
+            self.error(
+                u"ProtocolViolation: Client key ({}:{}) has changed: "
+                u"{}:{}".format(*(client.address + (ip, port)))
+            )
+            return None
+        return client
 
     def _do_unjoin_packet(self, packet, ip, port):
         """
@@ -160,34 +200,20 @@ class SensorServer(Sensor, SensorServerInterface):
         """
         self.debug("()")
         device_id = packet.header.device_id
-
-        if device_id <= Id.SERVER:
-            self.error("ProtocolViolation: Invalid device id")
-            return
-        client = self._clients.get(device_id)
-        if not client:
-            self.error("ProtocolViolation: Client is not registered")
-            return
-        key = u"{}:{}".format(ip, port)
-        if client['key'] != key:
-            self.error(
-                u"ProtocolViolation: Client key ({}) has changed: {}".format(
-                    client['key'], key
-                )
-            )
+        client = self._get_client(device_id, ip, port)
+        if client is None:
             return
 
         # Packet info seems ok
         try:
-            self.changer.on_person_leave(client['people'])
+            self.changer.on_person_leave(client.people())
         except:
             self.exception("Failed to remove people")
             return
 
-        # Forget client?
-        del self._clients[device_id]
-        del self._key2deviceId[key]
-        del client
+        # Forget client
+        self._clients.remove(device_id)
+        self._forget_peer(ip, port)
 
     def _do_update_packet(self, packet, ip, port):
         """
@@ -201,71 +227,121 @@ class SensorServer(Sensor, SensorServerInterface):
         :type port: int
         :rtype: None
         """
-        self.debug("()")
+        debug = self._logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            # Logging the caller is expensive - once per packet adds up
+            self.debug("()")
         device_id = packet.header.device_id
-        if device_id <= Id.SERVER:
-            self.error("ProtocolViolation: Invalid device id")
+        client = self._get_client(device_id, ip, port)
+        if client is None:
             return
-        client = self._clients.get(device_id, None)
-        if not client:
-            self.error("ProtocolViolation: Client is not registered")
+        seq = packet.header.sequence_number
+        baseline = client.baseline
+        if seq is not None and baseline is not None \
+                and not seq_after(seq, baseline[0]):
+            # Retransmit of an older baseline arriving late - outdated
+            if debug:
+                self.debug(u"Update {} older than baseline {}".format(
+                    seq, baseline[0]
+                ))
             return
-        key = u"{}:{}".format(ip, port)
-        if client['key'] != key:
-            self.error(
-                u"ProtocolViolation: Client key ({}) has changed: {}".format(
-                    client['key'], key
+
+        # Packet info seems ok
+        payload = packet.raw_payload
+        encoding = packet.encoding
+        # Most updates resend/flip a few seats of the last state
+        changed = self._clients.update_payload(device_id, payload, encoding)
+        if changed is None:
+            try:
+                view = packet.people_view()
+            except ProtocolViolation:
+                self.exception("Failed to decode people from packet")
+                return
+            if Person.BITS_PER_PERSON == 1:
+                seats = view.bits
+            else:
+                seats = bytearray([
+                    1 if view.sitting(index) else 0
+                    for index in range(len(view))
+                ])
+
+            # Verify same number of people in update as registered to client
+            # (APP specific)
+            if len(seats) != len(client.seats):
+                self.error(
+                    "ProtocolViolation: Incorrect number of people updated"
                 )
+            # Assumes same order here as on the client (e.g from the join())
+            changed = self._clients.update(
+                device_id, seats, payload, encoding
             )
-            return
+        if changed is not None and seq is not None:
+            # Acked update -> baseline for DELTAs
+            self._clients.set_baseline(device_id, seq)
+        self._notify_changed(client, changed, debug)
 
-        # Packet info seems ok
+    def _do_delta_packet(self, packet, ip, port):
+        """
+        React to delta packet - people changed relative to an acked update
+
+        Requests an acked update, if the baseline is not known
+
+        :param packet: Packet from client with changes
+        :type packet: paps.si.app.message.APPDeltaMessage
+        :param ip: Client ip address
+        :type ip: unicode
+        :param port: Client port
+        :type port: int
+        :rtype: None
+        """
+        debug = self._logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.debug("()")
+        device_id = packet.header.device_id
+        client = self._get_client(device_id, ip, port)
+        if client is None:
+            return
         try:
-            people = packet.people()
+            baseline = packet.baseline()
+            indices = packet.indices()
         except ProtocolViolation:
-            self.exception("Failed to decode people from packet")
+            self.exception("Failed to decode delta from packet")
+            return
+        try:
+            changed = self._clients.update_delta(device_id, baseline, indices)
+        except IndexError:
+            self.error("ProtocolViolation: Delta index out of range")
+            return
+        if changed is None:
+            if debug:
+                self.debug(u"Unknown baseline {} - resync".format(baseline))
+            self._send_packet(
+                ip, port, APPResyncMessage(), acknowledge_packet=False
+            )
             return
+        self._notify_changed(client, changed, debug)
 
-        # Verify same number of people in update as registered to client
-        # (APP specific)
-        if len(people) != len(client['people']):
-            self.error("ProtocolViolation: Incorrect number of people updated")
-        changed = []
-        # Add ids to all people
-        # Assumes same order here as on the client (e.g from the join())
-        for index, person in enumerate(people):
-            old = client['people'][index]
-            person.id = old.id
-            if person != old:
-                old.sitting = person.sitting
-                # Maybe sent person to protect access to local saved state
-                changed.append(old)
+    def _notify_changed(self, client, changed, debug):
+        """
+        Notify changer about changed people
+
+        :param client: Client record
+        :type client: paps.si.app.clientRegistry.ClientRecord
+        :param changed: Indices of changed people
+        :type changed: None | list[int]
+        :param debug: Is debug logging enabled
+        :type debug: bool
+        :rtype: None
+        """
         if changed:
             # Only update if there is really a change
             try:
-                self.changer.on_person_update(changed)
+                self.changer.on_person_update(client.people(changed))
             except:
                 self.exception("Failed to notify people update")
-                return
-        else:
+        elif debug:
             self.debug("No people updated")
 
-    def _new_device_id(self, key):
-        """
-        Generate a new device id or return existing device id for key
-
-        :param key: Key for device
-        :type key: unicode
-        :return: The device id
-        :rtype: int
-        """
-        device_id = Id.SERVER + 1
-        if key in self._key2deviceId:
-            return self._key2deviceId[key]
-        while device_id in self._clients:
-            device_id += 1
-        return device_id
-
     def _init_multicast_socket(self):
         """
         Init multicast socket
@@ -375,31 +451,26 @@ class SensorServer(Sensor, SensorServerInterface):
 
         super(SensorServer, self).start(blocking=False)
         self._is_stopped.clear()
-        try:
-            a_thread = threading.Thread(
-                target=self._thread_wrapper,
-                args=(self._packet_loop,)
-            )
-            a_thread.daemon = True
-            a_thread.start()
-        except:
-            self.exception("Failed to run packet loop")
-            raise SensorStartException("Packet loop failed")
+        if not self._dispatch_inline:
+            try:
+                self._start_thread(self._packet_loop)
+            except:
+                self.exception("Failed to run packet loop")
+                raise SensorStartException("Packet loop failed")
         self.info("Started")
         # Blocking
         super(Sensor, self).start(blocking)
 
     def stop(self):
         """
-        Stop the sensor server (soft stop - signal packet loop to stop)
-        Warning: Is non blocking (server might still do something after this!)
+        Stop the sensor server (returns once all threads exited)
 
         :rtype: None
         """
         self.debug("()")
+        # Signal packet loop to shutdown
+        self._is_stopped.set()
         super(SensorServer, self).stop()
         # No new clients
         if self._multicast_socket is not None:
             self._shutdown_multicast_socket()
-        # Signal packet loop to shutdown
-        self._is_stopped.set()
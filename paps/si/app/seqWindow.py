@@ -0,0 +1,118 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-11"
+# Created: 2016-05-11 09:20
+"""
+Sliding window of received sequence numbers to detect duplicates
+
+Sequence numbers are 32 bit and wrap around. A number is ahead of the
+newest one if it is less than half the number space in front of it.
+"""
+
+SEQ_MODULO = 1 << 32
+""" Number of possible sequence numbers """
+SEQ_MASK = SEQ_MODULO - 1
+""" Mask to wrap sequence numbers """
+_SEQ_HALF = SEQ_MODULO >> 1
+
+
+def seq_after(seq, other):
+    """
+    Is a sequence number newer than another one (serial number arithmetic)
+
+    :param seq: Sequence number to check
+    :type seq: int
+    :param other: Sequence number to compare to
+    :type other: int
+    :return: Is seq ahead of other
+    :rtype: bool
+    """
+    return 0 < ((seq - other) & SEQ_MASK) < _SEQ_HALF
+
+
+class SequenceWindow(object):
+    """ Recently received sequence numbers of one peer """
+
+    __slots__ = ("size", "_newest", "_bits")
+
+    def __init__(self, size=1024):
+        """
+        Initialize object
+
+        :param size: Number of sequence numbers remembered (default: 1024)
+        :type size: int
+        :rtype: None
+        """
+        self.size = size
+        """ Number of sequence numbers remembered
+            :type size: int """
+        self._newest = None
+        """ Newest received sequence number (None - nothing received)
+            :type _newest: None | int """
+        self._bits = 0
+        """ Bit i set -> _newest - i received
+            :type _bits: int """
+
+    def add(self, seq):
+        """
+        Record a received sequence number
+
+        A number further behind than the window size is taken as a restart
+        of the peer (window starts over)
+
+        :param seq: Received sequence number
+        :type seq: int
+        :return: Is it new (False - duplicate)
+        :rtype: bool
+        """
+        newest = self._newest
+        if newest is None:
+            self._reset(seq)
+            return True
+        ahead = (seq - newest) & SEQ_MASK
+        if ahead == 0:
+            return False
+        if ahead < _SEQ_HALF:
+            if ahead >= self.size:
+                self._bits = 1
+            else:
+                self._bits = ((self._bits << ahead) | 1) \
+                    & ((1 << self.size) - 1)
+            self._newest = seq
+            return True
+        behind = SEQ_MODULO - ahead
+        if behind >= self.size:
+            self._reset(seq)
+            return True
+        bit = 1 << behind
+        if self._bits & bit:
+            return False
+        self._bits |= bit
+        return True
+
+    def _reset(self, seq):
+        """
+        Start over with seq as the only received number
+
+        :param seq: Received sequence number
+        :type seq: int
+        :rtype: None
+        """
+        self._newest = seq
+        self._bits = 1
+
+    def __contains__(self, seq):
+        newest = self._newest
+        if newest is None:
+            return False
+        behind = (newest - seq) & SEQ_MASK
+        return behind < self.size and bool(self._bits >> behind & 1)
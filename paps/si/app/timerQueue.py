@@ -0,0 +1,234 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "MIT"
+__version__ = "0.1.0"
+__date__ = "2016-05-09"
+# Created: 2016-05-09 10:05
+"""
+Timers for delayed work of a sensor (heap ordered by deadline)
+
+Timers are run by whoever calls run_pending() - usually one thread
+looping run_pending()/wait()
+
+Cancelled timers stay in the heap (cancel is O(1)) and are skipped.
+When they make up more than half of the heap, it gets rebuilt without them.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class Timer(object):
+    """ Handle of a scheduled timer """
+
+    __slots__ = ("deadline", "callback", "args")
+
+    def __init__(self, deadline, callback, args):
+        """
+        Initialize object
+
+        :param deadline: When to run (unix timestamp)
+        :type deadline: float
+        :param callback: Function to call (None -> cancelled)
+        :type callback: None | callable
+        :param args: Arguments for callback
+        :type args: tuple
+        :rtype: None
+        """
+        self.deadline = deadline
+        """ When to run (unix timestamp)
+            :type deadline: float """
+        self.callback = callback
+        """ Function to call - None if cancelled or run
+            :type callback: None | callable """
+        self.args = args
+        """ Arguments for callback
+            :type args: tuple """
+
+    @property
+    def active(self):
+        """
+        Is this timer still waiting to be run
+
+        :rtype: bool
+        """
+        return self.callback is not None
+
+
+class TimerQueue(object):
+    """ Heap of timers ordered by deadline """
+
+    COMPACT_MIN = 64
+    """ Only rebuild heaps with at least this many cancelled timers """
+
+    def __init__(self):
+        """
+        Initialize object
+
+        :rtype: None
+        """
+        super(TimerQueue, self).__init__()
+        self._heap = []
+        """ Pending timers (deadline, order, timer)
+            :type _heap: list[(float, int, Timer)] """
+        self._cancelled = 0
+        """ Number of cancelled timers still in heap """
+        self._order = itertools.count()
+        """ Keeps timers with the same deadline in scheduling order """
+        self._condition = threading.Condition()
+        """ Lock for heap/wakes up wait() """
+        self._woken = False
+        """ wake() called - next wait() returns right away """
+
+    def __len__(self):
+        """ Number of active timers """
+        return len(self._heap) - self._cancelled
+
+    def schedule(self, delay, callback, *args):
+        """
+        Run callback after delay
+
+        :param delay: Seconds to wait
+        :type delay: float
+        :param callback: Function to call
+        :type callback: callable
+        :param args: Arguments for callback
+        :return: Handle to cancel timer
+        :rtype: Timer
+        """
+        timer = Timer(time.time() + delay, callback, args)
+        entry = (timer.deadline, next(self._order), timer)
+        with self._condition:
+            heapq.heappush(self._heap, entry)
+            if self._heap[0] is entry:
+                # New earliest deadline
+                self._condition.notify()
+        return timer
+
+    def cancel(self, timer):
+        """
+        Cancel timer (if not run yet)
+
+        :param timer: Timer to cancel
+        :type timer: Timer
+        :return: Was timer cancelled (False - already run/cancelled)
+        :rtype: bool
+        """
+        with self._condition:
+            if timer.callback is None:
+                return False
+            timer.callback = None
+            timer.args = ()
+            self._cancelled += 1
+            if self._cancelled >= self.COMPACT_MIN \
+                    and self._cancelled * 2 > len(self._heap):
+                self._compact()
+        return True
+
+    def _compact(self):
+        """
+        Rebuild heap without cancelled timers (lock has to be held)
+
+        :rtype: None
+        """
+        self._heap = [
+            entry for entry in self._heap if entry[2].callback is not None
+        ]
+        heapq.heapify(self._heap)
+        self._cancelled = 0
+
+    def _pop_cancelled(self):
+        """
+        Remove cancelled timers from top of heap (lock has to be held)
+
+        :rtype: None
+        """
+        heap = self._heap
+        while heap and heap[0][2].callback is None:
+            heapq.heappop(heap)
+            self._cancelled -= 1
+
+    def next_deadline(self):
+        """
+        Get the deadline of the next timer
+
+        :return: Deadline (unix timestamp) or None if no timer pending
+        :rtype: None | float
+        """
+        with self._condition:
+            self._pop_cancelled()
+            if not self._heap:
+                return None
+            return self._heap[0][0]
+
+    def run_pending(self, now=None):
+        """
+        Run all timers that are due
+
+        A raising callback stops the run, but the remaining timers stay
+        pending
+
+        :param now: Current time (default: None)
+            None -> time.time()
+        :type now: None | float
+        :return: Number of timers run
+        :rtype: int
+        """
+        if now is None:
+            now = time.time()
+        num = 0
+        while True:
+            with self._condition:
+                self._pop_cancelled()
+                if not self._heap or self._heap[0][0] > now:
+                    return num
+                _, _, timer = heapq.heappop(self._heap)
+                callback, args = timer.callback, timer.args
+                timer.callback = None
+            num += 1
+            callback(*args)
+
+    def wait(self, timeout=None):
+        """
+        Wait until the next timer is due, an earlier timer gets scheduled,
+        wake() is called or the timeout expired
+
+        :param timeout: Max seconds to wait (default: None)
+            None -> no limit
+        :type timeout: None | float
+        :rtype: None
+        """
+        with self._condition:
+            if self._woken:
+                # Woken while not waiting (e.g. running timers)
+                self._woken = False
+                return
+            self._pop_cancelled()
+            if self._heap:
+                due = self._heap[0][0] - time.time()
+                timeout = due if timeout is None else min(timeout, due)
+            if timeout is None:
+                self._condition.wait()
+            elif timeout > 0:
+                self._condition.wait(timeout)
+            self._woken = False
+
+    def wake(self):
+        """
+        Wake up a waiting thread - or make the next wait() return right
+        away, if none is waiting (e.g. on stop)
+
+        :rtype: None
+        """
+        with self._condition:
+            self._woken = True
+            self._condition.notify_all()
@@ -0,0 +1,139 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "All rights reserved"
+__version__ = "0.1.0"
+__date__ = "2016-05-12"
+# Created: 2016-05-12 14:00
+
+import pytest
+
+asyncio = pytest.importorskip("asyncio")
+
+from paps.changeInterface import ChangeInterface
+from paps.person import Person
+from paps.si.sensorInterface import SensorJoinException
+from paps.si.app.asyncSensor import AsyncSensorServer, AsyncSensorClient
+
+
+class Changer(ChangeInterface):
+    """ Record person events """
+
+    def __init__(self):
+        super(Changer, self).__init__()
+        self.events = []
+
+    def on_person_new(self, people):
+        self.events.append(('new', [p.id for p in people]))
+
+    def on_person_update(self, people):
+        self.events.append(('update', [(p.id, p.sitting) for p in people]))
+
+    def on_person_leave(self, people):
+        self.events.append(('leave', [p.id for p in people]))
+
+
+class TestAsyncSensor(object):
+    """ Test server and clients sharing one event loop """
+
+    def setup_method(self, method):
+        self.loop = asyncio.new_event_loop()
+        self.changer = Changer()
+        self.server = AsyncSensorServer({
+            'changer': self.changer,
+            'loop': self.loop,
+            'listen_bind_ip': "127.0.0.1",
+            'listen_port': 0,
+            'multicast_bind_ip': "127.0.0.1",
+            'multicast_bind_port': 0,
+        })
+        self.run(self.server.start())
+        self.server_port = self.server._listen_socket.getsockname()[1]
+        self.clients = []
+
+    def teardown_method(self, method):
+        for client in self.clients:
+            client.stop()
+        self.server.stop()
+        self.run(asyncio.sleep(0.05))
+        self.loop.close()
+
+    def run(self, awaitable, timeout=5.0):
+        return self.loop.run_until_complete(
+            asyncio.wait_for(awaitable, timeout)
+        )
+
+    def create_client(self, settings=None):
+        if settings is None:
+            settings = {}
+        settings.update({
+            'loop': self.loop,
+            'listen_bind_ip': "127.0.0.1",
+            'listen_port': 0,
+            'multicast_bind_ip': "127.0.0.1",
+            # Join directly at server
+            'multicast_group': "127.0.0.1",
+            'multicast_port': self.server_port,
+        })
+        client = AsyncSensorClient(settings)
+        self.run(client.start())
+        self.clients.append(client)
+        return client
+
+    def test_join_update_unjoin(self):
+        clients = [self.create_client() for _ in range(10)]
+        self.run(asyncio.gather(*[
+            client.join([Person(id=1), Person(id=2)]) for client in clients
+        ]))
+        assert len(self.changer.events) == 10
+        assert all(event[0] == 'new' for event in self.changer.events)
+        device_id = clients[0]._device_id
+
+        clients[0].person_update([Person(id=1, sitting=True), Person(id=2)])
+        self.run(asyncio.sleep(0.05))
+        assert self.changer.events[-1] == (
+            'update', [(u"{}.1".format(device_id), True)]
+        )
+
+        self.run(clients[0].unjoin())
+        assert self.changer.events[-1] == (
+            'leave', [u"{}.1".format(device_id), u"{}.2".format(device_id)]
+        )
+
+    def test_join_binary(self):
+        client = self.create_client({'payload_serializer': "binary"})
+        self.run(client.join([Person(id=1)]))
+        assert self.changer.events[0][0] == 'new'
+
+    def test_join_no_server(self):
+        self.server.stop()
+        client = self.create_client({
+            'join_retry_timeout': 0.05,
+            'join_retry_number': 2,
+        })
+        with pytest.raises(SensorJoinException):
+            self.run(client.join([Person(id=1)]))
+
+    def test_join_invalid_people(self):
+        client = self.create_client()
+        with pytest.raises(SensorJoinException):
+            client.join([])
+        with pytest.raises(SensorJoinException):
+            client.join([Person(id=1), Person(id=1)])
+
+    def test_unjoin_not_joined(self):
+        client = self.create_client()
+        self.run(client.unjoin())
+
+    def test_stop_leaves(self):
+        client = self.create_client()
+        self.run(client.join([Person(id=1)]))
+        self.run(client.stop())
+        assert self.changer.events[-1][0] == 'leave'
+        assert not client._transports
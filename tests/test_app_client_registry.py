@@ -0,0 +1,198 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "All rights reserved"
+__version__ = "0.1.0"
+__date__ = "2016-05-16"
+# Created: 2016-05-16 15:10
+
+import threading
+
+import pytest
+
+from paps.person import Person
+from paps.si.app.clientRegistry import ClientRegistry
+from paps.si.app.deviceIdAllocator import DeviceIdAllocator
+from paps.si.app.peopleCodec import pack_bits, pack_rle, \
+    ENCODING_RAW, ENCODING_RLE
+
+
+def people(device_id, *sitting):
+    return [
+        Person(u"{}.{}".format(device_id, index), state)
+        for index, state in enumerate(sitting)
+    ]
+
+
+class TestClientRegistry(object):
+    """ Test ClientRegistry class """
+
+    def test_add_get(self):
+        clients = ClientRegistry()
+        device_id = clients.allocate(("127.0.0.1", 2346))
+        record = clients.add(
+            device_id, ("127.0.0.1", 2346), people(device_id, True, False)
+        )
+        assert clients.get(device_id) is record
+        assert record.person_ids == (u"2.0", u"2.1")
+        assert record.seats == bytearray([1, 0])
+        assert [p.to_tuple() for p in record.people()] == [
+            (u"2.0", True), (u"2.1", False)
+        ]
+        assert clients.device_id(("127.0.0.1", 2346)) == device_id
+        assert device_id in clients
+        assert len(clients) == 1
+
+    def test_allocate_known_address(self):
+        clients = ClientRegistry()
+        clients.add(2, ("127.0.0.1", 2346), people(2, True))
+        assert clients.allocate(("127.0.0.1", 2346)) == 2
+        assert clients.allocate(("127.0.0.1", 2347)) == 3
+
+    def test_remove_releases(self):
+        clients = ClientRegistry(device_ids=DeviceIdAllocator(2, 2))
+        address = ("127.0.0.1", 2346)
+        clients.add(clients.allocate(address), address, people(2, True))
+        with pytest.raises(ValueError):
+            clients.allocate(("127.0.0.1", 2347))
+        assert clients.remove(2).address == ("127.0.0.1", 2346)
+        assert clients.remove(2) is None
+        assert clients.get(2) is None
+        assert clients.device_id(("127.0.0.1", 2346)) is None
+        assert clients.allocate(("127.0.0.1", 2347)) == 2
+
+    def test_release_registered_ignored(self):
+        clients = ClientRegistry()
+        clients.add(2, ("127.0.0.1", 2346), people(2, True))
+        clients.release(2)
+        assert clients.allocate(("127.0.0.1", 2347)) == 3
+
+    def test_update(self):
+        clients = ClientRegistry()
+        clients.add(2, ("127.0.0.1", 2346), people(2, True, False, False))
+        assert clients.update(2, bytearray([1, 0, 0])) == []
+        assert clients.update(2, bytearray([0, 0, 1])) == [0, 2]
+        assert clients.get(2).seats == bytearray([0, 0, 1])
+        # Extra seats ignored
+        assert clients.update(2, bytearray([0, 1, 1, 1])) == [1]
+        assert clients.update(3, bytearray([1])) is None
+
+    def test_update_payload(self):
+        clients = ClientRegistry()
+        clients.add(2, ("127.0.0.1", 2346), people(2, True, False, False))
+        record = clients.get(2)
+        assert record.payload == pack_bits(bytearray([1, 0, 0]))
+        assert clients.update_payload(2, pack_bits(bytearray([1, 0, 0]))) \
+            == []
+        assert clients.update_payload(2, pack_bits(bytearray([0, 0, 1]))) \
+            == [0, 2]
+        assert record.seats == bytearray([0, 0, 1])
+        assert record.payload == pack_bits(bytearray([0, 0, 1]))
+        # Other number of seats -> decode
+        assert clients.update_payload(2, pack_bits(bytearray(5))) is None
+        assert clients.update_payload(3, record.payload) is None
+
+    def test_update_keeps_payload(self):
+        clients = ClientRegistry()
+        clients.add(2, ("127.0.0.1", 2346), people(2, True))
+        payload = pack_bits(bytearray([0]))
+        assert clients.update(2, bytearray([0]), payload) == [0]
+        assert clients.get(2).payload is payload
+        # Wrong number of seats is not remembered
+        clients.update(2, bytearray([1, 1]), pack_bits(bytearray([1, 1])))
+        assert clients.get(2).payload is None
+        assert clients.update_payload(2, payload) is None
+
+    def test_update_payload_encoded(self):
+        """ Run-length/sparse payloads are only compared """
+        clients = ClientRegistry()
+        clients.add(2, ("127.0.0.1", 2346), people(2, True, True, True))
+        seats = bytearray([1, 1, 0])
+        payload = pack_rle(seats)
+        assert clients.update_payload(2, payload, ENCODING_RLE) is None
+        assert clients.update(2, seats, payload, ENCODING_RLE) == [2]
+        assert clients.get(2).encoding == ENCODING_RLE
+        assert clients.update_payload(2, payload, ENCODING_RLE) == []
+        assert clients.update_payload(
+            2, pack_rle(bytearray(3)), ENCODING_RLE
+        ) is None
+        # Same bytes, other encoding
+        assert clients.update_payload(2, payload, ENCODING_RAW) is None
+        assert clients.update_payload(2, payload, None) is None
+
+    def test_update_fewer_seats(self):
+        clients = ClientRegistry()
+        clients.add(2, ("127.0.0.1", 2346), people(2, True, True, True))
+        assert clients.update(2, bytearray([1, 0])) == [1]
+        assert clients.get(2).seats == bytearray([1, 0, 1])
+
+    def test_update_delta(self):
+        clients = ClientRegistry()
+        clients.add(2, ("127.0.0.1", 2346), people(2, False, False, False))
+        assert clients.update_delta(2, 7, [0]) is None
+        clients.update(2, bytearray([1, 0, 0]))
+        clients.set_baseline(2, 7)
+        assert clients.update_delta(2, 8, [0]) is None
+        assert clients.update_delta(2, 7, [2]) == [2]
+        assert clients.get(2).seats == bytearray([1, 0, 1])
+        assert clients.get(2).payload is None
+        # Relative to baseline, not last delta
+        assert clients.update_delta(2, 7, [0]) == [0, 2]
+        assert clients.get(2).seats == bytearray([0, 0, 0])
+        assert clients.update_delta(2, 7, [0]) == []
+        assert clients.get(2).baseline == (7, bytearray([1, 0, 0]))
+        with pytest.raises(IndexError):
+            clients.update_delta(2, 7, [3])
+        assert clients.update_delta(3, 7, []) is None
+
+    def test_snapshot_copies(self):
+        clients = ClientRegistry(stripes=2)
+        for device_id in (5, 2, 3):
+            clients.add(
+                device_id, ("127.0.0.1", device_id), people(device_id, False)
+            )
+        snapshot = clients.snapshot()
+        assert [record.device_id for record in snapshot] == [2, 3, 5]
+        clients.update(2, bytearray([1]))
+        assert snapshot[0].seats == bytearray([0])
+        assert [record.seats for record in clients] == [
+            bytearray([1]), bytearray([0]), bytearray([0])
+        ]
+
+    def test_concurrent(self):
+        clients = ClientRegistry(stripes=4)
+        errors = []
+
+        def churn(offset):
+            try:
+                for round in range(200):
+                    address = ("127.0.0.1", offset * 1000 + round % 10)
+                    device_id = clients.allocate(address)
+                    clients.add(device_id, address, people(device_id, False))
+                    clients.update(device_id, bytearray([round % 2]))
+                    if round % 3:
+                        clients.remove(device_id)
+                    len(clients.snapshot())
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=churn, args=(offset,))
+            for offset in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        snapshot = clients.snapshot()
+        device_ids = [record.device_id for record in snapshot]
+        assert len(set(device_ids)) == len(device_ids) == len(clients)
+        for record in snapshot:
+            assert clients.device_id(record.address) == record.device_id
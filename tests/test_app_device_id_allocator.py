@@ -0,0 +1,83 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "All rights reserved"
+__version__ = "0.1.0"
+__date__ = "2016-05-16"
+# Created: 2016-05-16 10:10
+
+import pytest
+
+from paps.si.app.message import Id
+from paps.si.app.deviceIdAllocator import DeviceIdAllocator, \
+    DEVICE_ID_FIRST, DEVICE_ID_LAST
+
+
+class TestDeviceIdAllocator(object):
+    """ Test DeviceIdAllocator class """
+
+    def test_range(self):
+        assert DEVICE_ID_FIRST == Id.SERVER + 1
+        assert DEVICE_ID_LAST == 0xffff
+
+    def test_allocate_sequential(self):
+        ids = DeviceIdAllocator()
+        assert [ids.allocate() for _ in range(3)] == [2, 3, 4]
+        assert len(ids) == 3
+        assert 3 in ids
+
+    def test_release_recycles_oldest_first(self):
+        ids = DeviceIdAllocator()
+        for _ in range(4):
+            ids.allocate()
+        ids.release(4)
+        ids.release(2)
+        assert 2 not in ids
+        assert ids.allocate() == 4
+        assert ids.allocate() == 2
+        assert ids.allocate() == 6
+
+    def test_release_unknown(self):
+        ids = DeviceIdAllocator()
+        ids.release(7)
+        assert ids.allocate() == 2
+        assert len(ids) == 1
+
+    def test_reserve_skipped(self):
+        ids = DeviceIdAllocator()
+        ids.reserve(3)
+        assert ids.allocate() == 2
+        assert ids.allocate() == 4
+        ids.release(2)
+        ids.reserve(2)
+        assert ids.allocate() == 5
+
+    def test_reserve_out_of_range(self):
+        ids = DeviceIdAllocator()
+        with pytest.raises(ValueError):
+            ids.reserve(Id.SERVER)
+        with pytest.raises(ValueError):
+            ids.reserve(DEVICE_ID_LAST + 1)
+
+    def test_exhausted(self):
+        ids = DeviceIdAllocator(2, 3)
+        ids.allocate()
+        ids.allocate()
+        with pytest.raises(ValueError):
+            ids.allocate()
+        ids.release(2)
+        assert ids.allocate() == 2
+
+    def test_full_id_space(self):
+        ids = DeviceIdAllocator()
+        allocated = set(ids.allocate() for _ in range(0xffff - 1))
+        assert min(allocated) == DEVICE_ID_FIRST
+        assert max(allocated) == DEVICE_ID_LAST
+        with pytest.raises(ValueError):
+            ids.allocate()
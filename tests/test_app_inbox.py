@@ -0,0 +1,210 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "All rights reserved"
+__version__ = "0.1.0"
+__date__ = "2016-05-13"
+# Created: 2016-05-13 15:00
+
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    # running python3
+    import queue
+
+import pytest
+
+from paps.person import Person
+from paps.si.app.message import APPJoinMessage, APPUnjoinMessage, \
+    APPDataMessage, APPUpdateMessage, APPDeltaMessage, APPResyncMessage
+from paps.si.app.inbox import Inbox
+
+
+def update(device_id, sitting):
+    return APPUpdateMessage(
+        device_id=device_id, people=[Person(sitting=sitting)]
+    )
+
+
+class TestInbox(object):
+    """ Test Inbox class """
+
+    def test_fifo(self):
+        inbox = Inbox()
+        join = APPJoinMessage(device_id=2, payload={})
+        inbox.put(("127.0.0.1", 2346, join))
+        inbox.put(("127.0.0.1", 2346, update(2, True)))
+        assert inbox.qsize() == 2
+        assert inbox.get() == ("127.0.0.1", 2346, join)
+        assert inbox.get()[2].people()[0].sitting is True
+        assert inbox.empty()
+
+    def test_update_latest_wins(self):
+        inbox = Inbox()
+        first = update(2, True)
+        other = update(3, True)
+        newest = update(2, False)
+        inbox.put(("127.0.0.1", 2346, first))
+        inbox.put(("127.0.0.1", 2347, other))
+        inbox.put(("127.0.0.1", 2346, newest))
+        assert inbox.qsize() == 2
+        # Keeps position of first update
+        assert inbox.get()[2] is newest
+        assert inbox.get()[2] is other
+        assert inbox.stats()['coalesced'] == 1
+
+    def test_update_after_get_queued(self):
+        inbox = Inbox()
+        inbox.put(("127.0.0.1", 2346, update(2, True)))
+        inbox.get()
+        newest = update(2, False)
+        inbox.put(("127.0.0.1", 2346, newest))
+        assert inbox.get()[2] is newest
+
+    def test_delta_replaces_update(self):
+        inbox = Inbox()
+        inbox.put(("127.0.0.1", 2346, update(2, True)))
+        delta = APPDeltaMessage(device_id=2, baseline=1, indices=[0])
+        inbox.put(("127.0.0.1", 2346, delta))
+        assert inbox.qsize() == 1
+        assert inbox.get()[2] is delta
+
+    def test_acked_update_not_replaced(self):
+        inbox = Inbox()
+        baseline = update(2, True)
+        baseline.header.sequence_number = 7
+        inbox.put(("127.0.0.1", 2346, update(2, False)))
+        inbox.put(("127.0.0.1", 2346, baseline))
+        first = APPDeltaMessage(device_id=2, baseline=7, indices=[0])
+        newest = APPDeltaMessage(device_id=2, baseline=7, indices=[])
+        inbox.put(("127.0.0.1", 2346, first))
+        inbox.put(("127.0.0.1", 2346, newest))
+        assert inbox.qsize() == 3
+        assert inbox.get()[2].people()[0].sitting is False
+        assert inbox.get()[2] is baseline
+        assert inbox.get()[2] is newest
+
+    def test_resync_control(self):
+        inbox = Inbox()
+        inbox.put(("127.0.0.1", 2346, update(2, True)))
+        resync = APPResyncMessage(device_id=1)
+        inbox.put(("127.0.0.1", 2346, resync))
+        assert inbox.get()[2] is resync
+
+    def test_control_first(self):
+        inbox = Inbox()
+        inbox.put(("127.0.0.1", 2346, update(2, True)))
+        unjoin = APPUnjoinMessage(device_id=2)
+        inbox.put(("127.0.0.1", 2346, unjoin))
+        join = APPJoinMessage(device_id=3, payload={})
+        inbox.put(("127.0.0.1", 2347, join))
+        assert inbox.qsize() == 3
+        assert inbox.get()[2] is unjoin
+        assert inbox.get()[2] is join
+        assert inbox.get()[2].people()[0].sitting is True
+
+    def test_wait_metrics(self):
+        inbox = Inbox()
+        inbox.put(("127.0.0.1", 2346, update(2, True)))
+        inbox.put(("127.0.0.1", 2347, APPJoinMessage(device_id=3, payload={})))
+        time.sleep(0.02)
+        inbox.get()
+        stats = inbox.stats()
+        assert stats['control']['handled'] == 1
+        assert stats['control']['size'] == 0
+        assert 0.02 <= stats['control']['wait_max'] < 1.0
+        assert stats['control']['wait_avg'] == stats['control']['wait_max']
+        assert stats['bulk'] == {
+            'size': 1, 'handled': 0, 'wait_avg': 0.0, 'wait_max': 0.0
+        }
+
+    def test_full_drops_updates(self):
+        inbox = Inbox(2)
+        assert inbox.put(("127.0.0.1", 2346, update(2, True)))
+        assert inbox.put(("127.0.0.1", 2347, update(3, True)))
+        assert not inbox.put(("127.0.0.1", 2348, update(4, True)))
+        # Same device is still coalesced
+        assert inbox.put(("127.0.0.1", 2346, update(2, False)))
+        stats = inbox.stats()
+        assert stats['size'] == 2
+        assert stats['coalesced'] == 1
+        assert stats['dropped'] == 1
+
+    def test_accepts(self):
+        """ Would put() add the packet (checked before acking) """
+        inbox = Inbox(1)
+        inbox.put(("127.0.0.1", 2346, update(2, True)))
+        data = APPDataMessage(device_id=3, payload={'a': 1})
+        data.header.sequence_number = 5
+        keyframe = update(2, False)
+        keyframe.header.sequence_number = 6
+        assert not inbox.accepts(("127.0.0.1", 2347, data))
+        assert not inbox.accepts(("127.0.0.1", 2346, keyframe))
+        # Replaces the waiting state/control packet
+        assert inbox.accepts(("127.0.0.1", 2346, update(2, False)))
+        assert inbox.accepts(
+            ("127.0.0.1", 2347, APPJoinMessage(device_id=3, payload={}))
+        )
+        assert inbox.stats()['dropped'] == 2
+        # Bounded for sequenced packets as well
+        assert not inbox.put(("127.0.0.1", 2347, data))
+        inbox.get()
+        assert inbox.accepts(("127.0.0.1", 2347, data))
+        assert Inbox(0).accepts(("127.0.0.1", 2347, data))
+
+    def test_full_keeps_join(self):
+        inbox = Inbox(1)
+        inbox.put(("127.0.0.1", 2346, update(2, True)))
+        assert inbox.put(
+            ("127.0.0.1", 2347, APPJoinMessage(device_id=3, payload={}))
+        )
+        assert inbox.qsize() == 2
+        assert inbox.stats()['dropped'] == 0
+
+    def test_unbounded(self):
+        inbox = Inbox(0)
+        for device_id in range(2, 102):
+            inbox.put(("127.0.0.1", 2346, update(device_id, True)))
+        assert inbox.qsize() == 100
+
+    def test_get_empty(self):
+        inbox = Inbox()
+        with pytest.raises(queue.Empty):
+            inbox.get(False)
+        with pytest.raises(queue.Empty):
+            inbox.get(timeout=0.01)
+
+    def test_get_waits(self):
+        inbox = Inbox()
+        packet = update(2, True)
+        timer = threading.Timer(
+            0.01, inbox.put, args=(("127.0.0.1", 2346, packet),)
+        )
+        timer.start()
+        assert inbox.get(timeout=1.0)[2] is packet
+        timer.join()
+
+    def test_wake(self):
+        inbox = Inbox()
+        waker = threading.Timer(0.01, inbox.wake)
+        waker.start()
+        with pytest.raises(queue.Empty):
+            inbox.get()
+        waker.join()
+        # Only one get() returns
+        with pytest.raises(queue.Empty):
+            inbox.get(timeout=0.01)
+
+    def test_wake_before_get(self):
+        inbox = Inbox()
+        inbox.wake()
+        with pytest.raises(queue.Empty):
+            inbox.get()
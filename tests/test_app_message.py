@@ -24,7 +24,10 @@ from paps.si.app.message import Id, MsgType, Flag,\
     format_data, format_message_type,\
     guess_class, guess_message_type,\
     APPHeader, APPMessage, APPDataMessage, APPUpdateMessage, APPConfigMessage,\
-    APPJoinMessage, APPUnjoinMessage
+    APPJoinMessage, APPUnjoinMessage, APPDeltaMessage, APPResyncMessage,\
+    ProtocolViolation
+from paps.si.app import peopleCodec
+from paps.si.app.payloadSerializer import BINARY_SERIALIZER
 from paps import Person
 
 logging.basicConfig(level=logging.DEBUG)
@@ -68,6 +71,12 @@ class TestModuleLevel(object):
     def test_format_message_type_UPDATE(self):
         assert format_message_type(MsgType.UPDATE) == "UPDATE"
 
+    def test_format_message_type_DELTA(self):
+        assert format_message_type(MsgType.DELTA) == "DELTA"
+
+    def test_format_message_type_RESYNC(self):
+        assert format_message_type(MsgType.RESYNC) == "RESYNC"
+
     def test_format_message_type_Unkown(self):
         assert format_message_type(123456) == "123456"
 
@@ -98,8 +107,14 @@ class TestModuleLevel(object):
     def test_guess_class_DATA(self):
         assert guess_class(MsgType.DATA) is APPDataMessage
 
+    def test_guess_class_DELTA(self):
+        assert guess_class(MsgType.DELTA) is APPDeltaMessage
+
+    def test_guess_class_RESYNC(self):
+        assert guess_class(MsgType.RESYNC) is APPResyncMessage
+
     def test_guess_class_unknown(self):
-        assert guess_class(6) is None
+        assert guess_class(8) is None
 
     def test_guess_message_type_unkown(self):
         assert guess_message_type(APPMessage(MsgType.NOT_SET)) is None
@@ -151,17 +166,15 @@ class TestAPPHeader:
 
     def test_init_default_values(self):
         """ Test the default values of __init__ """
-        with mock.patch("paps.si.app.message.datetime.datetime") \
-                as mockutc:
-            mockutc.__bases__ = (datetime.datetime,)
-            mockutc.utcnow.return_value = self.now.replace(tzinfo=None)
+        with mock.patch("paps.si.app.message.time.time") as mock_time:
             head = APPHeader()
-            mockutc.utcnow.assert_called_once_with()
+            # Timestamp is only set when packing
+            assert not mock_time.called
         assert head.message_type == MsgType.NOT_SET
         assert head.device_id == Id.NOT_SET
         assert head.payload_length == 0
         assert head.flags == 0
-        assert head._timestamp == self.now
+        assert head._timestamp is None
         assert head.ack_sequence_number is None
         assert head.sequence_number is None
         assert head.version_major == 1
@@ -265,16 +278,33 @@ class TestAPPHeader:
         assert head.timestamp == self.now
 
     def test_set_timestamp_to_current(self):
-        """ Test setTimestampToCurrent calls datetime.utcnow() """
+        """ Test setTimestampToCurrent calls time.time() """
         head = APPHeader()
-        with mock.patch("paps.si.app.message.datetime.datetime") \
-                as mockutc:
-            mockutc.__bases__ = (datetime.datetime,)
-            mockutc.utcnow.return_value = self.now.replace(tzinfo=None)
+        with mock.patch("paps.si.app.message.time.time") as mock_time:
+            mock_time.return_value = self.now_time
             head.set_timestamp_to_current()
-            mockutc.utcnow.assert_called_once_with()
-        # Note: head._timestamp is not a float, because it does not recognize
-        #       it as a datetime.datetime when setting it in set_timestamp
+            mock_time.assert_called_once_with()
+        assert head._timestamp == self.now_time
+        assert head.timestamp == self.now
+
+    def test_unpack_no_clock_read(self):
+        """ Unpacking uses the transmitted timestamp """
+        data = APPHeader(
+            message_type=MsgType.ACK, device_id=5, timestamp=5.0
+        ).pack()
+        with mock.patch("paps.si.app.message.time.time") as mock_time:
+            head, _ = APPHeader.unpack(data)
+            assert not mock_time.called
+        assert head._timestamp == 5.0
+
+    def test_pack_sets_timestamp(self):
+        """ Header without timestamp is stamped when packed """
+        head = APPHeader(message_type=MsgType.ACK, device_id=5)
+        with mock.patch("paps.si.app.message.time.time") as mock_time:
+            mock_time.return_value = 7.0
+            head2, _ = APPHeader.unpack(head.pack())
+        assert head._timestamp == 7.0
+        assert head2._timestamp == 7.0
 
     def test_pack_update_timestamp_use_current(self):
         """ Test packing with timestamp update at pack """
@@ -405,7 +435,7 @@ class TestAPPHeader:
     def test_pack_message_type_invalid_value_too_high(self):
         """ Fail because of message type value too high """
         head = APPHeader(
-            message_type=6,
+            message_type=8,
             device_id=Id.REQUEST
         )
         with pytest.raises(ValueError):
@@ -432,7 +462,173 @@ class TestAPPHeader:
         )
         head.pack()
 
-    # TODO: Test unpack
+    def test_unpack(self):
+        """ Test unpacking of a packed header """
+        data = "32:01:00:00:4e:ab:47:3f:00:01:00:00"
+        data = "".join([chr(int(h, 16)) for h in data.split(":")]) + "rest"
+        head, rem = APPHeader.unpack(data)
+        assert rem == "rest"
+        assert head.version_major == 3
+        assert head.version_minor == 2
+        assert head.message_type == MsgType.JOIN
+        assert head.device_id == Id.SERVER
+        assert head.sequence_number is None
+        assert head.ack_sequence_number is None
+
+    def test_pack_unpack_seq_ack(self):
+        """ Sequence number is packed before ack sequence number """
+        head = APPHeader(
+            message_type=MsgType.DATA,
+            device_id=Id.SERVER,
+            timestamp=5.0,
+            sequence_number=3,
+            ack_sequence_number=7
+        )
+        data = head.pack()
+        assert format_data(data[12:]) == "00:00:00:03:00:00:00:07"
+        head2, rem = APPHeader.unpack(data)
+        assert rem == ""
+        assert head2.flags == Flag.SEQ | Flag.ACKSEQ
+        assert head2.sequence_number == 3
+        assert head2.ack_sequence_number == 7
+        assert head2._timestamp == 5.0
+
+    def test_pack_into_unpack_from(self):
+        """ Pack into and unpack from a buffer at an offset """
+        head = APPHeader(
+            message_type=MsgType.UPDATE,
+            device_id=5,
+            payload_length=2,
+            timestamp=5.0,
+            ack_sequence_number=9
+        )
+        buff = bytearray(4 + head.size)
+        end = head.pack_into(buff, 4)
+        assert end == len(buff)
+        assert bytes(buff[4:]) == head.pack()
+        head2, offset = APPHeader.unpack_from(memoryview(buff), 4)
+        assert offset == end
+        assert head2.message_type == MsgType.UPDATE
+        assert head2.device_id == 5
+        assert head2.payload_length == 2
+        assert head2.ack_sequence_number == 9
+        assert head2.sequence_number is None
+
+    def test_pack_unpack_ack_mask(self):
+        """ Ack mask is packed after the ack sequence number """
+        head = APPHeader(
+            message_type=MsgType.ACK,
+            device_id=Id.SERVER,
+            timestamp=5.0,
+            ack_sequence_number=0xfffffffe,
+            ack_mask=0b1011
+        )
+        data = head.pack()
+        assert head.flags == Flag.ACKSEQ | Flag.ACKMASK
+        assert len(data) == head.size == 20
+        assert format_data(data[12:]) == "ff:ff:ff:fe:00:00:00:0b"
+        head2, rem = APPHeader.unpack(data)
+        assert rem == ""
+        assert head2.ack_mask == 0b1011
+        assert head2.acked_sequence_numbers() == [
+            0xfffffffe, 0xffffffff, 0, 2
+        ]
+
+    @pytest.mark.parametrize("seq, ack, mask", [
+        (seq, ack, mask)
+        for seq in (None, 7)
+        for ack in (None, 8)
+        for mask in (None, 5)
+    ])
+    def test_pack_unpack_optional(self, seq, ack, mask):
+        """ Every combination of optional fields decodes in one go """
+        head = APPHeader(
+            message_type=MsgType.ACK, device_id=Id.SERVER, timestamp=5.0,
+            sequence_number=seq, ack_sequence_number=ack, ack_mask=mask
+        )
+        head2, rem = APPHeader.unpack(head.pack() + "rest")
+        assert rem == "rest"
+        assert head2.flags == head.flags
+        assert head2.sequence_number == seq
+        assert head2.ack_sequence_number == ack
+        assert head2.ack_mask == (mask if ack is not None else None)
+        assert head2._timestamp == 5.0
+
+    def test_unpack_ack_mask_without_ack(self):
+        """ Ack mask only read together with the ack sequence number """
+        head = APPHeader(
+            message_type=MsgType.ACK, device_id=Id.SERVER, timestamp=5.0,
+            sequence_number=1
+        )
+        data = bytearray(head.pack())
+        data[11] |= Flag.ACKMASK
+        head2, rem = APPHeader.unpack(bytes(data) + "rest")
+        assert rem == "rest"
+        assert head2.sequence_number == 1
+        assert head2.ack_mask is None
+
+    def test_unpack_usec_too_short(self):
+        head = APPHeader(
+            message_type=MsgType.ACK, device_id=5, timestamp=5.0,
+            version_minor=1
+        )
+        with pytest.raises(ProtocolViolation):
+            APPHeader.unpack(head.pack()[:14])
+
+    def test_pack_optional_flags_follow_fields(self):
+        """ Flags of optional fields are set by the fields present """
+        head = APPHeader(
+            message_type=MsgType.ACK,
+            device_id=Id.SERVER,
+            timestamp=5.0,
+            sequence_number=1,
+            ack_mask=3
+        )
+        head.pack()
+        assert head.flags == Flag.SEQ
+        head.sequence_number = None
+        head.ack_sequence_number = 2
+        head2, _ = APPHeader.unpack(head.pack())
+        assert head.flags == Flag.ACKSEQ | Flag.ACKMASK
+        assert head2.acked_sequence_numbers() == [2, 3, 4]
+
+    def test_pack_unpack_usec_timestamp(self):
+        """ Protocol 1.1 transmits the timestamp in microseconds """
+        t = 1462435200.123456
+        head = APPHeader(
+            message_type=MsgType.UPDATE,
+            device_id=5,
+            timestamp=t,
+            sequence_number=3,
+            version_minor=1
+        )
+        data = head.pack()
+        assert len(data) == head.size == 20
+        assert format_data(data[:12]) == "11:04:00:00:00:05:32:13:ba:9c:42:40"
+        head2, rem = APPHeader.unpack(data + "rest")
+        assert rem == "rest"
+        assert head2.version == "1.1"
+        assert head2.sequence_number == 3
+        assert abs(head2._timestamp - t) < 1e-6
+
+    def test_unpack_versions_mixed(self):
+        """ Decoding depends on the version of each header """
+        old = APPHeader(
+            message_type=MsgType.ACK, device_id=5, timestamp=5.0
+        )
+        new = APPHeader(
+            message_type=MsgType.ACK, device_id=6, timestamp=5.0,
+            version_minor=1
+        )
+        data = old.pack() + new.pack() + old.pack()
+        head1, offset = APPHeader.unpack_from(data)
+        head2, offset = APPHeader.unpack_from(data, offset)
+        head3, offset = APPHeader.unpack_from(data, offset)
+        assert offset == len(data)
+        assert (head1.version, head2.version, head3.version) == \
+            ("1.0", "1.1", "1.0")
+        assert head2.device_id == 6
+        assert head2._timestamp == head3._timestamp == 5.0
 
 
 class TestAPPDataMessage:
@@ -453,6 +649,117 @@ class TestAPPDataMessage:
         assert p.header.sequence_number == p2.header.sequence_number
         assert p.header.device_id == p2.header.device_id
 
+    def test_payload_none(self):
+        p = APPDataMessage(device_id=Id.SERVER)
+        assert p.payload is None
+        p2, rem = APPDataMessage.unpack(p.pack())
+        assert p2.payload is None
+
+    def test_payload_decoded_once(self):
+        data = APPDataMessage(device_id=Id.SERVER, payload={'a': 1}).pack()
+        p, rem = APPDataMessage.unpack(data)
+        with mock.patch(
+            "paps.si.app.payloadSerializer.loadJSON", return_value={'a': 1}
+        ) as mock_load:
+            assert p.payload == {'a': 1}
+            assert p.payload is p.payload
+            mock_load.assert_called_once_with(p.raw_payload)
+
+    def test_payload_encoded_lazily(self):
+        with mock.patch(
+            "paps.si.app.payloadSerializer.saveJSON", return_value="[1]"
+        ) as mock_save:
+            p = APPDataMessage(device_id=Id.SERVER, payload=[1])
+            assert not mock_save.called
+            data = p.pack()
+            assert p.pack() == data
+            mock_save.assert_called_once_with([1], pretty=False)
+        assert p.header.payload_length == 3
+        p.payload = [1, 2]
+        assert p.raw_payload == "[1,2]"
+        assert p.header.payload_length == 5
+
+    def test_unpack_from_consecutive(self):
+        p1 = APPDataMessage(device_id=Id.SERVER, payload={'a': 1})
+        p2 = APPDataMessage(device_id=Id.SERVER, payload=[1, 2])
+        data = p1.pack() + p2.pack()
+        m1, offset = APPDataMessage.unpack_from(data)
+        m2, offset = APPDataMessage.unpack_from(data, offset)
+        assert offset == len(data)
+        assert m1.payload == {'a': 1}
+        assert m2.payload == [1, 2]
+
+    @pytest.mark.parametrize("value", [
+        None, True, False, 0, -1, 127, 128, -32769, 2 ** 40, 1.5,
+        u"", u"abc", u"\xe4\u20ac", [], [1, u"a", None],
+        {u"a": {u"b": [1, 2.5]}}, {1: u"one"},
+        [{'sitting': True, 'id': 0}, {'sitting': False, 'id': 70000}],
+        [{'sitting': False, 'id': u"seat1"}, {'sitting': True, 'id': None}],
+    ])
+    def test_binary_serializer_roundtrip(self, value):
+        assert BINARY_SERIALIZER.loads(BINARY_SERIALIZER.dumps(value)) == value
+
+    def test_binary_serializer_invalid(self):
+        with pytest.raises(ValueError):
+            BINARY_SERIALIZER.dumps(object())
+        with pytest.raises(ValueError):
+            BINARY_SERIALIZER.dumps(2 ** 64)
+        with pytest.raises(ValueError):
+            BINARY_SERIALIZER.loads(b"\xff")
+        with pytest.raises(ValueError):
+            BINARY_SERIALIZER.loads(BINARY_SERIALIZER.dumps(u"abc")[:-1])
+        with pytest.raises(ValueError):
+            BINARY_SERIALIZER.loads(BINARY_SERIALIZER.dumps(1) + b"\x00")
+
+    def test_binary_pack_unpack(self):
+        pay = {u'people': [{'sitting': bool(i % 2), 'id': i} for i in range(5)]}
+        p = APPDataMessage(
+            device_id=Id.SERVER, payload=pay, serializer=Flag.BINARY
+        )
+        data = p.pack()
+        assert p.header.flags & Flag.BINARY
+        p2, rem = APPDataMessage.unpack(data)
+        assert rem == ""
+        assert p2.serializer == Flag.BINARY
+        assert p2.payload == pay
+
+    def test_serializer_switch(self):
+        p = APPDataMessage(device_id=Id.SERVER, payload=[1, 2])
+        assert p.serializer == 0
+        json_data = p.raw_payload
+        p.serializer = Flag.BINARY
+        assert p.raw_payload != json_data
+        assert p.header.flags & Flag.BINARY
+        p2, _ = APPDataMessage.unpack(p.pack())
+        p2.serializer = 0
+        assert p2.raw_payload == json_data
+        assert not p2.header.flags & Flag.BINARY
+
+    def test_serializer_flags(self):
+        assert APPDataMessage.serializer_flags("json") == 0
+        assert APPDataMessage.serializer_flags("binary") == Flag.BINARY
+        with pytest.raises(KeyError):
+            APPDataMessage.serializer_flags("xml")
+        with pytest.raises(ValueError):
+            APPDataMessage(serializer=Flag.SEQ)
+
+    def test_serializer_mismatch(self):
+        data = APPDataMessage(device_id=Id.SERVER, payload=[1]).pack()
+        p, _ = APPDataMessage.unpack(data)
+        p.header.flags |= Flag.BINARY
+        with pytest.raises(ValueError):
+            p.payload
+
+    @pytest.mark.parametrize("flags", [
+        Flag.SEQ, Flag.ACKSEQ, Flag.ACKMASK, Flag.RLE, Flag.SPARSE,
+        Flag.ACKMASK | 64,
+    ])
+    def test_register_serializer_reserved_flags(self, flags):
+        with pytest.raises(ValueError):
+            APPDataMessage.register_serializer(flags, BINARY_SERIALIZER)
+        assert flags not in APPDataMessage.serializers
+        assert APPDataMessage.serializer_mask == Flag.BINARY
+
 
 class TestAPPJoinMessage:
     """ Test APPJoinMessage class """
@@ -476,6 +783,21 @@ class TestAPPJoinMessage:
         packet = APPJoinMessage(payload={'people': [0, 0, 0]})
         packet.pack(update_timestamp=True)
 
+    def test_binary_large_join(self):
+        people = [
+            Person(id=i, sitting=bool(i % 3)).to_dict() for i in range(1000)
+        ]
+        json_data = APPJoinMessage(
+            device_id=2, payload={'people': people}
+        ).pack()
+        data = APPJoinMessage(
+            device_id=2, payload={'people': people}, serializer=Flag.BINARY
+        ).pack()
+        assert len(json_data) > 4096
+        assert len(data) <= 4096
+        p, _ = APPJoinMessage.unpack(data)
+        assert p.payload['people'] == people
+
 
 class TestAPPUnjoinMessage:
     """ Test APPUnjoinMessage class """
@@ -485,6 +807,47 @@ class TestAPPUnjoinMessage:
         assert p.header.message_type == MsgType.UNJOIN
 
 
+class TestAPPDeltaMessage:
+    """ Test APPDeltaMessage class """
+
+    def test_pack_unpack(self):
+        packet = APPDeltaMessage(
+            device_id=3, baseline=0xfffffffe, indices=[0, 7, 0xffff]
+        )
+        assert packet.header.message_type == MsgType.DELTA
+        assert len(packet.payload) == APPDeltaMessage.packed_size(3) == 10
+        p, rem = APPDeltaMessage.unpack(packet.pack() + b"rest")
+        assert rem == b"rest"
+        assert p.header.device_id == 3
+        assert p.baseline() == 0xfffffffe
+        assert p.indices() == (0, 7, 0xffff)
+
+    def test_empty(self):
+        p, _ = APPDeltaMessage.unpack(APPDeltaMessage(baseline=5).pack())
+        assert p.baseline() == 5
+        assert p.indices() == ()
+
+    def test_malformed(self):
+        packet = APPDeltaMessage()
+        packet.payload = b"\x00\x00\x00"
+        with pytest.raises(ProtocolViolation):
+            packet.baseline()
+        with pytest.raises(ProtocolViolation):
+            packet.indices()
+        packet.payload = b"\x00\x00\x00\x00\x01"
+        with pytest.raises(ProtocolViolation):
+            packet.indices()
+
+
+class TestAPPResyncMessage:
+    """ Test APPResyncMessage class """
+
+    def test_guess_msg_type(self):
+        p = APPResyncMessage()
+        assert p.header.message_type == MsgType.RESYNC
+        assert p.payload == b""
+
+
 class TestAPPUpdateMessage:
     """ Test APPUpdateMessage class """
 
@@ -646,3 +1009,191 @@ class TestAPPUpdateMessage:
         assert not people[5].sitting
         assert people[6].sitting
         assert people[7].sitting
+
+    def test_people_malformed_marker(self):
+        """ Leading zero byte -> no marker """
+        packet = APPUpdateMessage(device_id=2, people=[])
+        packet._payload = "\x00\x03"
+        with pytest.raises(ProtocolViolation):
+            packet.people()
+
+    def test_bits_init(self):
+        """ Initialize from bits instead of people """
+        packet = APPUpdateMessage(device_id=2, bits=bytearray([0, 1]))
+        assert format_data(packet.payload) == "05"
+        assert packet.bits() == bytearray([0, 1])
+
+    def test_people_view_lazy(self):
+        """ View decodes once per payload and creates people on access """
+        people = [Person(sitting=bool(i % 3)) for i in range(2000)]
+        packet = APPUpdateMessage(device_id=2, people=people)
+        view = packet.people_view()
+        assert packet.people_view() is view
+        assert len(view) == 2000
+        assert not view.sitting(0)
+        assert view.sitting(1)
+        assert view[-1].sitting == people[-1].sitting
+        assert [p.sitting for p in view[3:6]] == [False, True, True]
+        with pytest.raises(IndexError):
+            view[2000]
+        packet._payload = "\x03"
+        assert packet.people_view() is not view
+
+    @pytest.mark.parametrize("size", [0, 1, 7, 8, 9, 2000, 5003])
+    def test_pack_unpack_bits(self, size):
+        """ Pure python and numpy codec agree with each other """
+        bits = bytearray([(i * 7 + i // 5) % 2 for i in range(size)])
+        packed = peopleCodec.pack_bits(bits)
+        assert peopleCodec.unpack_bits(packed) == bits
+        if peopleCodec.numpy is not None:
+            assert peopleCodec._pack_bits_numpy(bits) == packed
+            assert peopleCodec._unpack_bits_numpy(packed) == bits
+
+    @pytest.mark.parametrize("size", [1, 7, 8, 9, 2000])
+    def test_diff_bits(self, size):
+        old = bytearray([i % 2 for i in range(size)])
+        new = bytearray(old)
+        flipped = sorted(set([0, size // 2, size - 1]))
+        for index in flipped:
+            new[index] ^= 1
+        packed = peopleCodec.pack_bits(old)
+        assert peopleCodec.diff_bits(packed, packed, size) == []
+        assert peopleCodec.diff_bits(
+            packed, peopleCodec.pack_bits(new), size
+        ) == flipped
+
+    @pytest.mark.parametrize("size", [1, 7, 8, 9, 2000])
+    def test_diff_seats(self, size):
+        old = bytearray([i % 2 for i in range(size)])
+        new = bytearray(old)
+        flipped = sorted(set([0, size // 2, size - 1]))
+        for index in flipped:
+            new[index] ^= 1
+        assert peopleCodec.diff_seats(old, bytearray(old)) == []
+        assert peopleCodec.diff_seats(old, new) == flipped
+        assert peopleCodec.diff_seats(bytearray(), bytearray()) == []
+
+    def test_diff_bits_not_comparable(self):
+        packed = peopleCodec.pack_bits(bytearray(3))
+        # Other length
+        assert peopleCodec.diff_bits(
+            packed, peopleCodec.pack_bits(bytearray(9)), 3
+        ) is None
+        # Same length, marker moved
+        assert peopleCodec.diff_bits(
+            packed, peopleCodec.pack_bits(bytearray(5)), 3
+        ) is None
+
+    @pytest.mark.parametrize("encoding", [
+        peopleCodec.ENCODING_RAW, peopleCodec.ENCODING_RLE,
+        peopleCodec.ENCODING_SPARSE
+    ])
+    @pytest.mark.parametrize("size", [0, 1, 8, 130, 2000, 5003])
+    def test_encode_decode_bits(self, encoding, size):
+        """ Pure python and numpy codecs agree with each other """
+        patterns = [
+            bytearray(size),
+            bytearray([1]) * size,
+            bytearray([(i * 7 + i // 5) % 2 for i in range(size)]),
+            bytearray([1 if i % 97 == 3 else 0 for i in range(size)]),
+        ]
+        for bits in patterns:
+            used, data = peopleCodec.encode_bits(bits, encoding)
+            assert used == encoding
+            assert peopleCodec.decode_bits(encoding, data) == bits
+            if peopleCodec.numpy is None:
+                continue
+            with mock.patch.object(peopleCodec, "numpy", None):
+                assert peopleCodec.encode_bits(bits, encoding)[1] == data
+                assert peopleCodec.decode_bits(encoding, data) == bits
+
+    def test_choose_encoding(self):
+        """ Smallest encoding wins - bitmap on a tie """
+        assert peopleCodec.choose_encoding(bytearray(3)) == \
+            peopleCodec.ENCODING_RAW
+        mixed = bytearray([i % 2 for i in range(1000)])
+        assert peopleCodec.choose_encoding(mixed) == peopleCodec.ENCODING_RAW
+        few = bytearray(1000)
+        few[10] = few[500] = 1
+        assert peopleCodec.choose_encoding(few) == \
+            peopleCodec.ENCODING_SPARSE
+        rows = bytearray([i // 100 % 2 for i in range(1000)])
+        assert peopleCodec.choose_encoding(rows) == peopleCodec.ENCODING_RLE
+        used, data = peopleCodec.encode_bits(bytearray([1]) * 1000)
+        assert len(data) == 3
+        # Too many bits for 16 bit indices
+        assert peopleCodec.sparse_size(
+            bytearray(peopleCodec.SPARSE_MAX_BITS + 1)
+        ) is None
+        with pytest.raises(ValueError):
+            peopleCodec.encode_bits(bytearray(3), 3)
+
+    @pytest.mark.parametrize("data", [
+        b"", b"\x02\x05", b"\x00\x85",
+        # Decodes to more than MAX_BITS
+        b"\x00\xff\xff\x7f",
+    ])
+    def test_unpack_rle_malformed(self, data):
+        with pytest.raises(ValueError):
+            peopleCodec.unpack_rle(data)
+        with pytest.raises(ValueError):
+            peopleCodec.unpack_rle(data + b"\x80" * 200 + b"\x01")
+
+    @pytest.mark.parametrize("data", [
+        b"\x00\x00", b"\x02\x00\x01", b"\x00\x00\x03\x00",
+        b"\x00\x00\x03\x00\x03",
+    ])
+    def test_unpack_sparse_malformed(self, data):
+        with pytest.raises(ValueError):
+            peopleCodec.unpack_sparse(data)
+
+    def test_update_encoding_flags(self):
+        """ Encoding is selected by header flags """
+        people = [Person(sitting=True) for _ in range(100)]
+        packet = APPUpdateMessage(device_id=2, people=people)
+        assert packet.encoding in (
+            peopleCodec.ENCODING_RLE, peopleCodec.ENCODING_SPARSE
+        )
+        assert packet.header.flags & APPUpdateMessage.encoding_mask
+        packet.header.sequence_number = 3
+        p2, _ = APPUpdateMessage.unpack(packet.pack())
+        assert p2.encoding == packet.encoding
+        assert p2.header.sequence_number == 3
+        assert [p.sitting for p in p2.people()] == [True] * 100
+        packet = APPUpdateMessage(
+            device_id=2, people=people, encoding=peopleCodec.ENCODING_RLE
+        )
+        assert packet.header.flags == Flag.RLE
+        assert format_data(packet.payload) == "01:64"
+        packet = APPUpdateMessage(
+            device_id=2, people=people[:3], encoding=peopleCodec.ENCODING_RAW
+        )
+        assert packet.header.flags == 0
+        assert format_data(packet.payload) == "0f"
+
+    def test_update_encoding_unknown(self):
+        packet = APPUpdateMessage(device_id=2, people=[Person()])
+        packet.header.flags |= Flag.RLE | Flag.SPARSE
+        assert packet.encoding is None
+        with pytest.raises(ProtocolViolation):
+            packet.people()
+        packet.header.flags = Flag.RLE
+        packet._payload = "\x02"
+        with pytest.raises(ProtocolViolation):
+            packet.people()
+
+
+@pytest.mark.parametrize("obj", [
+    APPHeader(),
+    APPMessage(message_type=MsgType.ACK),
+    APPDataMessage(),
+    APPJoinMessage(),
+    APPConfigMessage(),
+    APPUnjoinMessage(),
+    APPUpdateMessage(),
+    APPDeltaMessage(),
+    APPResyncMessage(),
+])
+def test_slots(obj):
+    """ Headers and messages do not have an instance dict """
+    assert not hasattr(obj, "__dict__")
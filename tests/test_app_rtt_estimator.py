@@ -0,0 +1,59 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "All rights reserved"
+__version__ = "0.1.0"
+__date__ = "2016-05-10"
+# Created: 2016-05-10 15:00
+
+import pytest
+
+from paps.si.app.rttEstimator import RTTEstimator
+
+
+class TestRTTEstimator(object):
+    """ Test RTTEstimator class """
+
+    def test_initial_rto(self):
+        rtt = RTTEstimator(initial_rto=1.5)
+        assert rtt.rto == 1.5
+        assert rtt.srtt is None
+        assert rtt.stats()['samples'] == 0
+
+    def test_first_sample(self):
+        rtt = RTTEstimator(min_rto=0.01)
+        rtt.update(0.1)
+        assert rtt.srtt == pytest.approx(0.1)
+        assert rtt.rttvar == pytest.approx(0.05)
+        assert rtt.rto == pytest.approx(0.3)
+
+    def test_smoothing(self):
+        rtt = RTTEstimator(min_rto=0.01)
+        rtt.update(0.1)
+        rtt.update(0.2)
+        # rttvar = 3/4 * 0.05 + 1/4 * 0.1, srtt = 7/8 * 0.1 + 1/8 * 0.2
+        assert rtt.rttvar == pytest.approx(0.0625)
+        assert rtt.srtt == pytest.approx(0.1125)
+        assert rtt.rto == pytest.approx(0.1125 + 4 * 0.0625)
+
+    def test_bounds(self):
+        rtt = RTTEstimator(min_rto=0.2, max_rto=2.0)
+        rtt.update(0.001)
+        assert rtt.rto == 0.2
+        rtt.update(10.0)
+        assert rtt.rto == 2.0
+
+    def test_backoff(self):
+        rtt = RTTEstimator(initial_rto=1.0, max_rto=5.0)
+        assert rtt.backoff(1) == 2.0
+        assert rtt.backoff(2) == 4.0
+        assert rtt.backoff(3) == 5.0
+        assert rtt.stats()['retransmits'] == 3
+        # Backoff does not change the estimation
+        assert rtt.rto == 1.0
@@ -0,0 +1,1039 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "All rights reserved"
+__version__ = "0.1.0"
+__date__ = "2016-05-04"
+# Created: 2016-05-04 14:20
+
+import logging
+import socket
+import threading
+import time
+
+import pytest
+
+from paps.si.app.message import Id, MsgType, \
+    APPHeader, APPMessage, APPDataMessage, APPJoinMessage, APPUnjoinMessage, \
+    APPUpdateMessage, APPDeltaMessage, APPResyncMessage, ProtocolViolation
+from paps.si.app import peopleCodec
+from paps.si.app.sensor import Sensor
+from paps.si.app.sensorClient import SensorClient
+from paps.si.app.sensorServer import SensorServer
+from paps.changeInterface import ChangeInterface
+from paps import Person
+
+logging.basicConfig(level=logging.DEBUG)
+
+
+def create_sensor(settings=None):
+    """ Sensor that does not need a local ip lookup """
+    if settings is None:
+        settings = {}
+    settings.setdefault('listen_bind_ip', "127.0.0.1")
+    settings.setdefault('multicast_bind_ip', "127.0.0.1")
+    settings.setdefault('initial_sequence_number', 0)
+    return Sensor(settings)
+
+
+class TestSensorUnpack(object):
+    """ Test Sensor._unpack/_unpack_from """
+
+    def setup(self):
+        self.sensor = create_sensor()
+
+    def test_unpack_dispatch(self):
+        data = APPUpdateMessage(
+            device_id=2, people=[Person(sitting=True)]
+        ).pack()
+        packet, rem = self.sensor._unpack(data + "rest")
+        assert isinstance(packet, APPUpdateMessage)
+        assert rem == "rest"
+        assert packet.people()[0].sitting
+
+    def test_unpack_from_consecutive(self):
+        data = APPDataMessage(device_id=Id.SERVER, payload={'a': 1}).pack() \
+            + APPMessage(message_type=MsgType.ACK).pack()
+        packet, offset = self.sensor._unpack_from(data)
+        assert isinstance(packet, APPDataMessage)
+        assert packet.payload == {'a': 1}
+        packet, offset = self.sensor._unpack_from(data, offset)
+        assert type(packet) is APPMessage
+        assert packet.header.message_type == MsgType.ACK
+        assert offset == len(data)
+
+    def test_unpack_truncated(self):
+        data = APPDataMessage(device_id=Id.SERVER, payload={'a': 1}).pack()
+        with pytest.raises(ProtocolViolation):
+            self.sensor._unpack(data[:-1])
+        with pytest.raises(ProtocolViolation):
+            self.sensor._unpack(data[:5])
+
+
+class TestSensorSend(object):
+    """ Test Sensor._send_packet """
+
+    def test_protocol_version_minor(self):
+        sensor = create_sensor({'protocol_version_minor': 1})
+        sent = []
+        sensor._send = lambda ip, port, data: sent.append(data)
+        sensor._send_packet(
+            "127.0.0.1", 2346, APPMessage(message_type=MsgType.ACK),
+            acknowledge_packet=False
+        )
+        head, rem = APPHeader.unpack(sent[0])
+        assert rem == ""
+        assert head.version == "1.1"
+
+
+class TestSensorCoalesce(object):
+    """ Test sending several messages in one datagram """
+
+    def setup(self):
+        self.sensor = create_sensor({
+            'coalesce_window': 0.01, 'coalesce_max_size': 100
+        })
+        self.sent = []
+        self.sensor._send = lambda ip, port, data: self.sent.append(
+            ((ip, port), data)
+        )
+
+    def send_ack(self, port, seq):
+        ack = APPMessage(message_type=MsgType.ACK)
+        ack.header.ack_sequence_number = seq
+        self.sensor._send_packet(
+            "127.0.0.1", port, ack, acknowledge_packet=False
+        )
+
+    def test_coalesce_same_peer(self):
+        for seq in range(3):
+            self.send_ack(2346, seq)
+        self.send_ack(2347, 9)
+        assert self.sent == []
+        assert len(self.sensor._timers) == 2
+        self.sensor._timers.run_pending(now=time.time() + 1)
+        assert len(self.sent) == 2
+        sent = dict(self.sent)
+        packets = self.sensor._handle_datagram(
+            "127.0.0.1", 2346, sent[("127.0.0.1", 2346)]
+        )
+        assert [p.header.ack_sequence_number for p in packets] == [0, 1, 2]
+        assert self.sensor.inbox.qsize() == 3
+        packets = self.sensor._handle_datagram(
+            "127.0.0.1", 2347, sent[("127.0.0.1", 2347)]
+        )
+        assert [p.header.ack_sequence_number for p in packets] == [9]
+
+    def test_coalesce_max_size(self):
+        # ACK: 16 bytes -> 6 fit into 100 bytes
+        for seq in range(7):
+            self.send_ack(2346, seq)
+        assert len(self.sent) == 1
+        assert len(self.sent[0][1]) == 96
+        self.sensor._flush_coalesced()
+        assert len(self.sent) == 2
+        assert len(self.sent[1][1]) == 16
+        # Timers of already sent messages do nothing
+        self.sensor._timers.run_pending(now=time.time() + 1)
+        assert len(self.sent) == 2
+
+    def test_coalesce_disabled(self):
+        self.sensor._coalesce_window = 0
+        self.send_ack(2346, 1)
+        self.send_ack(2346, 2)
+        assert len(self.sent) == 2
+        assert len(self.sensor._timers) == 0
+
+
+class TestSensorDelayedAck(object):
+    """ Test delayed and piggybacked acks """
+
+    def setup(self):
+        self.sensor = create_sensor({'ack_delay': 0.01})
+        self.sent = []
+        self.sensor._send = lambda ip, port, data: self.sent.append(data)
+
+    def receive(self, seqs, port=2346):
+        for seq in seqs:
+            packet = APPMessage(message_type=MsgType.ACK, device_id=2)
+            packet.header.sequence_number = seq
+            self.sensor._handle_datagram("127.0.0.1", port, packet.pack())
+
+    def test_ack_delayed(self):
+        self.receive([5, 6, 8])
+        assert self.sent == []
+        self.sensor._timers.run_pending(now=time.time() + 1)
+        assert len(self.sent) == 1
+        header, rem = APPHeader.unpack(self.sent[0])
+        assert rem == ""
+        assert header.message_type == MsgType.ACK
+        assert header.acked_sequence_numbers() == [5, 6, 8]
+
+    def test_ack_piggybacked(self):
+        self.receive([5, 6])
+        self.sensor._send_packet(
+            "127.0.0.1", 2346, APPDataMessage(payload={'a': 1}),
+            acknowledge_packet=False
+        )
+        assert len(self.sent) == 1
+        packet, rem = self.sensor._unpack(self.sent[0])
+        assert isinstance(packet, APPDataMessage)
+        assert packet.header.acked_sequence_numbers() == [5, 6]
+        # Nothing left to send
+        self.sensor._timers.run_pending(now=time.time() + 1)
+        assert len(self.sent) == 1
+
+    def test_ack_other_peer_not_piggybacked(self):
+        self.receive([5])
+        self.sensor._send_packet(
+            "127.0.0.1", 2347, APPDataMessage(payload={'a': 1})
+        )
+        packet, _ = self.sensor._unpack(self.sent[0])
+        assert packet.header.ack_sequence_number is None
+
+    def test_ack_too_far_apart(self):
+        self.receive([1, 40, 2])
+        self.sensor._timers.run_pending(now=time.time() + 1)
+        assert len(self.sent) == 2
+        acked = [
+            APPHeader.unpack(data)[0].acked_sequence_numbers()
+            for data in self.sent
+        ]
+        assert acked == [[1, 2], [40]]
+
+    def test_ack_mask_removes_waiting(self):
+        for seq in (3, 4, 7):
+            self.sensor._send_packet(
+                "127.0.0.1", 2346, APPDataMessage(payload=seq)
+            )
+        self.sent = []
+        ack = APPMessage(message_type=MsgType.ACK, device_id=2)
+        ack.header.ack_sequence_number = 0
+        ack.header.ack_mask = 0b0001
+        self.sensor._handle_datagram("127.0.0.1", 2346, ack.pack())
+        assert list(self.sensor._seq_ack) == [2]
+
+
+class TestSensorRetransmit(object):
+    """ Test retransmission of packets not acked in time """
+
+    def setup(self):
+        self.sensor = create_sensor({
+            'retransmit_timeout': 0.5, 'retransmit_max_tries': 2
+        })
+        self.sent = []
+        self.sensor._send = lambda ip, port, data: self.sent.append(data)
+
+    def ack(self, seq):
+        ack = APPMessage(message_type=MsgType.ACK, device_id=2)
+        ack.header.ack_sequence_number = seq
+        self.sensor._handle_datagram("127.0.0.1", 2346, ack.pack())
+
+    def test_retransmit_until_max_tries(self):
+        self.sensor._send_packet(
+            "127.0.0.1", 2346, APPDataMessage(payload={'a': 1})
+        )
+        now = time.time()
+        for i in range(1, 4):
+            self.sensor._timers.run_pending(now=now + i)
+        # Initial send + 2 retries
+        assert len(self.sent) == 3
+        assert self.sensor._seq_ack == {}
+        assert len(self.sensor._timers) == 0
+
+    def test_ack_cancels_retransmit(self):
+        for i in range(100):
+            self.sensor._send_packet(
+                "127.0.0.1", 2346, APPDataMessage(payload=i)
+            )
+        for seq in range(99):
+            self.ack(seq)
+        assert list(self.sensor._seq_ack) == [99]
+        assert len(self.sensor._timers) == 1
+        # Cancelled timers got removed from heap
+        assert len(self.sensor._timers._heap) < 64
+        self.sensor._timers.run_pending(now=time.time() + 0.6)
+        assert len(self.sent) > 100
+        for data in self.sent[100:]:
+            packet, _ = self.sensor._unpack(data)
+            assert packet.header.sequence_number == 99
+
+    def test_rtt_measured(self):
+        self.sensor._send_packet(
+            "127.0.0.1", 2346, APPDataMessage(payload={'a': 1})
+        )
+        self.ack(0)
+        stats = self.sensor.rtt_stats()[("127.0.0.1", 2346)]
+        assert stats['samples'] == 1
+        assert 0 <= stats['srtt'] < 0.5
+        # Bounded by retransmit_timeout_min
+        assert stats['rto'] == 0.2
+
+    def test_rtt_karn(self):
+        self.sensor._send_packet(
+            "127.0.0.1", 2346, APPDataMessage(payload={'a': 1})
+        )
+        now = time.time()
+        self.sensor._timers.run_pending(now=now + 0.6)
+        assert len(self.sent) == 2
+        # Next try after doubled timeout
+        assert self.sensor._timers.next_deadline() >= now + 1.0
+        self.ack(0)
+        stats = self.sensor.rtt_stats()[("127.0.0.1", 2346)]
+        assert stats['samples'] == 0
+        assert stats['retransmits'] == 1
+        assert stats['rto'] == 0.5
+        assert self.sensor._seq_ack == {}
+
+
+class TestSensorDuplicates(object):
+    """ Test suppression of duplicated sequenced packets """
+
+    def setup(self):
+        self.sensor = create_sensor()
+        self.sent = []
+        self.sensor._send = lambda ip, port, data: self.sent.append(data)
+
+    def test_duplicate_acked_not_delivered(self):
+        packet = APPDataMessage(device_id=2, payload={'a': 1})
+        packet.header.sequence_number = 7
+        data = packet.pack()
+        assert len(self.sensor._handle_datagram("127.0.0.1", 2346, data)) == 1
+        assert self.sensor._handle_datagram("127.0.0.1", 2346, data) == []
+        assert self.sensor.inbox.qsize() == 1
+        # Both got acked
+        assert len(self.sent) == 2
+        for ack in self.sent:
+            header, _ = APPHeader.unpack(ack)
+            assert header.ack_sequence_number == 7
+
+    def test_full_inbox_not_acked(self):
+        """ Dropped from a full inbox without an ack - sender retransmits """
+        sensor = create_sensor({'inbox_size': 1})
+        sensor._send = lambda ip, port, data: self.sent.append(data)
+        packets = []
+        for seq in (1, 2):
+            packet = APPDataMessage(device_id=2, payload={'a': seq})
+            packet.header.sequence_number = seq
+            packets.append(packet.pack())
+        sensor._handle_datagram("127.0.0.1", 2346, packets[0])
+        assert sensor._handle_datagram("127.0.0.1", 2346, packets[1]) == []
+        assert sensor.inbox.qsize() == 1
+        assert len(self.sent) == 1
+        # Duplicate still acked (ack got lost)
+        sensor._handle_datagram("127.0.0.1", 2346, packets[0])
+        assert len(self.sent) == 2
+        sensor.inbox.get()
+        # Retransmit
+        assert len(sensor._handle_datagram("127.0.0.1", 2346, packets[1])) == 1
+        assert sensor.inbox.get()[2].payload == {'a': 2}
+        acked = [APPHeader.unpack(ack)[0].ack_sequence_number
+                 for ack in self.sent]
+        assert acked == [1, 1, 2]
+
+    def test_same_seq_other_peer(self):
+        packet = APPDataMessage(device_id=2, payload={'a': 1})
+        packet.header.sequence_number = 7
+        data = packet.pack()
+        self.sensor._handle_datagram("127.0.0.1", 2346, data)
+        self.sensor._handle_datagram("127.0.0.1", 2347, data)
+        assert self.sensor.inbox.qsize() == 2
+
+    def test_random_initial_sequence_number(self):
+        seqs = set(
+            Sensor({
+                'listen_bind_ip': "127.0.0.1",
+                'multicast_bind_ip': "127.0.0.1"
+            })._send_seq_num for _ in range(5)
+        )
+        assert len(seqs) > 1
+
+    def test_sequence_number_wraps(self):
+        sensor = create_sensor({'initial_sequence_number': 0xffffffff})
+        sensor._send = lambda ip, port, data: self.sent.append(data)
+        for _ in range(2):
+            sensor._send_packet(
+                "127.0.0.1", 2346, APPDataMessage(payload=1)
+            )
+        seqs = [APPHeader.unpack(d)[0].sequence_number for d in self.sent]
+        assert seqs == [0xffffffff, 0]
+
+
+class TestSensorReceive(object):
+    """ Test draining sockets into the receive buffer """
+
+    def setup(self):
+        self.sensor = create_sensor()
+        self.sensor._send = lambda ip, port, data: None
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(("127.0.0.1", 0))
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def teardown(self):
+        self.receiver.close()
+        self.sender.close()
+
+    def _send(self, data):
+        self.sender.sendto(data, self.receiver.getsockname())
+
+    def _wait_readable(self):
+        # Give the loopback a moment to deliver everything
+        time.sleep(0.05)
+
+    def test_drains_all_datagrams(self):
+        for i in range(5):
+            self._send(APPDataMessage(device_id=2, payload=i).pack())
+        self._wait_readable()
+        packets = self.sensor._get_packet(self.receiver)
+        assert [p.payload for p in packets] == list(range(5))
+        assert self.sensor.inbox.qsize() == 5
+
+    def test_drain_max(self):
+        self.sensor._receive_drain_max = 2
+        for i in range(3):
+            self._send(APPDataMessage(device_id=2, payload=i).pack())
+        self._wait_readable()
+        assert len(self.sensor._get_packet(self.receiver)) == 2
+        assert len(self.sensor._get_packet(self.receiver)) == 1
+
+    def test_payload_copied_from_buffer(self):
+        self._send(APPDataMessage(device_id=2, payload={'a': 1}).pack())
+        self._wait_readable()
+        packet, = self.sensor._get_packet(self.receiver)
+        assert isinstance(packet.raw_payload, bytes)
+        # Reusing the buffer does not change received packet
+        self._send(APPDataMessage(device_id=2, payload={'b': 2}).pack())
+        self._wait_readable()
+        self.sensor._get_packet(self.receiver)
+        assert packet.payload == {'a': 1}
+
+    def test_invalid_datagram_does_not_stop_drain(self):
+        self._send(b"\x01\x02")
+        self._send(APPDataMessage(device_id=2, payload=1).pack())
+        self._wait_readable()
+        packets = self.sensor._get_packet(self.receiver)
+        assert [p.payload for p in packets] == [1]
+
+
+class TestSensorDispatch(object):
+    """ Test queued and inline packet dispatch """
+
+    def test_queue_default(self):
+        sensor = create_sensor()
+        sensor._send = lambda ip, port, data: None
+        sensor._handle_datagram(
+            "127.0.0.1", 2346, APPDataMessage(device_id=2, payload=1).pack()
+        )
+        assert sensor.inbox.qsize() == 1
+
+    def test_inline(self):
+        sensor = create_sensor({'dispatch_mode': "inline"})
+        sensor._send = lambda ip, port, data: None
+        handled = []
+        sensor._do_packet = lambda packet, ip, port: handled.append(
+            (packet.payload, ip, port)
+        )
+        sensor._handle_datagram(
+            "127.0.0.1", 2346, APPDataMessage(device_id=2, payload=1).pack()
+        )
+        assert handled == [(1, "127.0.0.1", 2346)]
+        assert sensor.inbox.empty()
+
+    def test_inline_failing_handler(self):
+        sensor = create_sensor({'dispatch_mode': "inline"})
+        sensor._send = lambda ip, port, data: None
+
+        def fail(packet, ip, port):
+            raise RuntimeError("Handler failed")
+        sensor._do_packet = fail
+        data = APPDataMessage(device_id=2, payload=1).pack()
+        assert len(sensor._handle_datagram("127.0.0.1", 2346, data)) == 1
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            create_sensor({'dispatch_mode': "threads"})
+
+
+class NullChanger(ChangeInterface):
+    """ Ignore person events """
+
+    def on_person_new(self, people):
+        pass
+
+    def on_person_update(self, people):
+        pass
+
+    def on_person_leave(self, people):
+        pass
+
+
+class TestSensorStop(object):
+    """ Test stopping without waiting for timeouts """
+
+    def test_sensor_stop(self):
+        sensor = create_sensor({'listen_port': 0})
+        sensor.start()
+        threads = list(sensor._threads)
+        assert len(threads) == 2
+        start = time.time()
+        sensor.stop()
+        assert time.time() - start < 0.5
+        assert not any(t.is_alive() for t in threads)
+        assert sensor._wakeup_sockets is None
+
+    def test_stop_during_timer(self):
+        """ Stop while the timer thread runs a callback (not waiting) """
+        sensor = create_sensor({'listen_port': 0})
+        sensor.start()
+        running = threading.Event()
+        release = threading.Event()
+
+        def callback():
+            running.set()
+            release.wait(1.0)
+
+        sensor._schedule(0, callback)
+        assert running.wait(1.0)
+        threads = list(sensor._threads)
+        stopper = threading.Thread(target=sensor.stop)
+        start = time.time()
+        stopper.start()
+        # stop() woke the timers before the callback returned
+        time.sleep(0.1)
+        release.set()
+        stopper.join(5.0)
+        assert time.time() - start < 1.0
+        assert not any(t.is_alive() for t in threads)
+
+    def test_server_client_stop(self):
+        server = SensorServer({
+            'changer': NullChanger(),
+            'listen_bind_ip': "127.0.0.1",
+            'listen_port': 0,
+            'multicast_bind_ip': "127.0.0.1",
+            'multicast_bind_port': 0,
+        })
+        server.start()
+        client = SensorClient({
+            'listen_bind_ip': "127.0.0.1",
+            'listen_port': 0,
+            'multicast_bind_ip': "127.0.0.1",
+            'multicast_group': "127.0.0.1",
+            'multicast_port': server._listen_socket.getsockname()[1],
+        })
+        client.start()
+        threads = list(server._threads) + list(client._threads)
+        assert len(threads) == 6
+        try:
+            client.join([Person(id=1)])
+        finally:
+            start = time.time()
+            # Waits for unjoin to be acked
+            client.stop()
+            server.stop()
+            assert time.time() - start < 1.0
+        assert not any(t.is_alive() for t in threads)
+        assert not server._clients
+
+
+class TestSensorServerClients(object):
+    """ Test device id and address bookkeeping of server """
+
+    def setup(self):
+        self.server = SensorServer({
+            'changer': NullChanger(),
+            'listen_bind_ip': "127.0.0.1",
+            'multicast_bind_ip': "127.0.0.1",
+        })
+        self.sent = []
+        self.server._send_packet = lambda ip, port, packet, **kwargs: \
+            self.sent.append(packet)
+
+    def join(self, port, device_id=Id.REQUEST):
+        self.server._do_packet(APPJoinMessage(
+            device_id=device_id,
+            payload={'people': [{'id': 1, 'sitting': False}]}
+        ), "127.0.0.1", port)
+        return self.sent[-1].payload['device_id']
+
+    def unjoin(self, port, device_id):
+        self.server._do_packet(
+            APPUnjoinMessage(device_id=device_id), "127.0.0.1", port
+        )
+
+    def test_join_allocates(self):
+        assert self.join(2346) == Id.SERVER + 1
+        assert self.join(2347) == Id.SERVER + 2
+        assert self.sent[-1].payload['key'] == "127.0.0.1:2347"
+        # Same address keeps id
+        assert self.join(2346) == Id.SERVER + 1
+        assert len(self.server._clients) == 2
+
+    def test_unjoin_recycles(self):
+        first = self.join(2346)
+        self.join(2347)
+        self.unjoin(2346, first)
+        assert first not in self.server._clients
+        assert self.server._clients.device_id(("127.0.0.1", 2346)) is None
+        assert self.join(2348) == first
+
+    def test_wrong_address_rejected(self):
+        device_id = self.join(2346)
+        self.unjoin(2347, device_id)
+        assert device_id in self.server._clients
+
+    def test_rejoin_with_id(self):
+        self.join(2346, device_id=5)
+        assert 5 in self.server._clients
+        # Rejoin from new address
+        self.join(2347, device_id=5)
+        assert self.server._clients.device_id(("127.0.0.1", 2346)) is None
+        assert self.server._clients.device_id(("127.0.0.1", 2347)) == 5
+        assert self.join(2348) == Id.SERVER + 1
+
+    def test_peer_state_pruned(self):
+        """ Sequence window and rtt of a client dropped when it leaves """
+        def join(port, device_id):
+            packet = APPJoinMessage(
+                device_id=device_id,
+                payload={'people': [{'id': 1, 'sitting': False}]}
+            )
+            packet.header.sequence_number = 1
+            self.server._handle_packet("127.0.0.1", port, packet)
+            self.server._get_rtt("127.0.0.1", port)
+            self.server._do_packet(packet, "127.0.0.1", port)
+
+        join(2346, 5)
+        assert ("127.0.0.1", 2346) in self.server._seq_windows
+        # Rejoin from new address
+        join(2347, 5)
+        assert ("127.0.0.1", 2346) not in self.server._seq_windows
+        assert ("127.0.0.1", 2346) not in self.server.rtt_stats()
+        assert ("127.0.0.1", 2347) in self.server._seq_windows
+        self.unjoin(2347, 5)
+        assert not self.server._seq_windows
+        assert not self.server.rtt_stats()
+
+    def test_delta(self):
+        updates = []
+        self.server.changer.on_person_update = updates.append
+        self.server._do_packet(APPJoinMessage(payload={'people': [
+            {'id': index, 'sitting': False} for index in range(3)
+        ]}), "127.0.0.1", 2346)
+        device_id = self.sent[-1].payload['device_id']
+        baseline = APPUpdateMessage(device_id=device_id, people=[
+            Person(sitting=True), Person(), Person()
+        ])
+        baseline.header.sequence_number = 5
+        self.server._do_packet(baseline, "127.0.0.1", 2346)
+        assert len(updates) == 1
+        self.server._do_packet(APPDeltaMessage(
+            device_id=device_id, baseline=5, indices=[0, 2]
+        ), "127.0.0.1", 2346)
+        assert [p.to_tuple() for p in updates[-1]] == [
+            (u"{}.0".format(device_id), False),
+            (u"{}.2".format(device_id), True),
+        ]
+        sent = len(self.sent)
+        self.server._do_packet(APPDeltaMessage(
+            device_id=device_id, baseline=4, indices=[1]
+        ), "127.0.0.1", 2346)
+        assert len(updates) == 2
+        assert len(self.sent) == sent + 1
+        assert isinstance(self.sent[-1], APPResyncMessage)
+        # Index out of range
+        self.server._do_packet(APPDeltaMessage(
+            device_id=device_id, baseline=5, indices=[3]
+        ), "127.0.0.1", 2346)
+        assert len(updates) == 2
+        assert len(self.sent) == sent + 1
+
+    def test_late_baseline_ignored(self):
+        """ Baseline retransmit arriving after a newer one is outdated """
+        updates = []
+        self.server.changer.on_person_update = updates.append
+        self.server._do_packet(APPJoinMessage(payload={'people': [
+            {'id': index, 'sitting': False} for index in range(3)
+        ]}), "127.0.0.1", 2346)
+        device_id = self.sent[-1].payload['device_id']
+        first = APPUpdateMessage(device_id=device_id, people=[
+            Person(sitting=True), Person(), Person()
+        ])
+        first.header.sequence_number = 1
+        second = APPUpdateMessage(device_id=device_id, people=[
+            Person(sitting=True), Person(sitting=True), Person()
+        ])
+        second.header.sequence_number = 2
+        # First one lost - retransmit arrives after second one
+        self.server._do_packet(second, "127.0.0.1", 2346)
+        self.server._do_packet(first, "127.0.0.1", 2346)
+        assert len(updates) == 1
+        assert list(self.server._clients.get(device_id).seats) == [1, 1, 0]
+        sent = len(self.sent)
+        self.server._do_packet(APPDeltaMessage(
+            device_id=device_id, baseline=2, indices=[2]
+        ), "127.0.0.1", 2346)
+        assert len(self.sent) == sent
+        assert [p.sitting for p in updates[-1]] == [True]
+
+    def test_update_encodings(self):
+        updates = []
+        self.server.changer.on_person_update = updates.append
+        self.server._do_packet(APPJoinMessage(payload={'people': [
+            {'id': index, 'sitting': False} for index in range(40)
+        ]}), "127.0.0.1", 2346)
+        device_id = self.sent[-1].payload['device_id']
+        seats = [Person(sitting=True) for _ in range(40)]
+        for encoding in (
+            peopleCodec.ENCODING_RLE, peopleCodec.ENCODING_RAW,
+            peopleCodec.ENCODING_SPARSE
+        ):
+            self.server._do_packet(APPUpdateMessage(
+                device_id=device_id, people=seats, encoding=encoding
+            ), "127.0.0.1", 2346)
+            seats[len(updates)] = Person()
+        assert [len(people) for people in updates] == [40, 1, 1]
+        assert [p.sitting for p in updates[1] + updates[2]] == [False] * 2
+        assert list(self.server._clients.get(device_id).seats) == \
+            [1, 0, 0] + [1] * 37
+
+    def test_join_server_id_rejected(self):
+        sent = len(self.sent)
+        self.server._do_packet(APPJoinMessage(
+            device_id=Id.SERVER, payload={'people': []}
+        ), "127.0.0.1", 2346)
+        assert len(self.sent) == sent
+        assert not self.server._clients
+
+    def test_update_changed_only(self):
+        updates = []
+        self.server.changer.on_person_update = updates.append
+        self.server._do_packet(APPJoinMessage(payload={'people': [
+            {'id': 1, 'sitting': False}, {'id': 2, 'sitting': True}
+        ]}), "127.0.0.1", 2346)
+        device_id = self.sent[-1].payload['device_id']
+        update = APPUpdateMessage(device_id=device_id, people=[
+            Person(sitting=True), Person(sitting=True)
+        ])
+        self.server._do_packet(update, "127.0.0.1", 2346)
+        self.server._do_packet(update, "127.0.0.1", 2346)
+        assert len(updates) == 1
+        assert [p.to_tuple() for p in updates[0]] == [
+            (u"{}.1".format(device_id), True)
+        ]
+        # Other address ignored
+        self.server._do_packet(APPUpdateMessage(
+            device_id=device_id, people=[Person(), Person()]
+        ), "127.0.0.1", 2347)
+        assert len(updates) == 1
+
+
+class TestSensorClientUpdate(object):
+    """ Test duplicate suppression, rate limit and keepalive of updates """
+
+    def create(self, settings):
+        settings.update({
+            'listen_bind_ip': "127.0.0.1",
+            'multicast_bind_ip': "127.0.0.1",
+        })
+        client = SensorClient(settings)
+        client._is_running = True
+        client._joined.set()
+        self.sent = []
+        self.timers = []
+        client._send_packet = lambda ip, port, packet, **kwargs: \
+            self.sent.append([p.sitting for p in packet.people()])
+        client._schedule = lambda delay, callback, *args: \
+            self.timers.append((delay, callback)) or len(self.timers)
+        client._cancel = lambda timer: None
+        return client
+
+    def fire(self):
+        timers, self.timers = self.timers, []
+        for _, callback in timers:
+            callback()
+
+    def test_duplicates_suppressed(self):
+        client = self.create({'update_keepalive': 0})
+        client.person_update([Person(sitting=True)])
+        client.person_update([Person(sitting=True)])
+        client.person_update([Person(sitting=False)])
+        assert self.sent == [[True], [False]]
+        assert not self.timers
+
+    def test_duplicates_sent(self):
+        client = self.create({
+            'update_keepalive': 0, 'update_suppress_duplicates': False
+        })
+        client.person_update([Person(sitting=True)])
+        client.person_update([Person(sitting=True)])
+        assert self.sent == [[True], [True]]
+
+    def test_rate_limit_sends_latest(self):
+        client = self.create({
+            'update_keepalive': 0, 'update_min_interval': 10
+        })
+        client.person_update([Person(sitting=True)])
+        client.person_update([Person(sitting=False)])
+        client.person_update([Person(sitting=True)])
+        client.person_update([Person(sitting=False)])
+        assert self.sent == [[True]]
+        assert len(self.timers) == 1
+        assert 9 < self.timers[0][0] <= 10
+        self.fire()
+        assert self.sent == [[True], [False]]
+
+    def test_rate_limit_burst_back_to_sent_state(self):
+        client = self.create({
+            'update_keepalive': 0, 'update_min_interval': 10
+        })
+        client.person_update([Person(sitting=True)])
+        client.person_update([Person(sitting=False)])
+        client.person_update([Person(sitting=True)])
+        self.fire()
+        assert self.sent == [[True]]
+
+    def test_keepalive(self):
+        client = self.create({'update_keepalive': 0.01})
+        client.person_update([Person(sitting=True)])
+        assert [delay for delay, _ in self.timers] == [0.01]
+        time.sleep(0.02)
+        self.fire()
+        assert self.sent == [[True], [True]]
+        # Next keepalive scheduled
+        assert len(self.timers) == 1
+
+    def test_keepalive_postponed(self):
+        client = self.create({'update_keepalive': 10})
+        client.person_update([Person(sitting=True)])
+        self.fire()
+        assert self.sent == [[True]]
+        assert len(self.timers) == 1
+        assert self.timers[0][0] <= 10
+
+    def test_keepalive_stops_after_unjoin(self):
+        client = self.create({'update_keepalive': 0.01})
+        client.person_update([Person(sitting=True)])
+        client._joined.clear()
+        time.sleep(0.02)
+        self.fire()
+        assert self.sent == [[True]]
+        assert not self.timers
+
+    def test_join_resets(self):
+        client = self.create({'update_keepalive': 0})
+        client.person_update([Person(sitting=True)])
+        client._update_reset()
+        client.person_update([Person(sitting=True)])
+        assert self.sent == [[True], [True]]
+
+    @pytest.mark.parametrize("setting, encoding", [
+        ({}, peopleCodec.ENCODING_RAW),
+        ({'update_encoding': "auto"}, peopleCodec.ENCODING_RLE),
+        ({'update_encoding': "sparse"}, peopleCodec.ENCODING_SPARSE),
+    ])
+    def test_encoding(self, setting, encoding):
+        """ Bitmap unless enabled (older servers ignore encoding flags) """
+        setting['update_keepalive'] = 0
+        client = self.create(setting)
+        packets = []
+        client._send_packet = lambda ip, port, packet, **kwargs: \
+            packets.append(packet)
+        client.person_update([Person(sitting=True) for _ in range(100)])
+        assert packets[-1].encoding == encoding
+        assert [p.sitting for p in packets[-1].people()] == [True] * 100
+
+    def create_delta(self, settings):
+        settings.setdefault('update_keepalive', 0)
+        settings['update_delta'] = True
+        client = self.create(settings)
+        self.packets = []
+        self.seq = 0
+
+        def send(ip, port, packet, acknowledge_packet=True, **kwargs):
+            if acknowledge_packet:
+                self.seq += 1
+                packet.header.sequence_number = self.seq
+            self.packets.append(packet)
+
+        client._send_packet = send
+        return client
+
+    def ack(self, client, seq):
+        client._packet_acked(seq, (None, None, None), time.time())
+
+    @staticmethod
+    def mixed(number):
+        # Mixed tail - bitmap UPDATE smaller than run-length/sparse one
+        return [
+            Person(sitting=index >= number * 0.6 and index % 2 == 1)
+            for index in range(number)
+        ]
+
+    def test_delta_after_baseline_acked(self):
+        client = self.create_delta({})
+        seats = self.mixed(100)
+        client.person_update(seats)
+        keyframe = self.packets[-1]
+        assert keyframe.header.message_type == MsgType.UPDATE
+        assert keyframe.header.sequence_number == 1
+        seats[3] = Person(sitting=True)
+        client.person_update(seats)
+        # Not acked yet -> another baseline
+        assert self.packets[-1].header.message_type == MsgType.UPDATE
+        self.ack(client, 2)
+        seats[50] = Person(sitting=True)
+        client.person_update(seats)
+        delta = self.packets[-1]
+        assert delta.header.message_type == MsgType.DELTA
+        assert delta.header.sequence_number is None
+        assert delta.baseline() == 2
+        assert delta.indices() == (50,)
+        seats[3] = Person()
+        client.person_update(seats)
+        assert self.packets[-1].indices() == (3, 50)
+
+    def test_superseded_baseline(self):
+        """ Only newest baseline retransmitted - older acks still taken """
+        client = self.create_delta({})
+        send = client._send_packet
+
+        def send_waiting(ip, port, packet, acknowledge_packet=True, **kw):
+            send(ip, port, packet, acknowledge_packet, **kw)
+            if acknowledge_packet:
+                client._seq_ack[self.seq] = ("timer", time.time(), None)
+
+        client._send_packet = send_waiting
+        seats = self.mixed(100)
+        client.person_update(seats)
+        first = bytearray(peopleCodec.people_to_bits(seats))
+        seats[3] = Person(sitting=True)
+        client.person_update(seats)
+        seats[5] = Person(sitting=True)
+        client.person_update(seats)
+        assert [w[0] for _, w in sorted(client._seq_ack.items())] == \
+            [None, None, "timer"]
+        # Faster than a round trip - first ack still makes a baseline
+        self.ack(client, 1)
+        assert client._delta_baseline[:2] == (1, first)
+        assert len(client._delta_pending) == 2
+        self.ack(client, 3)
+        assert client._delta_baseline[0] == 3
+        # Second one superseded - forgotten
+        assert not client._delta_pending
+        assert 2 not in client._seq_ack
+        seats[7] = Person(sitting=True)
+        client.person_update(seats)
+        assert self.packets[-1].baseline() == 3
+        assert self.packets[-1].indices() == (7,)
+
+    def test_delta_keyframe_interval(self):
+        client = self.create_delta({'delta_keyframe_interval': 2})
+        seats = self.mixed(100)
+        client.person_update(seats)
+        self.ack(client, 1)
+        types = []
+        for index in range(4):
+            seats[index] = Person(sitting=True)
+            client.person_update(seats)
+            types.append(self.packets[-1].header.message_type)
+        assert types == [
+            MsgType.DELTA, MsgType.DELTA, MsgType.UPDATE, MsgType.DELTA
+        ]
+
+    def test_delta_bigger_than_update(self):
+        client = self.create_delta({})
+        client.person_update([Person() for _ in range(16)])
+        self.ack(client, 1)
+        client.person_update([Person(sitting=True)] + [Person()] * 15)
+        assert self.packets[-1].header.message_type == MsgType.UPDATE
+
+    def test_resync(self):
+        client = self.create_delta({})
+        seats = self.mixed(100)
+        client.person_update(seats)
+        resync = APPResyncMessage(device_id=Id.SERVER)
+        # Baseline still pending
+        client._do_packet(resync, "127.0.0.1", 2345)
+        assert len(self.packets) == 1
+        self.ack(client, 1)
+        client._do_packet(resync, "127.0.0.1", 2345)
+        assert len(self.packets) == 2
+        assert self.packets[-1].header.message_type == MsgType.UPDATE
+        assert self.packets[-1].header.sequence_number == 2
+        # Only from server
+        self.ack(client, 2)
+        client._do_packet(APPResyncMessage(device_id=5), "127.0.0.1", 2345)
+        assert len(self.packets) == 2
+
+
+class TestSensorDeltaLoopback(object):
+    """ Test DELTA updates between server and client """
+
+    def test_server_follows_deltas(self):
+        updates = []
+        changer = NullChanger()
+        changer.on_person_update = updates.extend
+        server = SensorServer({
+            'changer': changer,
+            'listen_bind_ip': "127.0.0.1",
+            'listen_port': 0,
+            'multicast_bind_ip': "127.0.0.1",
+            'multicast_bind_port': 0,
+            'receive_buffer_size': 65507,
+        })
+        server.start()
+        client = SensorClient({
+            'listen_bind_ip': "127.0.0.1",
+            'listen_port': 0,
+            'multicast_bind_ip': "127.0.0.1",
+            'multicast_group': "127.0.0.1",
+            'multicast_port': server._listen_socket.getsockname()[1],
+            'update_delta': True,
+        })
+        client.start()
+        people = [
+            Person(id=index, sitting=person.sitting)
+            for index, person in enumerate(TestSensorClientUpdate.mixed(200))
+        ]
+        try:
+            client.join(people)
+            sent = []
+            send_packet = client._send_packet
+            client._send_packet = lambda ip, port, packet, **kwargs: \
+                sent.append(packet.header.message_type) or \
+                send_packet(ip, port, packet, **kwargs)
+            for number, index in enumerate((5, 17, 5, 150)):
+                people[index] = Person(
+                    id=index, sitting=not people[index].sitting
+                )
+                client.person_update(people)
+                end = time.time() + 2.0
+                # Baseline acked and update handled
+                while time.time() < end and (
+                    client._delta_baseline is None
+                    or len(updates) <= number
+                ):
+                    time.sleep(0.01)
+        finally:
+            client.stop()
+            server.stop()
+        # Ignore acks/unjoin
+        sent = [
+            msg_type for msg_type in sent
+            if msg_type in (MsgType.UPDATE, MsgType.DELTA)
+        ]
+        assert sent == [MsgType.UPDATE] + [MsgType.DELTA] * 3
+        device_id = client._device_id
+        assert [(p.id, p.sitting) for p in updates] == [
+            (u"{}.5".format(device_id), True),
+            (u"{}.17".format(device_id), True),
+            (u"{}.5".format(device_id), False),
+            (u"{}.150".format(device_id), True),
+        ]
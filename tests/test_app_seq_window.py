@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "All rights reserved"
+__version__ = "0.1.0"
+__date__ = "2016-05-11"
+# Created: 2016-05-11 10:40
+
+import pytest
+
+from paps.si.app.seqWindow import SequenceWindow, SEQ_MASK, seq_after
+
+
+class TestSequenceWindow(object):
+    """ Test SequenceWindow class """
+
+    def test_duplicates(self):
+        window = SequenceWindow(size=8)
+        assert window.add(5)
+        assert not window.add(5)
+        assert window.add(7)
+        assert window.add(6)
+        assert not window.add(6)
+        assert not window.add(7)
+        assert 5 in window
+        assert 4 not in window
+
+    def test_out_of_order(self):
+        window = SequenceWindow(size=8)
+        for seq in (3, 1, 2, 0):
+            assert window.add(seq)
+        for seq in range(4):
+            assert not window.add(seq)
+
+    def test_slides(self):
+        window = SequenceWindow(size=8)
+        window.add(0)
+        assert window.add(7)
+        assert 0 in window
+        assert window.add(8)
+        assert 0 not in window
+        assert 1 not in window
+
+    @pytest.mark.parametrize("start", [SEQ_MASK - 3, SEQ_MASK])
+    def test_wrap_around(self, start):
+        window = SequenceWindow(size=16)
+        seqs = [(start + i) & SEQ_MASK for i in range(10)]
+        for seq in seqs:
+            assert window.add(seq)
+        for seq in seqs:
+            assert not window.add(seq)
+            assert seq in window
+
+    def test_far_behind_restarts(self):
+        window = SequenceWindow(size=8)
+        window.add(1000)
+        # Peer restarted with lower sequence numbers
+        assert window.add(3)
+        assert not window.add(3)
+        assert 1000 not in window
+
+    def test_big_jump(self):
+        window = SequenceWindow(size=8)
+        window.add(1)
+        assert window.add(1 + 100)
+        assert 1 not in window
+        assert not window.add(101)
+
+
+@pytest.mark.parametrize("seq, other, after", [
+    (2, 1, True),
+    (1, 2, False),
+    (1, 1, False),
+    (0, SEQ_MASK, True),
+    (SEQ_MASK, 0, False),
+])
+def test_seq_after(seq, other, after):
+    assert seq_after(seq, other) == after
@@ -0,0 +1,121 @@
+# -*- coding: UTF-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+# from __future__ import unicode_literals
+
+__author__ = "d01"
+__email__ = "jungflor@gmail.com"
+__copyright__ = "Copyright (C) 2016, Florian JUNG"
+__license__ = "All rights reserved"
+__version__ = "0.1.0"
+__date__ = "2016-05-09"
+# Created: 2016-05-09 11:30
+
+import threading
+import time
+
+import pytest
+
+from paps.si.app.timerQueue import TimerQueue
+
+
+class TestTimerQueue(object):
+    """ Test TimerQueue class """
+
+    def setup(self):
+        self.timers = TimerQueue()
+        self.called = []
+
+    def callback(self, *args):
+        self.called.append(args)
+
+    def test_run_pending_order(self):
+        self.timers.schedule(0.3, self.callback, 3)
+        self.timers.schedule(0.1, self.callback, 1)
+        self.timers.schedule(0.2, self.callback, 2, "b")
+        now = time.time()
+        assert self.timers.run_pending(now) == 0
+        assert self.timers.run_pending(now + 0.25) == 2
+        assert self.called == [(1,), (2, "b")]
+        assert len(self.timers) == 1
+        assert self.timers.run_pending(now + 1) == 1
+        assert self.called[-1] == (3,)
+        assert self.timers.next_deadline() is None
+
+    def test_same_deadline_keeps_order(self):
+        for i in range(5):
+            self.timers.schedule(0, self.callback, i)
+        self.timers.run_pending(time.time() + 1)
+        assert self.called == [(i,) for i in range(5)]
+
+    def test_raising_callback(self):
+        def fail():
+            raise ValueError("fail")
+        self.timers.schedule(0, fail)
+        self.timers.schedule(0, self.callback, 1)
+        with pytest.raises(ValueError):
+            self.timers.run_pending(time.time() + 1)
+        assert self.timers.run_pending(time.time() + 1) == 1
+        assert self.called == [(1,)]
+
+    def test_wait_until_due(self):
+        self.timers.schedule(0.05, self.callback)
+        start = time.time()
+        self.timers.wait(5)
+        assert time.time() - start < 1
+
+    def test_wait_without_timeout(self):
+        self.timers.schedule(0.05, self.callback)
+        start = time.time()
+        self.timers.wait()
+        assert time.time() - start < 1
+
+    def test_wake(self):
+        waker = threading.Timer(0.05, self.timers.wake)
+        waker.start()
+        start = time.time()
+        self.timers.wait()
+        assert time.time() - start < 1
+        waker.join()
+
+    def test_wake_before_wait(self):
+        """ Wake while not waiting is not lost """
+        self.timers.schedule(10, self.callback)
+        self.timers.wake()
+        start = time.time()
+        self.timers.wait()
+        assert time.time() - start < 1
+        # Only one wait() returns
+        start = time.time()
+        self.timers.wait(0.05)
+        assert time.time() - start >= 0.04
+
+    def test_cancel(self):
+        timer = self.timers.schedule(0, self.callback, 1)
+        self.timers.schedule(0, self.callback, 2)
+        assert timer.active
+        assert self.timers.cancel(timer)
+        assert not timer.active
+        assert not self.timers.cancel(timer)
+        assert len(self.timers) == 1
+        self.timers.run_pending(time.time() + 1)
+        assert self.called == [(2,)]
+        assert self.timers.next_deadline() is None
+
+    def test_cancel_run_timer(self):
+        timer = self.timers.schedule(0, self.callback, 1)
+        self.timers.run_pending(time.time() + 1)
+        assert not self.timers.cancel(timer)
+        assert len(self.timers) == 0
+
+    def test_cancel_compacts(self):
+        timers = [
+            self.timers.schedule(i, self.callback, i) for i in range(1000)
+        ]
+        for timer in timers[:-1]:
+            self.timers.cancel(timer)
+        assert len(self.timers) == 1
+        assert len(self.timers._heap) <= 2 * TimerQueue.COMPACT_MIN
+        self.timers.run_pending(time.time() + 2000)
+        assert self.called == [(999,)]
@@ -167,3 +167,9 @@ class TestPerson(object):
     def test_unicode(self):
         p = Person(id=u"3\xA9", sitting=True)
         assert u"{}".format(p) == u"<Person>(3\xA9; Sitting:True)"
+
+    def test_slots(self):
+        p = Person("h", True)
+        assert not hasattr(p, "__dict__")
+        with pytest.raises(AttributeError):
+            p.unknown = 1